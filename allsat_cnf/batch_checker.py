@@ -0,0 +1,142 @@
+import pysmt.operators as op
+import numpy as np
+from pysmt.fnode import FNode
+from pysmt.typing import BOOL
+
+from allsat_cnf.packed_models import PackedModels
+
+_WORD_BITS = 64
+
+
+class BooleanBatchChecker:
+    """Evaluates a Boolean formula on a batch of partial assignments, using three-valued logic.
+
+    The formula DAG is compiled once into a list of gates in topological order. Each gate is then evaluated on
+    a chunk of assignments at once: its value is represented by two bitsets over the assignments of the chunk,
+    telling whether the gate is TRUE or FALSE under each assignment (neither of them if it is unknown).
+    """
+
+    def __init__(self, formula: FNode, chunk_size: int = 1 << 14):
+        if chunk_size % 8 != 0:
+            raise ValueError("The chunk size must be a multiple of 8")
+        self.formula = formula
+        self.chunk_size = chunk_size
+        self.atoms: list[FNode] = []
+        self._atom_index: dict[FNode, int] = {}
+        # gates in topological order, as (node type, indices of the children, atom index or constant value)
+        self._gates: list[tuple[int, tuple[int, ...], int | bool | None]] = []
+        # for each gate, the index of the last gate using it
+        self._last_use: list[int] = []
+        self._compile(formula)
+
+    @staticmethod
+    def supports(formula: FNode) -> bool:
+        """Checks whether the formula is purely Boolean, i.e. its atoms are all Boolean variables."""
+        return all(a.is_symbol(BOOL) or a.is_bool_constant() for a in formula.get_atoms())
+
+    def _compile(self, formula: FNode):
+        gate_index: dict[FNode, int] = {}
+        stack = [(False, formula)]
+        while stack:
+            was_expanded, f = stack.pop()
+            if f in gate_index:
+                continue
+            if not was_expanded and not f.is_symbol() and not f.is_bool_constant():
+                self._check_supported(f)
+                stack.append((True, f))
+                stack.extend((False, a) for a in f.args() if a not in gate_index)
+                continue
+
+            args = tuple(gate_index[a] for a in f.args())
+            if f.is_symbol():
+                if not f.is_symbol(BOOL):
+                    raise ValueError("Only Boolean formulas are supported, found {}".format(f))
+                payload = len(self.atoms)
+                self._atom_index[f] = payload
+                self.atoms.append(f)
+            elif f.is_bool_constant():
+                payload = f.is_true()
+            else:
+                payload = None
+            gate_index[f] = len(self._gates)
+            self._gates.append((f.node_type(), args, payload))
+            self._last_use.append(-1)
+            for a in args:
+                self._last_use[a] = len(self._gates) - 1
+
+    def _check_supported(self, formula: FNode):
+        if formula.node_type() not in (op.NOT, op.AND, op.OR, op.IMPLIES, op.IFF, op.ITE):
+            raise ValueError("Only Boolean formulas are supported, found {}".format(formula))
+
+    def pack(self, models) -> PackedModels:
+        """Packs a list of assignments over the atoms of the formula, ignoring the literals of other atoms."""
+        packed = PackedModels(self.atoms, capacity=len(models))
+        index = self._atom_index
+        for mu in models:
+            packed.append(lit for lit in mu if (lit.arg(0) if lit.is_not() else lit) in index)
+        return packed
+
+    def evaluate(self, models: PackedModels) -> tuple[np.ndarray, np.ndarray]:
+        """Evaluates the formula on each assignment.
+        :param models: The assignments, packed over the atoms of the formula (see `pack`).
+        :return: Two boolean arrays, telling whether the formula is TRUE, respectively FALSE, under each assignment.
+        """
+        if models.atoms != self.atoms:
+            raise ValueError("The assignments must be packed over the atoms of the formula")
+        is_true = np.zeros(len(models), dtype=bool)
+        is_false = np.zeros(len(models), dtype=bool)
+        for start in range(0, len(models), self.chunk_size):
+            end = min(start + self.chunk_size, len(models))
+            t, f = self._evaluate_chunk(models.assigned[start:end], models.value[start:end])
+            is_true[start:end] = np.unpackbits(t)[:end - start]
+            is_false[start:end] = np.unpackbits(f)[:end - start]
+        return is_true, is_false
+
+    def undecided(self, models: PackedModels) -> np.ndarray:
+        """Returns the indices of the assignments under which the formula is neither TRUE nor FALSE."""
+        is_true, is_false = self.evaluate(models)
+        return np.flatnonzero(~(is_true | is_false))
+
+    def _evaluate_chunk(self, assigned: np.ndarray, value: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        n_bytes = (len(assigned) + 7) // 8
+        ones = np.full(n_bytes, 0xFF, dtype=np.uint8)
+        zeros = np.zeros(n_bytes, dtype=np.uint8)
+        values: list[tuple[np.ndarray, np.ndarray] | None] = [None] * len(self._gates)
+
+        for g, (node_type, args, payload) in enumerate(self._gates):
+            if node_type == op.SYMBOL:
+                word, bit = divmod(payload, _WORD_BITS)
+                is_assigned = ((assigned[:, word] >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+                is_value = ((value[:, word] >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+                res = np.packbits(is_assigned & is_value), np.packbits(is_assigned & ~is_value)
+            elif node_type == op.BOOL_CONSTANT:
+                res = (ones, zeros) if payload else (zeros, ones)
+            else:
+                res = _evaluate_gate(node_type, [values[a] for a in args])
+            values[g] = res
+            for a in args:
+                if self._last_use[a] == g:
+                    values[a] = None
+        return values[-1]
+
+
+def _evaluate_gate(node_type: int, args: list[tuple[np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray]:
+    if node_type == op.NOT:
+        t, f = args[0]
+        return f, t
+    if node_type == op.AND:
+        return (np.bitwise_and.reduce([t for t, _ in args]),
+                np.bitwise_or.reduce([f for _, f in args]))
+    if node_type == op.OR:
+        return (np.bitwise_or.reduce([t for t, _ in args]),
+                np.bitwise_and.reduce([f for _, f in args]))
+    if node_type == op.IMPLIES:
+        (ta, fa), (tb, fb) = args
+        return fa | tb, ta & fb
+    if node_type == op.IFF:
+        (ta, fa), (tb, fb) = args
+        return (ta & tb) | (fa & fb), (ta & fb) | (fa & tb)
+    if node_type == op.ITE:
+        (ti, fi), (tt, ft), (te, fe) = args
+        return (ti & tt) | (fi & te) | (tt & te), (ti & ft) | (fi & fe) | (ft & fe)
+    raise ValueError("Unsupported node type {}".format(node_type))
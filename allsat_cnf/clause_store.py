@@ -0,0 +1,118 @@
+from abc import ABC, abstractmethod
+from array import array
+from typing import Iterable, Iterator
+
+from pysmt.environment import get_env
+from pysmt.fnode import FNode
+
+from allsat_cnf.utils import negate
+
+T_IntClause = tuple[int, ...]
+
+
+class VariableMap:
+    """Maps atoms and labels to DIMACS-style variables.
+
+    Variables are positive integers, and a literal is a variable with a sign giving its polarity.
+    Atoms (Boolean variables, theory relations, ...) are mapped to a variable the first time they are seen,
+    while labels are allocated with `new_var` and turned into fresh pysmt symbols only if requested.
+    The constant TRUE is treated as an atom, so that FALSE is simply its negation.
+    """
+
+    def __init__(self, environment=None):
+        self.env = environment or get_env()
+        self.mgr = self.env.formula_manager
+        self.n_vars = 0
+        self.true_var = 0
+        self._atom_to_var: dict[FNode, int] = {}
+        self._var_to_node: dict[int, FNode] = {}
+
+    @classmethod
+    def from_atoms(cls, atoms: dict[FNode, int], n_vars: int, environment=None) -> "VariableMap":
+        """Rebuilds a variable map from the mapping of its atoms and its number of variables, e.g. when reading
+        back a stored CNF. The variables not assigned to atoms are labels."""
+        var_map = cls(environment)
+        var_map.n_vars = n_vars
+        for atom, var in atoms.items():
+            var_map._atom_to_var[atom] = var
+            var_map._var_to_node[var] = atom
+            if atom.is_true():
+                var_map.true_var = var
+        return var_map
+
+    def new_var(self) -> int:
+        self.n_vars += 1
+        return self.n_vars
+
+    def literal(self, atom: FNode) -> int:
+        """Returns the literal of the given atom, allocating a new variable if needed."""
+        if atom.is_false():
+            return -self.literal(self.mgr.TRUE())
+        var = self._atom_to_var.get(atom)
+        if var is None:
+            var = self.new_var()
+            self._atom_to_var[atom] = var
+            self._var_to_node[var] = atom
+            if atom.is_true():
+                self.true_var = var
+        return var
+
+    def atoms(self) -> dict[FNode, int]:
+        """Returns the mapping from the atoms to their variables."""
+        return self._atom_to_var
+
+    def to_fnode(self, lit: int) -> FNode:
+        """Returns the pysmt literal corresponding to the given integer literal."""
+        var = abs(lit)
+        node = self._var_to_node.get(var)
+        if node is None:
+            node = self.mgr.FreshSymbol()
+            self._var_to_node[var] = node
+        return node if lit > 0 else negate(node, self.mgr)
+
+
+class ClauseSink(ABC):
+    """Receives the clauses of a CNF, as integer literals, as soon as they are produced."""
+
+    def __init__(self, var_map: VariableMap | None = None, environment=None):
+        self.var_map = var_map or VariableMap(environment)
+
+    @abstractmethod
+    def add_clause(self, clause: Iterable[int]):
+        """Receives a clause, as integer literals of the variable map."""
+
+    @property
+    def n_vars(self) -> int:
+        return self.var_map.n_vars
+
+
+class ClauseStore(ClauseSink):
+    """A CNF stored as a flat array of integer literals, plus the offset where each clause starts."""
+
+    def __init__(self, var_map: VariableMap | None = None, environment=None):
+        super().__init__(var_map, environment)
+        self.literals = array("i")
+        self.offsets = array("q", [0])
+
+    def add_clause(self, clause: Iterable[int]):
+        self.literals.extend(clause)
+        self.offsets.append(len(self.literals))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> T_IntClause:
+        return tuple(self.literals[self.offsets[i]:self.offsets[i + 1]])
+
+    def __iter__(self) -> Iterator[T_IntClause]:
+        literals, offsets = self.literals, self.offsets
+        for i in range(len(self)):
+            yield tuple(literals[offsets[i]:offsets[i + 1]])
+
+    def as_fnode_clauses(self) -> list[tuple[FNode, ...]]:
+        to_fnode = self.var_map.to_fnode
+        return [tuple(to_fnode(lit) for lit in clause) for clause in self]
+
+    def as_formula(self) -> FNode:
+        mgr = self.var_map.mgr
+        return mgr.And(map(mgr.Or, self.as_fnode_clauses()))
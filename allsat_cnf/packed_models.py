@@ -0,0 +1,177 @@
+from typing import Iterable, Iterator, Sequence
+
+import numpy as np
+from pysmt.environment import get_env
+from pysmt.fnode import FNode
+
+# number of bits set in each byte
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_WORD_BITS = 64
+
+
+class PackedModels:
+    """A list of (partial) assignments over a fixed list of atoms, packed as bitsets.
+
+    Each assignment is stored as two bit planes of `n_words` 64-bit words: `assigned`, whose i-th bit is set if
+    the i-th atom is assigned, and `value`, whose i-th bit is the value of the i-th atom (0 if not assigned).
+    Counting, weighting and subsumption checks are vectorised over all the assignments.
+    """
+
+    def __init__(self, atoms: Sequence[FNode], capacity: int = 1024, environment=None):
+        self.env = environment or get_env()
+        self.mgr = self.env.formula_manager
+        self.atoms = list(atoms)
+        self.n_words = max(1, (len(self.atoms) + _WORD_BITS - 1) // _WORD_BITS)
+        self._atom_index = {a: i for i, a in enumerate(self.atoms)}
+        self._assigned = np.zeros((max(1, capacity), self.n_words), dtype=np.uint64)
+        self._value = np.zeros((max(1, capacity), self.n_words), dtype=np.uint64)
+        self._len = 0
+
+    @classmethod
+    def from_models(cls, atoms: Sequence[FNode], models: Iterable[Iterable[FNode]]) -> "PackedModels":
+        """Packs a list of assignments, given as sets of pysmt literals, e.g. as returned by `get_allsat`."""
+        models = list(models)
+        packed = cls(atoms, capacity=len(models))
+        for mu in models:
+            packed.append(mu)
+        return packed
+
+    @property
+    def assigned(self) -> np.ndarray:
+        return self._assigned[:self._len]
+
+    @property
+    def value(self) -> np.ndarray:
+        return self._value[:self._len]
+
+    def append(self, model: Iterable[FNode]):
+        """Appends an assignment, given as pysmt literals over the atoms."""
+        indices = []
+        values = []
+        for literal in model:
+            negated = literal.is_not()
+            indices.append(self._atom_index[literal.arg(0) if negated else literal])
+            values.append(not negated)
+        self.append_indices(indices, values)
+
+    def append_indices(self, indices: Iterable[int], values: Iterable[bool]):
+        """Appends an assignment, given as the indices of the assigned atoms and their values."""
+        if self._len == len(self._assigned):
+            self._grow()
+        row_assigned = self._assigned[self._len]
+        row_value = self._value[self._len]
+        for i, v in zip(indices, values):
+            word, bit = divmod(i, _WORD_BITS)
+            mask = np.uint64(1 << bit)
+            row_assigned[word] |= mask
+            if v:
+                row_value[word] |= mask
+        self._len += 1
+
+    def _grow(self):
+        capacity = 2 * len(self._assigned)
+        for name in ("_assigned", "_value"):
+            grown = np.zeros((capacity, self.n_words), dtype=np.uint64)
+            grown[:self._len] = getattr(self, name)[:self._len]
+            setattr(self, name, grown)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i: int) -> set[FNode]:
+        if not -self._len <= i < self._len:
+            raise IndexError("model index out of range")
+        i %= self._len
+        assigned = _unpack(self._assigned[i], len(self.atoms))
+        value = _unpack(self._value[i], len(self.atoms))
+        return {a if v else self.mgr.Not(a) for a, s, v in zip(self.atoms, assigned, value) if s}
+
+    def __iter__(self) -> Iterator[set[FNode]]:
+        for i in range(self._len):
+            yield self[i]
+
+    def n_assigned(self) -> np.ndarray:
+        """Returns the number of atoms assigned by each assignment."""
+        return _popcount(self.assigned)
+
+    def n_free(self) -> np.ndarray:
+        """Returns the number of atoms not assigned by each assignment."""
+        return len(self.atoms) - self.n_assigned()
+
+    def weights(self) -> np.ndarray:
+        """Returns the number of total assignments covered by each assignment, i.e. 2**free, as floats."""
+        return np.ldexp(1.0, self.n_free())
+
+    def count(self) -> int:
+        """Returns the exact number of total assignments covered by the assignments, assuming they are disjoint."""
+        free_counts = np.bincount(self.n_free(), minlength=len(self.atoms) + 1)
+        return sum(int(c) << f for f, c in enumerate(free_counts) if c)
+
+    def are_disjoint(self) -> bool:
+        """Checks whether the assignments are pairwise disjoint, i.e. no total assignment is covered by two of them.
+
+        The assignments are split recursively on the value of an atom assigned by one of them: the ones assigning
+        it different values are disjoint, while the ones not assigning it are compared with both sides.
+        """
+        assigned, value = self.assigned, self.value
+        stack = [(np.arange(self._len), np.zeros(self.n_words, dtype=np.uint64))]
+        while stack:
+            rows, split = stack.pop()
+            if len(rows) <= 1:
+                continue
+            remaining = assigned[rows[0]] & ~split
+            words = np.flatnonzero(remaining)
+            if len(words) == 0:
+                # the first assignment agrees with all the others on the atoms split so far, and assigns no other one
+                return False
+            word = words[0]
+            lowest_bit = int(remaining[word]) & -int(remaining[word])
+            mask = np.uint64(lowest_bit)
+            is_assigned = (assigned[rows, word] & mask) != 0
+            is_true = (value[rows, word] & mask) != 0
+            free = rows[~is_assigned]
+            split = split.copy()
+            split[word] |= mask
+            stack.append((np.concatenate([rows[is_assigned & is_true], free]), split))
+            stack.append((np.concatenate([rows[is_assigned & ~is_true], free]), split))
+        return True
+
+    def subsets_of(self, assigned: np.ndarray, value: np.ndarray) -> np.ndarray:
+        """Returns a mask of the stored assignments that are subsets of the given packed assignment."""
+        stored_assigned = self.assigned
+        # every atom assigned by a stored assignment is assigned by the given one, with the same value
+        in_assigned = (stored_assigned & ~assigned) == 0
+        same_value = ((self.value ^ value) & stored_assigned) == 0
+        return np.all(in_assigned & same_value, axis=1)
+
+    def supersets_of(self, assigned: np.ndarray, value: np.ndarray) -> np.ndarray:
+        """Returns a mask of the stored assignments that are supersets of the given packed assignment."""
+        stored_assigned = self.assigned
+        contains_assigned = (assigned & ~stored_assigned) == 0
+        same_value = ((self.value ^ value) & assigned) == 0
+        return np.all(contains_assigned & same_value, axis=1)
+
+    def covers(self, model: Iterable[FNode]) -> bool:
+        """Checks whether any stored assignment is a subset of the given assignment."""
+        return bool(self.subsets_of(*self.pack(model)).any())
+
+    def pack(self, model: Iterable[FNode]) -> tuple[np.ndarray, np.ndarray]:
+        """Packs an assignment, given as pysmt literals, into its `assigned` and `value` bit planes."""
+        assigned = np.zeros(self.n_words, dtype=np.uint64)
+        value = np.zeros(self.n_words, dtype=np.uint64)
+        for literal in model:
+            negated = literal.is_not()
+            word, bit = divmod(self._atom_index[literal.arg(0) if negated else literal], _WORD_BITS)
+            mask = np.uint64(1 << bit)
+            assigned[word] |= mask
+            if not negated:
+                value[word] |= mask
+        return assigned, value
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    return _POPCOUNT[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def _unpack(words: np.ndarray, n_bits: int) -> np.ndarray:
+    return np.unpackbits(words.astype("<u8", copy=False).view(np.uint8), bitorder="little")[:n_bits]
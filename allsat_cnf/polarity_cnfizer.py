@@ -1,19 +1,39 @@
+from collections import Counter
+
 import pysmt.operators as op
 from pysmt.fnode import FNode
 from pysmt.rewritings import NNFizer
 from pysmt.walkers import DagWalker, handles
 
+from allsat_cnf.clause_store import ClauseSink, ClauseStore, VariableMap, T_IntClause
 from allsat_cnf.polarity_finder import PolarityFinder, PolarityDict
 from allsat_cnf.polarity_walker import Polarity
+from allsat_cnf.structural_hasher import StructuralHasher
 from allsat_cnf.utils import unique_everseen, negate
 
 T_CNF = list[tuple[FNode, ...]]
 
 
 class PolarityCNFizer(DagWalker):
-    """Converts a formula into CNF using the Plaisted and Greenbaum algorithm."""
+    """Converts a formula into CNF using the Plaisted and Greenbaum algorithm.
+
+    The CNF is natively built as integer literals, which are passed to a `ClauseSink` (by default a
+    `ClauseStore`) as soon as the clauses of each gate are produced. pysmt nodes are only built when the CNF
+    is requested as a list of clauses or as a formula.
+
+    With `strash`, the formula is first normalized by a `StructuralHasher`, so that sub-formulas equal up to the
+    order of their arguments share their label, and constant sub-formulas get none. The atoms removed by the
+    normalization are still added to the variable map, so that they are enumerated as free atoms.
 
-    def __init__(self, environment=None, nnf=False, mutex_nnf_labels=False, label_neg_polarity=False):
+    With `flatten`, the children of an And (resp. Or) which are And (resp. Or) themselves and have no other parent
+    are merged into it, so that a chain of binary gates is encoded as a single n-ary gate with a single label.
+    Such children have the same polarity as their parent, so the clauses of the merged gate are the ones of the
+    Plaisted and Greenbaum encoding of the n-ary gate. The constants among the arguments of the merged gate are
+    folded, and the atoms removed by folding are still added to the variable map, as with `strash`.
+    """
+
+    def __init__(self, environment=None, nnf=False, mutex_nnf_labels=False, label_neg_polarity=False, strash=False,
+                 flatten=False):
         DagWalker.__init__(self, environment, invalidate_memoization=True)
         self.mgr = self.env.formula_manager
         if mutex_nnf_labels and not nnf:
@@ -21,59 +41,218 @@ class PolarityCNFizer(DagWalker):
         self._nnf = nnf
         self._mutex_nnf_labels = mutex_nnf_labels
         self._label_neg_polarity = label_neg_polarity
-
-        self._introduced_variables = {}
-        self._clauses: T_CNF = []
+        self._strash = strash
+        self._flatten = flatten
+
+        self._introduced_variables: dict[FNode, int] = {}
+        self._encoded_polarities: dict[FNode, Polarity] = {}
+        self._mutex_clauses: set[T_IntClause] = set()
+        self._incremental = False
+        self._var_map = VariableMap(self.env)
+        self._sink: ClauseSink = ClauseStore(self._var_map)
+        self._clauses: list[T_IntClause] = []
+        self._pending_clauses: list[T_IntClause] = []
+        self._has_clauses = False
+        self._n_parents: Counter[FNode] = Counter()
+        self._flat_args: dict[FNode, list[FNode]] = {}
         self._polarity_finder = PolarityFinder(environment)
         self._nnfizer = NNFizer(environment)
+        self._structural_hasher = StructuralHasher(environment)
 
     def convert(self, formula: FNode) -> T_CNF:
+        return self.convert_as_store(formula).as_fnode_clauses()
+
+    def convert_as_formula(self, formula: FNode) -> FNode:
+        return self.convert_as_store(formula).as_formula()
+
+    def convert_as_store(self, formula: FNode, var_map: VariableMap | None = None) -> ClauseStore:
+        """Converts a formula into CNF, stored as integer literals.
+        :param formula: The formula to convert.
+        :param var_map: The variable map to use, e.g. to fix the variables of some atoms in advance.
+        :return: The clause store containing the CNF, whose variable map maps back literals to pysmt nodes.
+        """
+        return self.convert_to_sink(formula, ClauseStore(var_map or VariableMap(self.env)))
+
+    def convert_to_sink(self, formula: FNode, sink: ClauseSink) -> ClauseSink:
+        """Converts a formula into CNF, passing each clause to the sink as soon as it is produced.
+        Apart from the clauses of the last gate, which are kept until the end of the walk,
+        no clause is kept in memory by the CNFizer.
+        :param formula: The formula to convert.
+        :param sink: The sink receiving the clauses. Its variable map is used to map atoms to variables.
+        :return: The sink.
+        """
+        if self._incremental:
+            raise ValueError("The CNFizer is used by a session, convert the formula through the session")
+        self._var_map = sink.var_map
+        self._introduced_variables = {}
+        self._encoded_polarities = {}
+        tl = self._convert(formula, sink)
+        if not self._has_clauses:
+            self._sink.add_clause([tl])
+        return self._sink
+
+    def session(self, var_map: VariableMap | None = None) -> "CNFizerSession":
+        """Starts a session, in which the conversions of a family of formulas share labels and clauses.
+        See `CNFizerSession` for more information.
+        :param var_map: The variable map shared by the conversions of the session.
+        :return: The session.
+        """
+        return CNFizerSession(self, var_map)
+
+    def _start_session(self, var_map: VariableMap):
+        self._incremental = True
+        self._var_map = var_map
+        self._introduced_variables = {}
+        self._encoded_polarities = {}
+        self._mutex_clauses = set()
+
+    def _end_session(self):
+        self._incremental = False
+        self._mutex_clauses = set()
+
+    def _convert(self, formula: FNode, sink: ClauseSink) -> int:
+        self._sink = sink
         self._clauses = []
+        self._pending_clauses = []
+        self._has_clauses = False
+
+        original = formula
+        if self._strash:
+            formula = self._structural_hasher.convert(formula)
         pre_polarities = self._get_polarities(formula)
-        formula = self._pre_process(formula)
-        polarities = self._get_polarities(formula)
-        tl: FNode = self.walk(formula, polarities=polarities)
+        pre_processed = self._pre_process(formula)
+        if pre_processed is formula:
+            polarities = pre_polarities
+        else:
+            polarities = self._get_polarities(pre_processed)
+        if self._flatten:
+            self._n_parents = self._count_parents(pre_processed)
+        try:
+            tl: int = self.walk(pre_processed, polarities=polarities)
+        finally:
+            self._n_parents = Counter()
+            self._flat_args = {}
         self._post_process(pre_polarities)
+        if self._strash or self._flatten:
+            self._add_folded_atoms(original)
+
+        # In a session, the labels must keep their full definition to be reused by the next formulas,
+        # so the clauses are not simplified w.r.t. the top-level label
+        self._flush_clauses(self._pending_clauses + self._clauses, 0 if self._incremental else tl)
+        return tl
 
-        clauses = self._simplify_clauses(tl)
-        return list(unique_everseen(clauses))
+    def _add_folded_atoms(self, formula: FNode):
+        """Adds to the variable map the atoms of the formula removed by folding constants, so that they are
+        enumerated as free atoms."""
+        atoms = self._var_map.atoms()
+        for atom in sorted((a for a in formula.get_atoms() if a not in atoms), key=str):
+            self._var_map.literal(atom)
 
     def _get_polarities(self, formula: FNode) -> PolarityDict:
         return self._polarity_finder.find(formula)
 
-    def _simplify_clauses(self, tl) -> T_CNF:
-        if len(self._clauses) == 0:
-            return [tuple([tl])]
-        res = []
-        for clause in self._clauses:
-            simp = []
-            for lit in clause:
-                if lit.is_true() or self.negate(lit) in simp:
-                    # Prune clauses that are trivially TRUE
-                    simp = None
+    @staticmethod
+    def _count_parents(formula: FNode) -> Counter[FNode]:
+        n_parents = Counter()
+        stack = [formula]
+        seen = {formula}
+        while stack:
+            f = stack.pop()
+            for child in f.args():
+                n_parents[child] += 1
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return n_parents
+
+    def _get_children(self, formula: FNode) -> list[FNode]:
+        if self._flatten and (formula.is_and() or formula.is_or()):
+            return self._get_flat_args(formula)
+        return formula.args()
+
+    def _get_flat_args(self, formula: FNode) -> list[FNode]:
+        """Returns the arguments of the n-ary gate obtained by merging into the And/Or formula its children with the
+        same operator and no other parent, recursively. The constants are folded: the neutral ones are dropped,
+        and an absorbing one is the only argument."""
+        args = self._flat_args.get(formula)
+        if args is None:
+            neutral = self.mgr.Bool(formula.is_and())
+            absorbing = self.mgr.Bool(not formula.is_and())
+            args = []
+            stack = list(reversed(formula.args()))
+            while stack:
+                a = stack.pop()
+                if a.node_type() == formula.node_type() and self._n_parents[a] == 1:
+                    stack.extend(reversed(a.args()))
+                elif a is absorbing:
+                    args = [a]
                     break
-                elif lit == tl:
-                    # Prune clauses as ~tl -> l1 v ... v lk
-                    simp = None
-                    break
-                elif lit == self.negate(tl):
-                    # Simplify tl -> l1 v ... v lk
-                    # into l1 v ... v lk
-                    continue
-                elif not lit.is_false():
-                    # Prune FALSE literals
-                    simp.append(lit)
-            if simp:
-                res.append(tuple(unique_everseen(simp)))
-        return res
-
-    def convert_as_formula(self, formula: FNode) -> FNode:
-        clauses = self.convert(formula)
-        return self.mgr.And(map(self.mgr.Or, clauses))
-
-    def key_var(self, formula: FNode, polarities: PolarityDict) -> FNode:
+                elif a is not neutral:
+                    args.append(a)
+            args = list(unique_everseen(args)) or [neutral]
+            self._flat_args[formula] = args
+        return args
+
+    def _compute_node_result(self, formula: FNode, **kwargs):
+        super()._compute_node_result(formula, **kwargs)
+        if self._clauses:
+            # The clauses of the last gate are kept pending, since they are the only ones that can
+            # contain the top-level label, which is known only at the end of the walk
+            self._flush_clauses(self._pending_clauses)
+            self._pending_clauses, self._clauses = self._clauses, []
+
+    def _push_with_children_to_stack(self, formula: FNode, **kwargs):
+        if self._incremental and self._is_encoded(formula, kwargs["polarities"]):
+            # The sub-formula and all its descendants are already encoded with the required polarities
+            self.memoization[formula] = self._introduced_variables[formula]
+            return
+        super()._push_with_children_to_stack(formula, **kwargs)
+
+    def _is_encoded(self, formula: FNode, polarities: PolarityDict) -> bool:
+        encoded = self._encoded_polarities.get(formula)
+        return encoded is not None and polarities[formula] | encoded == encoded
+
+    def _polarity_to_encode(self, formula: FNode, polarities: PolarityDict) -> Polarity:
+        """Returns the polarities of the formula whose clauses have not been produced yet."""
+        pol = polarities[formula]
+        if self._incremental:
+            encoded = self._encoded_polarities.get(formula, Polarity(0))
+            self._encoded_polarities[formula] = encoded | pol
+            pol = pol ^ (pol & encoded)
+        return pol
+
+    def _flush_clauses(self, clauses: list[T_IntClause], tl: int = 0):
+        if clauses:
+            self._has_clauses = True
+        simplified = (self._simplify_clause(clause, tl) for clause in clauses)
+        for clause in unique_everseen(filter(None, simplified)):
+            self._sink.add_clause(clause)
+
+    def _simplify_clause(self, clause: T_IntClause, tl: int) -> T_IntClause | None:
+        true_var = self._var_map.true_var
+        simp = []
+        for lit in clause:
+            if lit == true_var or -lit in simp:
+                # Prune clauses that are trivially TRUE
+                return None
+            elif lit == tl:
+                # Prune clauses as ~tl -> l1 v ... v lk
+                return None
+            elif lit == -tl:
+                # Simplify tl -> l1 v ... v lk
+                # into l1 v ... v lk
+                continue
+            elif lit != -true_var:
+                # Prune FALSE literals
+                simp.append(lit)
+        if not simp:
+            # The clause is FALSE: keep it as the unit clause of FALSE, since an empty clause would be dropped
+            return (self._var_map.literal(self._var_map.mgr.FALSE()),)
+        return tuple(unique_everseen(simp))
+
+    def key_var(self, formula: FNode, polarities: PolarityDict) -> int:
         if formula not in self._introduced_variables:
-            k = self.mgr.FreshSymbol()
+            k = self._var_map.new_var()
             if self._label_neg_polarity and polarities[formula] == Polarity.NEG:
                 k = self.negate(k)
             self._introduced_variables[formula] = k
@@ -86,63 +265,67 @@ class PolarityCNFizer(DagWalker):
     def walk_quantifier(self, formula: FNode, args, **kwargs):
         raise NotImplementedError("CNFizer does not support quantifiers")
 
-    def walk_and(self, formula: FNode, args: list[FNode], polarities: PolarityDict, **kwargs) -> FNode:
+    def walk_and(self, formula: FNode, args: list[int], polarities: PolarityDict, **kwargs) -> int:
         if len(args) == 1:
             return args[0]
 
         k = self.key_var(formula, polarities)
-        if Polarity.POS in polarities[formula]:
+        pol = self._polarity_to_encode(formula, polarities)
+        if Polarity.POS in pol:
             self._clauses += [tuple([self.negate(k), a]) for a in args]
-        if Polarity.NEG in polarities[formula]:
+        if Polarity.NEG in pol:
             self._clauses += [tuple([k] + [self.negate(a) for a in args])]
         return k
 
-    def walk_or(self, formula: FNode, args: list[FNode], polarities: PolarityDict, **kwargs) -> FNode:
+    def walk_or(self, formula: FNode, args: list[int], polarities: PolarityDict, **kwargs) -> int:
         if len(args) == 1:
             return args[0]
 
         k = self.key_var(formula, polarities)
-        if Polarity.POS in polarities[formula]:
+        pol = self._polarity_to_encode(formula, polarities)
+        if Polarity.POS in pol:
             self._clauses += [tuple([self.negate(k)] + [a for a in args])]
-        if Polarity.NEG in polarities[formula]:
+        if Polarity.NEG in pol:
             self._clauses += [tuple([k, self.negate(a)]) for a in args]
         return k
 
     def walk_not(self, formula: FNode, args, **kwargs):
         return self.negate(args[0])
 
-    def walk_implies(self, formula: FNode, args: list[FNode], polarities: PolarityDict, **kwargs) -> FNode:
+    def walk_implies(self, formula: FNode, args: list[int], polarities: PolarityDict, **kwargs) -> int:
         a, b = args
         k = self.key_var(formula, polarities)
         not_k = self.negate(k)
         not_a = self.negate(a)
         not_b = self.negate(b)
+        pol = self._polarity_to_encode(formula, polarities)
 
-        if Polarity.POS in polarities[formula]:
+        if Polarity.POS in pol:
             self._clauses += [tuple([not_k, not_a, b])]
-        if Polarity.NEG in polarities[formula]:
+        if Polarity.NEG in pol:
             self._clauses += [tuple([k, a]), tuple([k, not_b])]
         return k
 
-    def negate(self, term):
-        return negate(term, self.mgr)
+    def negate(self, lit: int) -> int:
+        return -lit
 
-    def walk_iff(self, formula: FNode, args: list[FNode], polarities: PolarityDict, **kwargs) -> FNode:
+    def walk_iff(self, formula: FNode, args: list[int], polarities: PolarityDict, **kwargs) -> int:
         a, b = args
         k = self.key_var(formula, polarities)
-        not_k: FNode = self.negate(k)
-        not_a: FNode = self.negate(a)
-        not_b: FNode = self.negate(b)
+        not_k = self.negate(k)
+        not_a = self.negate(a)
+        not_b = self.negate(b)
+        pol = self._polarity_to_encode(formula, polarities)
 
-        if Polarity.POS in polarities[formula]:
+        if Polarity.POS in pol:
             self._clauses += [tuple([not_k, not_a, b]),
                               tuple([not_k, a, not_b])]
-        if Polarity.NEG in polarities[formula]:
+        if Polarity.NEG in pol:
             self._clauses += [tuple([k, not_a, not_b]),
                               tuple([k, a, b])]
         return k
 
-    def walk_ite(self, formula: FNode, args: list[FNode], polarities: PolarityDict, **kwargs) -> FNode:
+    def walk_ite(self, formula: FNode, args: list[int], polarities: PolarityDict, **kwargs) -> int | FNode:
         if not self.env.stc.get_type(formula).is_bool_type():
             return formula
 
@@ -152,10 +335,11 @@ class PolarityCNFizer(DagWalker):
         not_i = self.negate(i)
         not_t = self.negate(t)
         not_e = self.negate(e)
+        pol = self._polarity_to_encode(formula, polarities)
 
-        if Polarity.POS in polarities[formula]:
+        if Polarity.POS in pol:
             self._clauses += [tuple([not_k, not_i, t]), tuple([not_k, i, e])]
-        if Polarity.NEG in polarities[formula]:
+        if Polarity.NEG in pol:
             self._clauses += [tuple([k, not_i, not_t]), tuple([k, i, not_e])]
 
         return k
@@ -164,7 +348,9 @@ class PolarityCNFizer(DagWalker):
     @handles(*op.CONSTANTS)
     @handles(*op.THEORY_OPERATORS)
     @handles(*op.RELATIONS)
-    def walk_identity(self, formula: FNode, **kwargs) -> FNode:
+    def walk_identity(self, formula: FNode, **kwargs) -> int | FNode:
+        if self.env.stc.get_type(formula).is_bool_type():
+            return self._var_map.literal(formula)
         return formula
 
     def _pre_process(self, formula: FNode) -> FNode:
@@ -180,8 +366,65 @@ class PolarityCNFizer(DagWalker):
         double_polarity_sub_formulas = [f for f, p in polarities.items() if p == Polarity.DOUBLE]
         for f in double_polarity_sub_formulas:
             f_pos = self._nnfizer.convert(f)
-            f_neg = self._nnfizer.convert(self.negate(f))
+            f_neg = self._nnfizer.convert(negate(f, self.mgr))
             if f_pos in self._introduced_variables and f_neg in self._introduced_variables:
                 k_pos = self.key_var(f_pos, polarities)
                 k_neg = self.key_var(f_neg, polarities)
-                self._clauses.append((self.negate(k_pos), self.negate(k_neg)))
+                clause = (self.negate(k_pos), self.negate(k_neg))
+                if self._incremental:
+                    if clause in self._mutex_clauses:
+                        continue
+                    self._mutex_clauses.add(clause)
+                self._clauses.append(clause)
+
+
+class CNFizerSession:
+    """Converts a family of formulas sharing sub-formulas into CNF incrementally.
+
+    The conversions of a session share the variable map and the labels: a sub-formula already encoded by a
+    previous conversion with the required polarity reuses its label and its definitional clauses, so that each
+    conversion only produces the clauses that are missing (e.g. the NEG clauses of a sub-formula previously
+    encoded only with POS polarity).
+
+    The clauses produced by the session only define the labels, and so they can be safely shared (e.g. added
+    once to an incremental solver): a formula is asserted by the unit clause of its top-level literal, which is
+    returned by each conversion.
+    """
+
+    def __init__(self, cnfizer: PolarityCNFizer, var_map: VariableMap | None = None):
+        self.cnfizer = cnfizer
+        self.var_map = var_map or VariableMap(cnfizer.env)
+        cnfizer._start_session(self.var_map)
+
+    def __enter__(self) -> "CNFizerSession":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Ends the session, so that the CNFizer can be used again for standalone conversions."""
+        self.cnfizer._end_session()
+
+    @property
+    def labels(self) -> dict[FNode, int]:
+        """Returns the mapping from the sub-formulas encoded so far to their labels."""
+        return self.cnfizer._introduced_variables
+
+    def convert(self, formula: FNode) -> tuple[int, ClauseStore]:
+        """Converts a formula, producing only the clauses not produced yet by the session.
+        :param formula: The formula to convert.
+        :return: The top-level literal of the formula, and the store of the new clauses.
+        """
+        store = ClauseStore(self.var_map)
+        return self.convert_to_sink(formula, store), store
+
+    def convert_to_sink(self, formula: FNode, sink: ClauseSink) -> int:
+        """Converts a formula, passing to the sink only the clauses not produced yet by the session.
+        :param formula: The formula to convert.
+        :param sink: The sink receiving the clauses. It must use the variable map of the session.
+        :return: The top-level literal of the formula.
+        """
+        if sink.var_map is not self.var_map:
+            raise ValueError("The sink must use the variable map of the session")
+        return self.cnfizer._convert(formula, sink)
@@ -1,46 +1,56 @@
-from pysmt import operators as op, typing as types
+from pysmt.environment import get_env
 from pysmt.fnode import FNode
-from pysmt.walkers import DagWalker, handles
 
-from allsat_cnf.polarity_walker import PolarityDagWalker, Polarity
+from allsat_cnf.polarity_walker import Polarity, get_children_polarities
 
 PolarityDict = dict[FNode, Polarity]
 
 
-class PolarityFinder(PolarityDagWalker):
+class PolarityFinder:
     """Finds the polarity of each subformula in a formula.
     See the main method `find` for more information.
     """
 
     def __init__(self, environment=None):
-        DagWalker.__init__(self, environment, invalidate_memoization=True)
+        self.env = environment or get_env()
         self.mgr = self.env.formula_manager
         self.polarity: PolarityDict = {}
 
     def find(self, formula: FNode) -> PolarityDict:
         """Finds the polarity of each subformula in a formula.
+
+        The polarities are computed in a single pass over the DAG, visiting each sub-formula once:
+        sub-formulas are visited parents first, so that the polarity of a sub-formula is final
+        when it is propagated to its children.
         :param formula: The formula to analyze.
         :return: A dictionary mapping each subformula to its polarity.
         """
         self.polarity = {}
-        self.walk(formula)
+        if formula.is_bool_constant():
+            return self.polarity
+
+        self.polarity[formula] = Polarity.POS
+        for f in reversed(self._topological_order(formula)):
+            pol = self.polarity[f]
+            for child, child_pol in get_children_polarities(f, pol):
+                if not child.is_bool_constant():
+                    self.polarity[child] = self.polarity.get(child, child_pol) | child_pol
         return self.polarity
 
-    @handles(op.AND, op.OR, op.ITE, op.IMPLIES, op.IFF, op.NOT)
-    @handles(op.RELATIONS)
-    def walk_sub_formula(self, formula: FNode, args: list[None], pol: Polarity, **kwargs):
-        self.polarity[formula] = self.polarity.get(formula, pol) | pol
-
-    def walk_symbol(self, formula: FNode, args: list[None], pol: Polarity, **kwargs):
-        if formula.is_symbol(types.BOOL):
-            self.polarity[formula] = self.polarity.get(formula, pol) | pol
-
-    def walk_function(self, formula: FNode, args: list[None], pol: Polarity, **kwargs):
-        ty = formula.function_name().symbol_type()
-        if ty.return_type.is_bool_type():
-            self.polarity[formula] = self.polarity.get(formula, pol) | pol
-
-    @handles(*op.THEORY_OPERATORS)
-    @handles(*op.CONSTANTS)
-    def walk_ignore(self, formula: FNode, args: list[None], pol: Polarity, **kwargs):
-        pass
+    @staticmethod
+    def _topological_order(formula: FNode) -> list[FNode]:
+        """Returns the sub-formulas of a formula, each one after all of its children."""
+        order = []
+        visited = set()
+        stack = [(False, formula)]
+        while stack:
+            was_expanded, f = stack.pop()
+            if was_expanded:
+                order.append(f)
+            elif f not in visited:
+                visited.add(f)
+                stack.append((True, f))
+                for child, _ in get_children_polarities(f):
+                    if child not in visited and not child.is_bool_constant():
+                        stack.append((False, child))
+        return order
@@ -62,29 +62,35 @@ class PolarityDagWalker(DagWalker):
             pass
 
     def _get_children(self, formula: FNode, pol: Polarity = Polarity.DOUBLE):
-        eq_pol, inv_pol = pol, ~pol
+        if formula.is_ite():
+            assert self.env.stc.get_type(formula).is_bool_type()
+        return get_children_polarities(formula, pol)
 
-        if formula.is_not():
-            return [(formula.arg(0), inv_pol)]
 
-        elif formula.is_implies():
-            return [(formula.arg(0), inv_pol), (formula.arg(1), eq_pol)]
+def get_children_polarities(formula: FNode, pol: Polarity = Polarity.DOUBLE) -> list[tuple[FNode, Polarity]]:
+    """Returns the children of a formula, each with its polarity given the polarity `pol` of the formula."""
+    eq_pol, inv_pol = pol, ~pol
 
-        elif formula.is_iff():
-            return [(formula.arg(0), Polarity.DOUBLE), (formula.arg(1), Polarity.DOUBLE)]
+    if formula.is_not():
+        return [(formula.arg(0), inv_pol)]
 
-        elif formula.is_and() or formula.is_or() or formula.is_quantifier():
-            return [(a, eq_pol) for a in formula.args()]
+    elif formula.is_implies():
+        return [(formula.arg(0), inv_pol), (formula.arg(1), eq_pol)]
 
-        elif formula.is_ite():
-            assert self.env.stc.get_type(formula).is_bool_type()
-            i, t, e = formula.args()
-            return [(i, Polarity.DOUBLE), (t, eq_pol), (e, inv_pol)]
+    elif formula.is_iff():
+        return [(formula.arg(0), Polarity.DOUBLE), (formula.arg(1), Polarity.DOUBLE)]
 
-        else:
-            assert formula.is_str_op() or \
-                   formula.is_symbol() or \
-                   formula.is_function_application() or \
-                   formula.is_bool_constant() or \
-                   formula.is_theory_relation(), str(formula)
-            return []
+    elif formula.is_and() or formula.is_or() or formula.is_quantifier():
+        return [(a, eq_pol) for a in formula.args()]
+
+    elif formula.is_ite():
+        i, t, e = formula.args()
+        return [(i, Polarity.DOUBLE), (t, eq_pol), (e, eq_pol)]
+
+    else:
+        assert formula.is_str_op() or \
+               formula.is_symbol() or \
+               formula.is_function_application() or \
+               formula.is_bool_constant() or \
+               formula.is_theory_relation(), str(formula)
+        return []
@@ -0,0 +1,160 @@
+from collections import Counter
+
+import pysmt.operators as op
+from pysmt.fnode import FNode
+from pysmt.walkers import DagWalker, handles
+
+
+class StructuralHasher(DagWalker):
+    """Normalizes the Boolean structure of a formula, so that the CNFizers give a single label to sub-formulas
+    that are equal up to the order of their arguments, and no label to constant sub-formulas.
+
+    As in the structural hashing of AIGs, equal sub-formulas are built as the same node by pysmt once their
+    arguments are put in a canonical form:
+    - the arguments of And and Or are sorted, deduplicated, and the ones of children with the same operator which
+      are referenced only once are merged into the parent (n-ary flattening);
+    - the constants are folded, as well as And and Or having complementary arguments;
+    - Implies is rewritten as Or, the negations of the arguments of Iff are moved outside it, and the negated
+      condition of an Ite is removed by swapping its branches.
+
+    Theory atoms are kept as they are. An atom disappears only when the formula does not depend on it (e.g. in
+    `a | ~a`), so the projected atoms must be computed on the original formula.
+    """
+
+    def __init__(self, environment=None):
+        DagWalker.__init__(self, environment, invalidate_memoization=True)
+        self.mgr = self.env.formula_manager
+        self._n_parents: Counter[FNode] = Counter()
+
+    def convert(self, formula: FNode) -> FNode:
+        """Normalizes the formula.
+        :param formula: The formula to normalize.
+        :return: An equivalent formula, whose atoms are a subset of the atoms of the input.
+        """
+        self._n_parents = self._count_parents(formula)
+        try:
+            return self.walk(formula)
+        finally:
+            self._n_parents = Counter()
+
+    def _count_parents(self, formula: FNode) -> Counter[FNode]:
+        n_parents = Counter()
+        stack = [formula]
+        seen = {formula}
+        while stack:
+            f = stack.pop()
+            for child in self._get_children(f):
+                n_parents[child] += 1
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return n_parents
+
+    def _get_children(self, formula: FNode):
+        # theory atoms and terms are leaves, so that the atoms of the formula are never rewritten
+        if formula.node_type() in op.BOOL_CONNECTIVES or (formula.is_ite() and self._is_bool(formula)):
+            return formula.args()
+        return []
+
+    def _is_bool(self, formula: FNode) -> bool:
+        return self.env.stc.get_type(formula).is_bool_type()
+
+    def _negate(self, formula: FNode) -> FNode:
+        if formula.is_true():
+            return self.mgr.FALSE()
+        if formula.is_false():
+            return self.mgr.TRUE()
+        return self.mgr.Not(formula)
+
+    def _is_mergeable(self, original: FNode | None, arg: FNode, node_type: int) -> bool:
+        # a child referenced elsewhere gets its own label anyway, so merging it would only duplicate its arguments
+        return (original is not None and original.node_type() == node_type and arg.node_type() == node_type
+                and self._n_parents[original] == 1)
+
+    def _make_nary(self, node_type: int, args: list[tuple[FNode | None, FNode]]) -> FNode:
+        """Builds the n-ary And or Or of the normalized arguments, each paired with the original node it comes from,
+        or None if it does not come from an original argument."""
+        absorbing, neutral = (self.mgr.FALSE(), self.mgr.TRUE()) if node_type == op.AND \
+            else (self.mgr.TRUE(), self.mgr.FALSE())
+        flat = []
+        for original, arg in args:
+            if self._is_mergeable(original, arg, node_type):
+                flat.extend(arg.args())
+            else:
+                flat.append(arg)
+
+        unique = {}
+        for arg in flat:
+            if arg is absorbing:
+                return absorbing
+            if arg is neutral:
+                continue
+            if self._negate(arg) in unique:
+                return absorbing
+            unique[arg] = None
+        if not unique:
+            return neutral
+        if len(unique) == 1:
+            return next(iter(unique))
+        sorted_args = sorted(unique, key=lambda f: f.node_id())
+        return self.mgr.And(sorted_args) if node_type == op.AND else self.mgr.Or(sorted_args)
+
+    def walk_and(self, formula: FNode, args: list[FNode], **kwargs) -> FNode:
+        return self._make_nary(op.AND, list(zip(formula.args(), args)))
+
+    def walk_or(self, formula: FNode, args: list[FNode], **kwargs) -> FNode:
+        return self._make_nary(op.OR, list(zip(formula.args(), args)))
+
+    def walk_not(self, formula: FNode, args: list[FNode], **kwargs) -> FNode:
+        return self._negate(args[0])
+
+    def walk_implies(self, formula: FNode, args: list[FNode], **kwargs) -> FNode:
+        a, b = args
+        return self._make_nary(op.OR, [(None, self._negate(a)), (formula.arg(1), b)])
+
+    def walk_iff(self, formula: FNode, args: list[FNode], **kwargs) -> FNode:
+        a, b = args
+        if a.is_bool_constant():
+            return b if a.is_true() else self._negate(b)
+        if b.is_bool_constant():
+            return a if b.is_true() else self._negate(a)
+        negated = False
+        if a.is_not():
+            a, negated = a.arg(0), not negated
+        if b.is_not():
+            b, negated = b.arg(0), not negated
+        if a is b:
+            return self.mgr.Bool(not negated)
+        if b.node_id() < a.node_id():
+            a, b = b, a
+        iff = self.mgr.Iff(a, b)
+        return self.mgr.Not(iff) if negated else iff
+
+    def walk_ite(self, formula: FNode, args: list[FNode], **kwargs) -> FNode:
+        if not self._is_bool(formula):
+            return formula
+        i, t, e = args
+        if i.is_bool_constant():
+            return t if i.is_true() else e
+        if i.is_not():
+            i, t, e = i.arg(0), e, t
+        if t is e:
+            return t
+        if t.is_bool_constant() and e.is_bool_constant():
+            return i if t.is_true() else self._negate(i)
+        if t.is_bool_constant():
+            # (i -> t) & (~i -> e)
+            return self._make_nary(op.OR, [(None, i), (None, e)]) if t.is_true() \
+                else self._make_nary(op.AND, [(None, self._negate(i)), (None, e)])
+        if e.is_bool_constant():
+            return self._make_nary(op.OR, [(None, self._negate(i)), (None, t)]) if e.is_true() \
+                else self._make_nary(op.AND, [(None, i), (None, t)])
+        return self.mgr.Ite(i, t, e)
+
+    @handles(op.QUANTIFIERS)
+    @handles(op.SYMBOL, op.FUNCTION)
+    @handles(*op.CONSTANTS)
+    @handles(*op.THEORY_OPERATORS)
+    @handles(*op.RELATIONS)
+    def walk_identity(self, formula: FNode, **kwargs) -> FNode:
+        return formula
@@ -1,10 +1,16 @@
+import time
+from collections import Counter
 from dataclasses import dataclass
 from enum import Enum
 from itertools import filterfalse
+from multiprocessing import get_context, TimeoutError as MPTimeoutError
 from pprint import pformat
-from typing import Iterable
+from queue import Queue
+from threading import Thread
+from typing import Callable, Iterable, Iterator
 
 import mathsat
+import numpy as np
 from pysmt.environment import get_env
 from pysmt.fnode import FNode
 from pysmt.shortcuts import Solver, get_atoms, substitute
@@ -13,6 +19,9 @@ from pysmt.solvers.msat import MathSAT5Solver
 from pysmt.typing import PySMTType, BOOL, REAL
 from pysmt.walkers import IdentityDagWalker
 
+from allsat_cnf.batch_checker import BooleanBatchChecker
+from allsat_cnf.packed_models import PackedModels
+
 
 @dataclass
 class SolverOptions:
@@ -32,6 +41,7 @@ class Normalizer:
     """A class for normalizing terms."""
 
     def __init__(self):
+        self.env = get_env()
         self._solver = Solver(name="msat")
         self._cache = {}
 
@@ -65,10 +75,265 @@ class Simplifier(Simplifier_):
         return super().walk_iff(formula, args, **kwargs)
 
 
+class AllSATEnumerator:
+    """Enumerates the (partial) assignments of a formula with a long-lived MathSAT solver.
+
+    The MathSAT environment, together with the caches of its converter, is kept alive between calls,
+    so that a stream of queries over the same base formula (e.g. projections on different atoms,
+    assumptions, or assertions in push/pop scopes) pays the start-up and conversion costs only once.
+    """
+
+    def __init__(self, formula: FNode | None = None, solver_options: SolverOptions | None = None):
+        self.solver_options = solver_options
+        if solver_options is not None:
+            solver_options_dict = get_solver_options_dict(solver_options)
+        else:
+            solver_options_dict = {}
+        self._solver: MathSAT5Solver = Solver(name="msat", solver_options=solver_options_dict)
+        # atoms of the assertions of each backtrack level
+        self._atoms: list[set[FNode]] = [set()]
+        self._preferred_atoms: list[FNode] = []
+        if formula is not None:
+            self.add_assertion(formula)
+
+    def __enter__(self) -> "AllSATEnumerator":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.exit()
+
+    def exit(self):
+        self._solver.exit()
+
+    def add_assertion(self, formula: FNode):
+        formula = rewalk(formula)
+        self._solver.add_assertion(formula)
+        self._atoms[-1].update(get_atoms(formula))
+
+    def push(self):
+        self._solver.push()
+        self._atoms.append(set())
+
+    def pop(self):
+        if len(self._atoms) == 1:
+            raise ValueError("No backtrack point to pop")
+        self._solver.pop()
+        self._atoms.pop()
+
+    def atoms(self) -> set[FNode]:
+        """Returns the atoms of the formulas currently asserted."""
+        return set().union(*self._atoms)
+
+    def is_sat(self, assumptions: Iterable[FNode] | None = None) -> bool:
+        if assumptions is not None:
+            assumptions = rewalk(list(assumptions))
+        return self._solver.solve(assumptions)
+
+    def is_valid(self, formula: FNode) -> bool:
+        formula = rewalk(formula)
+        return self._solver.is_valid(formula)
+
+    def get_allsat(self, atoms: Iterable[FNode] | None = None,
+                   assumptions: Iterable[FNode] | None = None) -> tuple[list[set[FNode]], int]:
+        """
+        Enumerates a list of (partial) assignments of the asserted formulas.
+        :param atoms: the atoms to project the assignments on (if None, all atoms of the asserted formulas are used)
+        :param assumptions: literals assumed to be true only for this enumeration
+        :return: a list of assignments and the total number of assignments
+        """
+        atoms = self._important_atoms(atoms)
+        assignments = []
+        converter = self._solver.converter
+        self._all_sat(atoms, assumptions, lambda model: _allsat_callback(model, converter, assignments))
+
+        total_models_count = sum(
+            map(lambda assignment: 2 ** (len(atoms) - len(assignment)), assignments)
+        )
+        return assignments, total_models_count
+
+    def get_packed_allsat(self, atoms: Iterable[FNode] | None = None,
+                          assumptions: Iterable[FNode] | None = None) -> PackedModels:
+        """
+        Enumerates the (partial) assignments of the asserted formulas, packed as bitsets over the atoms.
+        The assignments are never converted back to pysmt.
+        :param atoms: the atoms to project the assignments on (if None, all atoms of the asserted formulas are used)
+        :param assumptions: literals assumed to be true only for this enumeration
+        :return: the assignments, packed over the atoms sorted by node id
+        """
+        atoms = self._important_atoms(atoms)
+        packed = PackedModels(atoms)
+        env = self._solver.msat_env()
+        converter = self._solver.converter
+        # the index of each atom, keyed by the term reported by MathSAT, and whether the term is the negation of the
+        # atom: atoms may be converted to negated terms, e.g. `x < y` to `not (y <= x)`
+        atom_index = {}
+        for i, a in enumerate(atoms):
+            term = converter.convert(a)
+            is_negation = mathsat.msat_term_is_not(env, term)
+            if is_negation:
+                term = mathsat.msat_term_get_arg(term, 0)
+            atom_index[mathsat.msat_term_id(term)] = (i, is_negation)
+
+        def _callback(model):
+            indices = []
+            values = []
+            for literal in model:
+                negated = mathsat.msat_term_is_not(env, literal)
+                atom = mathsat.msat_term_get_arg(literal, 0) if negated else literal
+                i, is_negation = atom_index[mathsat.msat_term_id(atom)]
+                indices.append(i)
+                values.append(negated == is_negation)
+            packed.append_indices(indices, values)
+            return 1
+
+        self._all_sat(atoms, assumptions, _callback)
+        return packed
+
+    def all_sat(self, callback: Callable[[set[FNode]], bool | None], atoms: Iterable[FNode] | None = None,
+                assumptions: Iterable[FNode] | None = None) -> int:
+        """
+        Calls the callback on each (partial) assignment of the asserted formulas, as soon as it is found.
+        :param callback: the function called on each assignment. The enumeration stops if it returns False
+        :param atoms: the atoms to project the assignments on (if None, all atoms of the asserted formulas are used)
+        :param assumptions: literals assumed to be true only for this enumeration
+        :return: the number of assignments passed to the callback
+        """
+        atoms = self._important_atoms(atoms)
+        converter = self._solver.converter
+        n_assignments = 0
+
+        def _callback(model):
+            nonlocal n_assignments
+            n_assignments += 1
+            return 0 if callback({converter.back(v) for v in model}) is False else 1
+
+        self._all_sat(atoms, assumptions, _callback)
+        return n_assignments
+
+    def count_allsat(self, atoms: Iterable[FNode] | None = None, assumptions: Iterable[FNode] | None = None,
+                     limit: int | None = None) -> tuple[int, int]:
+        """
+        Counts the (partial) assignments of the asserted formulas, without converting them back to pysmt.
+        :param atoms: the atoms to project the assignments on (if None, all atoms of the asserted formulas are used)
+        :param assumptions: literals assumed to be true only for this enumeration
+        :param limit: the maximum number of assignments to enumerate (if None, all assignments are enumerated)
+        :return: the number of assignments and the total number of models they cover
+        """
+        atoms = self._important_atoms(atoms)
+        n_assignments = 0
+        total_models_count = 0
+
+        def _callback(model):
+            nonlocal n_assignments, total_models_count
+            n_assignments += 1
+            total_models_count += 2 ** (len(atoms) - len(model))
+            return 0 if n_assignments == limit else 1
+
+        if limit is None or limit > 0:
+            self._all_sat(atoms, assumptions, _callback)
+        return n_assignments, total_models_count
+
+    def iter_allsat(self, atoms: Iterable[FNode] | None = None, assumptions: Iterable[FNode] | None = None,
+                    limit: int | None = None) -> Iterator[set[FNode]]:
+        """
+        Yields the (partial) assignments of the asserted formulas, as soon as they are found.
+
+        The enumeration runs in a separate thread, which is suspended until the next assignment is requested:
+        the solver never runs ahead of the consumer, and no assignment is kept in memory.
+        Closing the iterator before it is exhausted stops the enumeration.
+        :param atoms: the atoms to project the assignments on (if None, all atoms of the asserted formulas are used)
+        :param assumptions: literals assumed to be true only for this enumeration
+        :param limit: the maximum number of assignments to enumerate (if None, all assignments are enumerated)
+        :return: an iterator over the assignments
+        """
+        atoms = self._important_atoms(atoms)
+        if limit is not None and limit <= 0:
+            return
+        converter = self._solver.converter
+        models = Queue(maxsize=1)
+        resume = Queue(maxsize=1)
+        done = object()
+
+        def _callback(model):
+            models.put(model)
+            return 1 if resume.get() else 0
+
+        def _enumerate():
+            try:
+                self._all_sat(atoms, assumptions, _callback)
+                models.put(done)
+            except BaseException as e:
+                models.put(e)
+
+        thread = Thread(target=_enumerate, daemon=True)
+        thread.start()
+        suspended = False
+        try:
+            n_assignments = 0
+            while True:
+                model = models.get()
+                if model is done:
+                    break
+                if isinstance(model, BaseException):
+                    raise model
+                suspended = True
+                n_assignments += 1
+                yield {converter.back(v) for v in model}
+                if n_assignments == limit:
+                    break
+                suspended = False
+                resume.put(True)
+        finally:
+            if suspended:
+                resume.put(False)
+                models.get()
+            thread.join()
+
+    def _important_atoms(self, atoms: Iterable[FNode] | None) -> list[FNode]:
+        if atoms is None:
+            atoms = self.atoms()
+        else:
+            atoms = rewalk(atoms)
+        return sorted(atoms, key=lambda x: x.node_id())
+
+    def _all_sat(self, atoms: list[FNode], assumptions: Iterable[FNode] | None, callback: Callable[[list], int]):
+        if len(atoms) == 0:
+            return
+        self._set_preferred_atoms(atoms)
+        converter = self._solver.converter
+        # enumerate within a backtrack point, so that the assumptions and the clauses blocking the models found
+        # are discarded afterwards
+        self._solver.push()
+        try:
+            for literal in rewalk(list(assumptions or [])):
+                self._solver.add_assertion(literal)
+            mathsat.msat_all_sat(self._solver.msat_env(), [converter.convert(a) for a in atoms], callback)
+        finally:
+            self._solver.pop()
+
+    def _set_preferred_atoms(self, atoms: list[FNode]):
+        preferred_atoms = set()
+        if self.solver_options is not None:
+            boolean_variables = {a for a in self.atoms() if a.is_symbol(BOOL)}
+            if self.solver_options.first_assign is SolverOptions.FirstAssign.RELEVANT:
+                preferred_atoms = boolean_variables & set(atoms)  # MathSAT allows only boolean variables to be relevant
+            elif self.solver_options.first_assign is SolverOptions.FirstAssign.IRRELEVANT:
+                preferred_atoms = boolean_variables - set(atoms)
+        preferred_atoms = sorted(preferred_atoms, key=lambda x: x.node_id())
+
+        if preferred_atoms != self._preferred_atoms:
+            if self._preferred_atoms:
+                mathsat.msat_clear_preferred_for_branching(self._solver.msat_env())
+            for atom in preferred_atoms:
+                self._solver.set_preferred_var(atom)
+            self._preferred_atoms = preferred_atoms
+
+
 def get_allsat(formula: FNode, atoms: Iterable[FNode] | None = None,
                solver_options: SolverOptions | None = None) -> tuple[list[set[FNode]], int]:
     """
     Enumerates a list of (partial) assignments of the given formula.
+    To run several enumerations over the same formula, use an `AllSATEnumerator` instead.
     :param formula: the formula to enumerate assignments for
     :param atoms: the atoms to project the assignments on (if None, all atoms in the formula are used)
     :param solver_options: options for the solver
@@ -82,36 +347,59 @@ def get_allsat(formula: FNode, atoms: Iterable[FNode] | None = None,
         atoms = rewalk(atoms)
     if len(atoms) == 0:
         return [], 0
-    atoms = sorted(atoms, key=lambda x: x.node_id())
 
-    if solver_options is not None:
-        solver_options_dict = get_solver_options_dict(solver_options)
-    else:
-        solver_options_dict = {}
-
-    preferred_atoms = set()
-    if solver_options is not None:
-        boolean_variables = get_boolean_variables(formula)
-        if solver_options.first_assign is SolverOptions.FirstAssign.RELEVANT:
-            preferred_atoms = boolean_variables & set(atoms)  # MathSAT allows only boolean variables to be relevant
-        elif solver_options.first_assign is SolverOptions.FirstAssign.IRRELEVANT:
-            preferred_atoms = boolean_variables - set(atoms)
-    preferred_atoms = sorted(preferred_atoms, key=lambda x: x.node_id())
-
-    assignments = []
-    with Solver(name="msat", solver_options=solver_options_dict) as solver:
-        solver: MathSAT5Solver
-        solver.add_assertion(formula)
-        for atom in preferred_atoms:
-            solver.set_preferred_var(atom)
-        # solver.all_sat(important=atoms, callback=lambda model: _allsat_callback(model, solver.converter, assignments))
-        mathsat.msat_all_sat(solver.msat_env(), [solver.converter.convert(a) for a in atoms],
-                             lambda model: _allsat_callback(model, solver.converter, assignments))
-
-    total_models_count = sum(
-        map(lambda assignment: 2 ** (len(atoms) - len(assignment)), assignments)
-    )
-    return assignments, total_models_count
+    with AllSATEnumerator(formula, solver_options) as enumerator:
+        return enumerator.get_allsat(atoms)
+
+
+def get_packed_allsat(formula: FNode, atoms: Iterable[FNode] | None = None,
+                      solver_options: SolverOptions | None = None) -> PackedModels:
+    """
+    Enumerates the (partial) assignments of the given formula, packed as bitsets over the atoms.
+    :param formula: the formula to enumerate assignments for
+    :param atoms: the atoms to project the assignments on (if None, all atoms in the formula are used)
+    :param solver_options: options for the solver
+    :return: the assignments, packed over the atoms sorted by node id
+    """
+    formula = rewalk(formula)
+    if atoms is None:
+        atoms = get_atoms(formula)
+    with AllSATEnumerator(formula, solver_options) as enumerator:
+        return enumerator.get_packed_allsat(atoms)
+
+
+def iter_allsat(formula: FNode, atoms: Iterable[FNode] | None = None,
+                solver_options: SolverOptions | None = None, limit: int | None = None) -> Iterator[set[FNode]]:
+    """
+    Yields the (partial) assignments of the given formula, as soon as they are found.
+    See `AllSATEnumerator.iter_allsat` for more information.
+    :param formula: the formula to enumerate assignments for
+    :param atoms: the atoms to project the assignments on (if None, all atoms in the formula are used)
+    :param solver_options: options for the solver
+    :param limit: the maximum number of assignments to enumerate (if None, all assignments are enumerated)
+    :return: an iterator over the assignments
+    """
+    formula = rewalk(formula)
+    if atoms is None:
+        atoms = get_atoms(formula)
+    with AllSATEnumerator(formula, solver_options) as enumerator:
+        yield from enumerator.iter_allsat(atoms, limit=limit)
+
+
+def count_allsat(formula: FNode, atoms: Iterable[FNode] | None = None,
+                 solver_options: SolverOptions | None = None) -> tuple[int, int]:
+    """
+    Counts the (partial) assignments of the given formula, without converting them back to pysmt.
+    :param formula: the formula to enumerate assignments for
+    :param atoms: the atoms to project the assignments on (if None, all atoms in the formula are used)
+    :param solver_options: options for the solver
+    :return: the number of assignments and the total number of models they cover
+    """
+    formula = rewalk(formula)
+    if atoms is None:
+        atoms = get_atoms(formula)
+    with AllSATEnumerator(formula, solver_options) as enumerator:
+        return enumerator.count_allsat(atoms)
 
 
 def _allsat_callback(model, converter, models):
@@ -180,25 +468,41 @@ def get_functions(formula: FNode):
     return {a for a in formula.get_atoms() if a.is_function_application()}
 
 
-def check_models(ta: list[FNode], phi: FNode, relevant_atoms: set[FNode] | None = None):
+def check_models(ta: list[FNode], phi: FNode, relevant_atoms: set[FNode] | None = None, disjoint: bool = False,
+                 n_workers: int = 1, timeout: float | None = None):
     """
     Check that the given list of models is correct and complete for the given formula.
     :param ta: the list of models
     :param phi: the formula
     :param relevant_atoms: the atoms relevant for the formula (if None, all atoms in the formula are used)
+    :param disjoint: whether the models are pairwise disjoint, so that completeness can be checked by counting
+    :param n_workers: the number of processes checking the correctness of the models
+    :param timeout: the time limit in seconds of the correctness check on several processes, after which the pool is
+        terminated and a TimeoutError is raised (if None, no limit)
     :return: True if the list of models is correct and complete for the given formula, False otherwise
     """
     ta = rewalk(ta)
     phi = rewalk(phi)
     if relevant_atoms is None:
         relevant_atoms = get_atoms(phi)
-    is_correct, err = ta_is_correct(phi, ta, relevant_atoms)
+    if n_workers > 1 and len(ta) > 1:
+        is_correct, err = ta_is_correct_parallel(phi, ta, relevant_atoms, n_workers, timeout=timeout)
+    else:
+        is_correct, err = ta_is_correct(phi, ta, relevant_atoms)
     assert is_correct, "ta is not correct: {}\n{}\n{}".format(phi.serialize(), pformat(ta), err)
-    is_complete, err = ta_is_complete(phi, ta)
+    is_complete, err = ta_is_complete(phi, ta, relevant_atoms, disjoint)
     assert is_complete, "ta is not complete: {}\n{}\n{}".format(phi.serialize(), pformat(ta), err)
 
 
-_normalizer = Normalizer()
+_normalizer: Normalizer | None = None
+
+
+def _get_normalizer() -> Normalizer:
+    # the normalizer is bound to the pysmt environment it was created in, so it is rebuilt after `reset_env`
+    global _normalizer
+    if _normalizer is None or _normalizer.env is not get_env():
+        _normalizer = Normalizer()
+    return _normalizer
 
 
 def ta_is_correct(phi: FNode, ta: list[FNode], relevant_atoms: set[FNode]) -> tuple[bool, str | None]:
@@ -210,16 +514,28 @@ def ta_is_correct(phi: FNode, ta: list[FNode], relevant_atoms: set[FNode]) -> tu
     :return: True if each model in the list satisfies the formula, False otherwise
     """
     mgr = get_env().formula_manager
-    phi = _normalizer.normalize(phi)
+    if BooleanBatchChecker.supports(phi):
+        # the models making the formula FALSE under three-valued logic are wrong, and the ones making it TRUE are
+        # correct, so only the remaining ones are checked by substitution
+        checker = BooleanBatchChecker(phi)
+        is_true, is_false = checker.evaluate(checker.pack(ta))
+        falsifying = np.flatnonzero(is_false)
+        if len(falsifying) > 0:
+            mu = ta[falsifying[0]]
+            return False, "mu: {}\nfalsifies the formula".format(mu)
+        ta = [ta[i] for i in np.flatnonzero(~is_true)]
+    normalizer = _get_normalizer()
+    phi = normalizer.normalize(phi)
+    simplifier = Simplifier()
     for mu in ta:
-        mu = _normalizer.normalize_assigment(mu)
+        mu = normalizer.normalize_assigment(mu)
         subs = {}
         for literal in mu:
             if literal.is_not():
                 subs[literal.arg(0)] = mgr.FALSE()
             else:
                 subs[literal] = mgr.TRUE()
-        res = Simplifier().simplify(substitute(phi, subs))
+        res = simplifier.simplify(substitute(phi, subs))
         res_atoms = get_atoms(res)
         if len(res_atoms & relevant_atoms) != 0:
             err = "mu: {}\nsubstituting {}\ngot: {}\nres_atoms {}".format(mu, subs, res, res_atoms)
@@ -227,25 +543,196 @@ def ta_is_correct(phi: FNode, ta: list[FNode], relevant_atoms: set[FNode]) -> tu
     return True, None
 
 
-def ta_is_complete(phi: FNode, ta: list[FNode]) -> tuple[bool, str | None]:
+def ta_is_correct_parallel(phi: FNode, ta: list[FNode], relevant_atoms: set[FNode], n_workers: int,
+                           timeout: float | None = None, shard_size: int | None = None) -> tuple[bool, str | None]:
     """
-    Check that each total model of the formula is a super-model of one of the models in the list.
+    Check that each model in the list satisfies the formula, sharding the models across a pool of processes.
+    Each worker rebuilds the formula in its own pysmt environment, and checks its shards with `ta_is_correct`.
     :param phi: the formula
     :param ta: the list of models
+    :param relevant_atoms: the atoms relevant for the formula
+    :param n_workers: the number of worker processes
+    :param timeout: the overall time limit in seconds, after which a TimeoutError is raised (if None, no limit)
+    :param shard_size: the number of models checked by each task (if None, a few shards per worker are used)
+    :return: True if each model in the list satisfies the formula, False otherwise, with the first failure found
+    """
+    if shard_size is None:
+        shard_size = max(1, -(-len(ta) // (4 * n_workers)))
+    shards = [ta[i:i + shard_size] for i in range(0, len(ta), shard_size)]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    ctx = get_context("spawn")
+    with ctx.Pool(n_workers, initializer=_init_check_worker, initargs=(phi, relevant_atoms)) as pool:
+        results = pool.imap(_check_shard, shards)
+        for _ in shards:
+            # shards are returned in order, so the first failure is the one of the first wrong model
+            try:
+                is_correct, err = results.next(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except MPTimeoutError:
+                raise TimeoutError("Models check timed out")
+            if not is_correct:
+                return False, err
+    return True, None
+
+
+_worker_phi: FNode | None = None
+_worker_relevant_atoms: set[FNode] | None = None
+
+
+def _init_check_worker(phi: FNode, relevant_atoms: set[FNode]):
+    global _worker_phi, _worker_relevant_atoms
+    _worker_phi = rewalk(phi)
+    _worker_relevant_atoms = rewalk(relevant_atoms)
+
+
+def _check_shard(shard: list[set[FNode]]) -> tuple[bool, str | None]:
+    return ta_is_correct(_worker_phi, rewalk(shard), _worker_relevant_atoms)
+
+
+def ta_is_complete(phi: FNode, ta: list[FNode], relevant_atoms: set[FNode] | None = None,
+                   disjoint: bool = False) -> tuple[bool, str | None]:
+    """
+    Check that each total model of the formula is a super-model of one of the models in the list.
+
+    If the models are disjoint, which is checked before, completeness is checked by counting: the number of total
+    assignments covered by the models must be equal to the (projected) model count of the formula. Otherwise, the total models of the formula
+    are enumerated one at a time, and each of them is looked up in a subsumption index of the models.
+    :param phi: the formula
+    :param ta: the list of models, each of which is assumed to be correct
+    :param relevant_atoms: the atoms the models are projected on (if None, all atoms in the formula are used)
+    :param disjoint: whether the models are expected to be pairwise disjoint, e.g. if enumerated without repetitions
     :return: True if each total model of the formula is a super-model of one of the models in the list, False otherwise
     """
-    ta = [_normalizer.normalize_assigment(mu) for mu in ta]
-    atoms = get_boolean_variables(phi).union({a for a in get_lra_atoms(phi)})
-    tta, _ = get_allsat(phi, atoms=atoms, solver_options=SolverOptions(with_repetitions=False, use_ta=False))
+    normalizer = _get_normalizer()
+    ta = [normalizer.normalize_assigment(mu) for mu in ta]
+    if relevant_atoms is None:
+        relevant_atoms = get_boolean_variables(phi).union({a for a in get_lra_atoms(phi)})
+    if disjoint:
+        # the count is sound only if no total assignment is covered twice, otherwise the models are checked by
+        # subsumption
+        packed = _pack_on_atoms(ta, {_get_atom(normalizer.normalize(a)) for a in relevant_atoms})
+        if packed.are_disjoint():
+            return _ta_is_complete_by_count(phi, packed)
+
+    index = SubsumptionIndex.from_models(ta)
     # check that for every model in tta there is a corresponding supermodel in ta
+    tta = iter_allsat(phi, atoms=relevant_atoms, solver_options=SolverOptions(with_repetitions=False, use_ta=False))
     for eta in tta:
-        eta = _normalizer.normalize_assigment(eta)
-        err = "{} not covered"
-        if not any(eta.issuperset(mu) for mu in ta):
-            return False, err
+        eta = normalizer.normalize_assigment(eta)
+        if index.find_subset(eta) is None:
+            tta.close()
+            return False, "{} not covered".format(eta)
+    return True, None
+
+
+def _pack_on_atoms(ta: list[set[FNode]], atoms: set[FNode]) -> PackedModels:
+    # atoms which are normalized to the same term are counted once
+    packed = PackedModels(sorted(atoms, key=lambda a: a.node_id()), capacity=len(ta))
+    for mu in ta:
+        packed.append(literal for literal in mu if _get_atom(literal) in atoms)
+    return packed
+
+
+def _ta_is_complete_by_count(phi: FNode, packed: PackedModels) -> tuple[bool, str | None]:
+    ta_count = packed.count()
+    _, phi_count = count_allsat(phi, atoms=packed.atoms,
+                                solver_options=SolverOptions(with_repetitions=False, use_ta=True))
+    if ta_count != phi_count:
+        return False, "the models cover {} total assignments, the formula has {} models".format(ta_count, phi_count)
     return True, None
 
 
+def _get_atom(literal: FNode) -> FNode:
+    return literal.arg(0) if literal.is_not() else literal
+
+
+class SubsumptionIndex:
+    """An index of sets of literals, supporting the search of a stored set which is a subset of a given one.
+
+    The sets are stored in a trie, in which the literals of each set are sorted by a fixed rank. A subset of a query
+    is searched by following only the edges labelled with literals of the query, so that the search visits only the
+    prefixes of the stored sets which are subsets of the query, instead of scanning all of them.
+    When the index is built in bulk, literals are ranked by decreasing frequency, so that the most common literals
+    are shared by the longest prefixes.
+    """
+
+    _END = None
+
+    def __init__(self):
+        self._root: dict = {}
+        self._rank: dict[FNode, int] = {}
+        self._len = 0
+
+    @classmethod
+    def from_models(cls, models: Iterable[Iterable[FNode]]) -> "SubsumptionIndex":
+        """Builds an index of the given sets of literals, e.g. the assignments returned by `get_allsat`."""
+        models = [frozenset(mu) for mu in models]
+        frequency = Counter(literal for mu in models for literal in mu)
+        index = cls()
+        index._rank = {literal: i for i, (literal, _) in enumerate(frequency.most_common())}
+        for mu in models:
+            index.insert(mu)
+        return index
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[frozenset[FNode]]:
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            for literal, child in node.items():
+                if literal is self._END:
+                    yield child
+                else:
+                    stack.append(child)
+
+    def __contains__(self, model: Iterable[FNode]) -> bool:
+        node = self._root
+        for literal in self._sorted(model):
+            node = node.get(literal)
+            if node is None:
+                return False
+        return self._END in node
+
+    def insert(self, model: Iterable[FNode]):
+        model = frozenset(model)
+        for literal in model:
+            if literal not in self._rank:
+                self._rank[literal] = len(self._rank)
+        node = self._root
+        for literal in self._sorted(model):
+            node = node.setdefault(literal, {})
+        if self._END not in node:
+            node[self._END] = model
+            self._len += 1
+
+    def find_subset(self, assignment: Iterable[FNode]) -> frozenset[FNode] | None:
+        """Returns a stored set which is a subset of the given assignment, or None if there is none."""
+        # literals which do not appear in any stored set cannot be part of a subset
+        query = self._sorted(literal for literal in set(assignment) if literal in self._rank)
+        position = {literal: i for i, literal in enumerate(query)}
+        stack = [(self._root, 0)]
+        while stack:
+            node, start = stack.pop()
+            if self._END in node:
+                return node[self._END]
+            if len(node) < len(query) - start:
+                for literal, child in node.items():
+                    i = position.get(literal)
+                    if i is not None and i >= start:
+                        stack.append((child, i + 1))
+            else:
+                for i in range(start, len(query)):
+                    child = node.get(query[i])
+                    if child is not None:
+                        stack.append((child, i + 1))
+        return None
+
+    def _sorted(self, literals: Iterable[FNode]) -> list[FNode]:
+        rank = self._rank
+        return sorted(literals, key=lambda literal: rank.get(literal, len(rank)))
+
+
 def rewalk(phi: FNode | Iterable[FNode]) -> FNode | Iterable[FNode]:
     if isinstance(phi, FNode):
         return IdentityDagWalker().walk(phi)
@@ -0,0 +1,97 @@
+import argparse
+import dataclasses
+import hashlib
+import json
+import os
+from array import array
+from dataclasses import dataclass
+from tempfile import NamedTemporaryFile
+
+import numpy as np
+from pysmt.fnode import FNode
+
+from allsat_cnf.clause_store import ClauseStore, VariableMap
+from .io.smtlib import formulas_to_smtlib, smtlib_to_formulas
+from .preprocess import convert_file_to_store
+from .run import PreprocessOptions
+
+
+@dataclass
+class CachedCNF:
+    store: ClauseStore
+    projected_atoms: set[FNode]
+
+
+class CNFCache:
+    """On-disk cache of the CNFs of the input files, keyed by the content of the file and the preprocess options.
+
+    Each entry is a .npz file holding the clauses as a flat array of integer literals plus the clause offsets,
+    the atoms of the variable map as SMT-LIB text together with their variables, and the variables of the
+    projected atoms. The projected atoms are numbered first, in order of their names, as done by `write_dimacs`,
+    so that the same entry can be used both to enumerate with MathSAT and to write the DIMACS input of a solver.
+    """
+    # to be increased whenever the CNFizers or the format of the entries change
+    VERSION = 3
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, filename: str, preprocess_options: PreprocessOptions) -> str:
+        h = hashlib.sha256()
+        with open(filename, "rb") as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+        options = json.dumps(dataclasses.asdict(preprocess_options), sort_keys=True)
+        h.update("\n{}\n{}".format(self.VERSION, options).encode())
+        return h.hexdigest()
+
+    def get(self, filename: str, preprocess_options: PreprocessOptions) -> CachedCNF:
+        """Returns the CNF of the formula in the file, computing and storing it if it is not in the cache."""
+        path = os.path.join(self.cache_dir, self.key(filename, preprocess_options) + ".npz")
+        if os.path.exists(path):
+            return self._load(path)
+        cnf = self._compute(filename, preprocess_options)
+        self._save(path, cnf)
+        return cnf
+
+    @staticmethod
+    def _compute(filename: str, preprocess_options: PreprocessOptions) -> CachedCNF:
+        return CachedCNF(*convert_file_to_store(filename, preprocess_options))
+
+    def _save(self, path: str, cnf: CachedCNF):
+        atom_to_var = cnf.store.var_map.atoms()
+        # written to a temporary file first, so that concurrent runs never read a partial entry
+        with NamedTemporaryFile("wb", dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            np.savez(
+                f,
+                literals=np.frombuffer(cnf.store.literals, dtype=np.int32),
+                offsets=np.frombuffer(cnf.store.offsets, dtype=np.int64),
+                n_vars=np.int64(cnf.store.n_vars),
+                atoms=np.array(formulas_to_smtlib(atom_to_var)),
+                atom_vars=np.array(list(atom_to_var.values()), dtype=np.int64),
+                projected_vars=np.array([atom_to_var[a] for a in cnf.projected_atoms], dtype=np.int64),
+            )
+        os.replace(f.name, path)
+
+    @staticmethod
+    def _load(path: str) -> CachedCNF:
+        with np.load(path) as data:
+            atoms = smtlib_to_formulas(str(data["atoms"]))
+            atom_to_var = dict(zip(atoms, data["atom_vars"].tolist()))
+            var_map = VariableMap.from_atoms(atom_to_var, int(data["n_vars"]))
+            store = ClauseStore(var_map)
+            store.literals = array("i", data["literals"].astype(np.int32).tobytes())
+            store.offsets = array("q", data["offsets"].astype(np.int64).tobytes())
+            projected_vars = set(data["projected_vars"].tolist())
+        return CachedCNF(store, {a for a, v in atom_to_var.items() if v in projected_vars})
+
+
+def add_cnf_cache_argument(parser: argparse.ArgumentParser):
+    parser.add_argument('--cnf-cache', type=str, default=None,
+                        help='Folder where to cache the CNFs of the input files, shared by the evaluation scripts '
+                             '(default: no cache)')
+
+
+def get_cnf_cache(args) -> CNFCache | None:
+    return CNFCache(args.cnf_cache) if args.cnf_cache is not None else None
@@ -1,15 +1,23 @@
+import dataclasses
 import re
+import shutil
+import time
 from dataclasses import dataclass
 from enum import Enum
-from tempfile import NamedTemporaryFile
+from typing import TextIO
 
 import networkx as nx
+import numpy as np
 from matplotlib import pyplot as plt
 from networkx.drawing.nx_pydot import pydot_layout
 from pysmt.fnode import FNode
 
-from allsat_cnf.utils import get_clauses
-from .io.dimacs import pysmt_to_dimacs, dimacs_var_map
+from allsat_cnf.clause_store import ClauseStore
+from allsat_cnf.polarity_cnfizer import PolarityCNFizer
+from .ddnnf import AND, FALSE, OR, TRUE, load_ddnnf
+from .io.aig import AIG, AIGCNFizer, write_aig_dimacs
+from .io.dimacs import write_dimacs, write_dimacs_from_store, DimacsInfo, HeaderMode
+from .result_cache import SolverResultCache
 from .run import run_cmd_with_timeout
 
 
@@ -42,94 +50,97 @@ class D4Interface:
     RE_NUM_NEG_HITS = re.compile(r"c Number of negative hit: (\d+)")
     RE_MODEL_COUNT = re.compile(r"s (\d+)")
 
-    # Regular expressions for parsing d4 NNF file
-    # o <id> 0 : OR gate with index <id>
-    # a <id> 0 : AND gate with index <id> and variable <var>
-    # t <id> 0 : TRUE gate with index <id> and variable <var>
-    # f <id> 0 : FALSE gate with index <id> and variable <var>
-    RE_NNF_OR = re.compile(r"o (\d+) 0")
-    RE_NNF_AND = re.compile(r"a (\d+) 0")
-    RE_NNF_TRUE = re.compile(r"t (\d+) 0")
-    RE_NNF_FALSE = re.compile(r"f (\d+) 0")
-    # NNF edges: <number> <number> <possibly empty list of numbers separated by spaces> 0
-    RE_NNF_EDGE = re.compile(r"(\d+) (\d+)( .+)? 0")
-
     class MODE(Enum):
         COUNTING = "counting"
         DDNNF = "dDNNF"
 
-    def __init__(self, d4_bin: str):
+    # name of the d-DNNF in the entries of the result cache
+    CACHED_NNF = "ddnnf.nnf"
+
+    def __init__(self, d4_bin: str, result_cache: SolverResultCache | None = None):
         self.d4_bin = d4_bin
+        self.result_cache = result_cache
+        # time taken by the runs of d4 whose results were taken from the cache
+        self.cached_time = 0.
 
-    def projected_model_count(self, formula: FNode, projected_vars: set[FNode], tmp_dir: str | None,
-                              timeout: int | None) -> int:
-        output, _ = self._invoke_d4(formula, projected_vars, self.MODE.COUNTING, tmp_dir=tmp_dir, timeout=timeout)
+    def write_dimacs(self, f: TextIO, formula: FNode, projected_vars: set[FNode],
+                     cnfizer: PolarityCNFizer) -> DimacsInfo:
+        """Converts the formula into CNF, streaming it to the DIMACS file given as input to d4."""
+        return write_dimacs(f, formula, projected_vars, cnfizer, HeaderMode.ZERO_TERMINATED)
 
-        return output.model_count
+    def write_dimacs_from_store(self, f: TextIO, store: ClauseStore, projected_vars: set[FNode]) -> DimacsInfo:
+        """Writes a CNF already converted, e.g. read from the CNF cache, to the DIMACS file given as input to d4."""
+        return write_dimacs_from_store(f, store, projected_vars, HeaderMode.ZERO_TERMINATED)
 
-    def compile(self, formula: FNode, projected_vars: set[FNode], nnf_file: str, tmp_dir: str | None,
-                timeout: int | None) \
-            -> tuple[_D4Output, dict[FNode, int]]:
-        return self._invoke_d4(formula, projected_vars, self.MODE.DDNNF, nnf_file=nnf_file, tmp_dir=tmp_dir,
-                               timeout=timeout)
+    def write_aig_dimacs(self, f: TextIO, aig: AIG, cnfizer: AIGCNFizer) -> tuple[DimacsInfo, set[FNode]]:
+        """Converts the AIG into CNF, streaming it to the DIMACS file given as input to d4."""
+        return write_aig_dimacs(f, aig, cnfizer, HeaderMode.ZERO_TERMINATED)
 
-    def _invoke_d4(self, formula: FNode, projected_vars: set[FNode], mode: MODE,
-                   nnf_file: str | None = None,
-                   tmp_dir: str | None = None,
-                   timeout: int | None = None) -> tuple[_D4Output, dict[FNode, int]]:
-        with NamedTemporaryFile(dir=tmp_dir, delete=False, delete_on_close=False) as f:
-            dimacs_file = f.name
-            var_map = dimacs_var_map(formula, projected_vars)
+    def projected_model_count(self, dimacs_file: str, dimacs_info: DimacsInfo, projected_vars: set[FNode],
+                              timeout: int | None, stdin: int | None = None, dimacs_digest: str | None = None) -> int:
+        output = self._invoke_d4(dimacs_file, dimacs_info, projected_vars, self.MODE.COUNTING, timeout=timeout,
+                                 stdin=stdin, dimacs_digest=dimacs_digest)
 
-            with open(dimacs_file, "w") as fw:
-                fw.writelines(pysmt_to_dimacs(formula, projected_vars, var_map))
+        return output.model_count
 
-            cmd = [self.d4_bin, "-i", str(dimacs_file)]
-            if mode == self.MODE.DDNNF:
-                assert nnf_file is not None, "d-DNNF mode requires a file to dump the d-DNNF"
-                cmd += ["--dump-file", nnf_file]
-            elif mode == self.MODE.COUNTING:
-                assert nnf_file is None, "Counting mode does not require a file to dump the d-DNNF"
-                pass
+    def compile(self, dimacs_file: str, dimacs_info: DimacsInfo, projected_vars: set[FNode], nnf_file: str,
+                timeout: int | None, stdin: int | None = None, dimacs_digest: str | None = None) -> _D4Output:
+        return self._invoke_d4(dimacs_file, dimacs_info, projected_vars, self.MODE.DDNNF, nnf_file=nnf_file,
+                               timeout=timeout, stdin=stdin, dimacs_digest=dimacs_digest)
 
+    def _invoke_d4(self, dimacs_file: str, dimacs_info: DimacsInfo, projected_vars: set[FNode], mode: MODE,
+                   nnf_file: str | None = None,
+                   timeout: int | None = None,
+                   stdin: int | None = None,
+                   dimacs_digest: str | None = None) -> _D4Output:
+        """Runs d4, unless its result is in the result cache.
+        :param dimacs_digest: The digest of the DIMACS file, needed to use the result cache.
+        """
+        cmd = [self.d4_bin, "-i", str(dimacs_file)]
+        if mode == self.MODE.DDNNF:
+            assert nnf_file is not None, "d-DNNF mode requires a file to dump the d-DNNF"
+            cmd += ["--dump-file", nnf_file]
+        elif mode == self.MODE.COUNTING:
+            assert nnf_file is None, "Counting mode does not require a file to dump the d-DNNF"
+            pass
+
+        cache_key = None
+        if self.result_cache is not None and dimacs_digest is not None:
+            projected_ids = sorted(dimacs_info.var_map[v] for v in projected_vars)
+            cache_key = self.result_cache.key(self.d4_bin, mode.value, dimacs_digest, projected_ids)
+
+        if cache_key is not None and (cached := self.result_cache.get(cache_key)) is not None:
+            output = _D4Output(**cached.output)
+            if mode == self.MODE.DDNNF:
+                shutil.copyfile(cached.files[self.CACHED_NNF], nnf_file)
+            self.cached_time += cached.time
+        else:
+            time_start = time.time()
             output = _D4Output(0, 0, 0, 0, 0, 0, 0, 0)
-            for line in run_cmd_with_timeout(cmd, timeout=timeout):
+            for line in run_cmd_with_timeout(cmd, stdin=stdin, timeout=timeout):
                 output = self._read_output_line(output, line)
 
             if mode == self.MODE.DDNNF:
-                self._fix_ddnnf(nnf_file, var_map, projected_vars)
+                self._fix_ddnnf(nnf_file, dimacs_info.var_map, projected_vars)
+
+            if cache_key is not None:
+                files = {self.CACHED_NNF: nnf_file} if mode == self.MODE.DDNNF else None
+                self.result_cache.put(cache_key, dataclasses.asdict(output), time.time() - time_start, files)
 
-        assert output.num_vars == (nv := len(var_map)), f"{output.num_vars} != {nv}"
-        assert output.num_clauses == (cc := len(get_clauses(formula))), f"{output.num_clauses} != {cc}"
+        assert output.num_vars == (nv := dimacs_info.n_vars), f"{output.num_vars} != {nv}"
+        assert output.num_clauses == (cc := dimacs_info.n_clauses), f"{output.num_clauses} != {cc}"
         assert output.projected_vars == (pv := len(projected_vars)), f"{output.projected_vars} != {pv}"
 
-        return output, var_map
+        return output
 
     def _fix_ddnnf(self, nnf_file: str, var_map: dict[FNode, int], projected_vars: set[FNode]):
         """
         The d-DNNF output by d4 can contain variables that are not in the projected variables set.
         However, it should be safe to simply remove them from the d-DNNF file.
-        """
-        with open(nnf_file) as f:
-            lines = f.readlines()
 
-        projected_ids = {var_map[v] for v in projected_vars}
-        ids_map = {v: i for i, v in enumerate(projected_ids, start=1)}
-
-        with open(nnf_file, "w") as f:
-            for line in lines:
-                if m := self.RE_NNF_EDGE.match(line):
-                    a, b, ll = m.groups()
-                    f.write(f"{a} {b}")
-                    for l in (ll or "").split():
-                        i = int(l)
-                        a = abs(i)
-                        s = 1 if i > 0 else -1
-                        if a in projected_ids:
-                            f.write(f" {s * ids_map[a]}")
-                    f.write(" 0\n")
-                else:
-                    f.write(line)
+        The projected variables are renumbered from 1 in increasing order, and the file is rewritten atomically.
+        """
+        load_ddnnf(nnf_file).project(var_map[v] for v in projected_vars).write(nnf_file)
 
     def _read_output_line(self, output: _D4Output, line: str) -> _D4Output:
         if m := self.RE_NUM_VARS.match(line):
@@ -190,51 +201,43 @@ class D4EnumeratorInterface:
 
 def visualize(nnf_file: str, var_map: dict[FNode, int], output_file: str | None = None):
     inverse_var_map = {v: k for k, v in var_map.items()}
+    ddnnf = load_ddnnf(nnf_file, cache=True)
+    type_labels = {OR: "OR", AND: "AND", TRUE: "TRUE", FALSE: "FALSE"}
 
     g = nx.DiGraph()
     labels = {}
 
-    with open(nnf_file) as f:
-        for line in f:
-            if m := D4Interface.RE_NNF_OR.match(line):
-                g.add_node(m.group(1))
-                labels[m.group(1)] = "OR"
-            elif m := D4Interface.RE_NNF_AND.match(line):
-                g.add_node(m.group(1))
-                labels[m.group(1)] = "AND"
-            elif m := D4Interface.RE_NNF_TRUE.match(line):
-                g.add_node(m.group(1))
-                labels[m.group(1)] = "TRUE"
-            elif m := D4Interface.RE_NNF_FALSE.match(line):
-                g.add_node(m.group(1))
-                labels[m.group(1)] = "FALSE"
-            elif m := D4Interface.RE_NNF_EDGE.match(line):
-                from_id, to_id, ll = m.groups()
-                ll = [int(i) for i in (ll or "").split()]
-                literals = []
-                for l in ll:
-                    v = inverse_var_map[abs(l)]
-                    s = (f"!{v}" if l < 0 else str(v))
-                    literals.append(s)
-                    labels[s] = s
-
-                # make a fresh AND node
-                and_node = f"AND{from_id}_{to_id}_{'_'.join(literals)}"
-                g.add_node(and_node)
-                labels[and_node] = "AND"
-                g.add_edge(from_id, and_node)
-                g.add_edge(and_node, to_id)
-                for l in literals:
-                    g.add_edge(and_node, l)
-
-        # visualize the graph. the graph is a rooted DAG
-
-        pos = pydot_layout(g, prog="dot", root=4)
-        nx.draw(g, pos, labels=labels, node_size=500, alpha=0.5, font_size=10)
-
-        if output_file is not None:
-            plt.savefig(output_file)
-        else:
-            plt.show()
-
-        plt.close()
+    for node in np.flatnonzero(ddnnf.node_types != 255).tolist():
+        g.add_node(str(node))
+        labels[str(node)] = type_labels[int(ddnnf.node_types[node])]
+
+    lit_offsets = ddnnf.lit_offsets.tolist()
+    for e, (from_id, to_id) in enumerate(zip(ddnnf.edge_from().tolist(), ddnnf.edge_to.tolist())):
+        from_id, to_id = str(from_id), str(to_id)
+        literals = []
+        for l in ddnnf.literals[lit_offsets[e]:lit_offsets[e + 1]].tolist():
+            v = inverse_var_map[abs(l)]
+            s = (f"!{v}" if l < 0 else str(v))
+            literals.append(s)
+            labels[s] = s
+
+        # make a fresh AND node
+        and_node = f"AND{from_id}_{to_id}_{'_'.join(literals)}"
+        g.add_node(and_node)
+        labels[and_node] = "AND"
+        g.add_edge(from_id, and_node)
+        g.add_edge(and_node, to_id)
+        for l in literals:
+            g.add_edge(and_node, l)
+
+    # visualize the graph. the graph is a rooted DAG
+
+    pos = pydot_layout(g, prog="dot", root=4)
+    nx.draw(g, pos, labels=labels, node_size=500, alpha=0.5, font_size=10)
+
+    if output_file is not None:
+        plt.savefig(output_file)
+    else:
+        plt.show()
+
+    plt.close()
@@ -0,0 +1,300 @@
+import mmap
+import os
+from dataclasses import dataclass
+from tempfile import NamedTemporaryFile
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# node types of the d-DNNF, as in the NNF format of d4
+OR, AND, TRUE, FALSE = range(4)
+NODE_TYPES = {"o": OR, "a": AND, "t": TRUE, "f": FALSE}
+
+DDNNF_CACHE_EXT = ".npz"
+NNF_CHUNK_SIZE = 1 << 26
+NNF_WRITE_EDGES = 1 << 20
+
+# types of the lines of an NNF file, given by their first character
+_EDGE, _BLANK, _INVALID = 253, 254, 255
+_LINE_TYPES = np.full(256, _INVALID, dtype=np.uint8)
+_LINE_TYPES[[ord(c) for c in NODE_TYPES]] = list(NODE_TYPES.values())
+_LINE_TYPES[ord("0"):ord("9") + 1] = _EDGE
+_LINE_TYPES[[ord(c) for c in " \t\r\n"]] = _BLANK
+_DROP_NODE_TYPES = bytes.maketrans("".join(NODE_TYPES).encode(), b" " * len(NODE_TYPES))
+
+_DDNNF_ARRAYS = ["node_types", "child_offsets", "edge_to", "lit_offsets", "literals"]
+
+
+@dataclass
+class DDNNF:
+    """A d-DNNF in the NNF format of d4, stored in arrays indexed by node id.
+
+    Each edge goes from a node to one of its children and is labelled by a conjunction of literals.
+    The edges of a node are `child_offsets[node]:child_offsets[node + 1]`, the child of an edge is `edge_to[edge]`
+    and its literals are `literals[lit_offsets[edge]:lit_offsets[edge + 1]]`.
+    The root is the first node of the file.
+    """
+    node_types: np.ndarray
+    child_offsets: np.ndarray
+    edge_to: np.ndarray
+    lit_offsets: np.ndarray
+    literals: np.ndarray
+    root: int
+
+    @property
+    def n_nodes(self) -> int:
+        return int(np.count_nonzero(self.node_types != 255))
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.edge_to)
+
+    def edge_from(self) -> np.ndarray:
+        """Returns the origin node of each edge."""
+        return np.repeat(np.arange(len(self.node_types)), np.diff(self.child_offsets))
+
+    def project(self, projected_ids: Iterable[int]) -> "DDNNF":
+        """Removes the literals of the variables not in `projected_ids` from the edges, and renumbers the projected
+        variables from 1 in increasing order."""
+        projected_ids = np.array(sorted(projected_ids), dtype=np.int64)
+        variables = np.abs(self.literals)
+        new_vars = np.zeros(max(variables.max(initial=0), projected_ids.max(initial=0)) + 1, dtype=np.int32)
+        new_vars[projected_ids] = np.arange(1, len(projected_ids) + 1)
+        literals = np.sign(self.literals) * new_vars[variables]
+        kept = literals != 0
+        lit_edges = np.repeat(np.arange(self.n_edges), np.diff(self.lit_offsets))
+        lit_counts = np.bincount(lit_edges[kept], minlength=self.n_edges)
+        return DDNNF(self.node_types, self.child_offsets, self.edge_to, np.concatenate(([0], np.cumsum(lit_counts))),
+                     literals[kept], self.root)
+
+    def write(self, nnf_file: str):
+        """Writes the d-DNNF in the NNF format of d4, replacing the file atomically.
+
+        The nodes are declared first, starting from the root, and are followed by the edges grouped by origin.
+        """
+        node_ids = np.flatnonzero(self.node_types != 255)
+        node_ids = np.concatenate(([self.root], node_ids[node_ids != self.root]))
+        letters = list(NODE_TYPES)
+        # edges as zero-terminated groups <from> <to> <literals> 0 in a flat array
+        lit_counts = np.diff(self.lit_offsets)
+        edge_starts = self.lit_offsets[:-1] + 3 * np.arange(self.n_edges)
+        tokens = np.zeros(len(self.literals) + 3 * self.n_edges, dtype=np.int64)
+        tokens[edge_starts] = self.edge_from()
+        tokens[edge_starts + 1] = self.edge_to
+        tokens[np.repeat(edge_starts + 2 - self.lit_offsets[:-1], lit_counts) + np.arange(len(self.literals))] = \
+            self.literals
+
+        nnf_dir = os.path.dirname(os.path.abspath(nnf_file))
+        with NamedTemporaryFile("w", dir=nnf_dir, suffix=".tmp", delete=False) as f:
+            try:
+                f.writelines(f"{letters[t]} {i} 0\n" for i, t in zip(node_ids.tolist(),
+                                                                   self.node_types[node_ids].tolist()))
+                for chunk in np.split(tokens, edge_starts[::NNF_WRITE_EDGES][1:]):
+                    if len(chunk) > 0:
+                        # 0 only terminates the edges
+                        f.write(" ".join(map(str, chunk.tolist())).replace(" 0 ", " 0\n") + "\n")
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, nnf_file)
+
+    def save(self, cache_file: str, source_stat: os.stat_result):
+        """Stores the arrays in a .npz file, together with the size and modification time of the NNF file."""
+        with NamedTemporaryFile("wb", dir=os.path.dirname(os.path.abspath(cache_file)), suffix=".tmp",
+                                delete=False) as f:
+            np.savez(f, **{field: getattr(self, field) for field in _DDNNF_ARRAYS}, root=np.int64(self.root),
+                     source_size=np.int64(source_stat.st_size), source_mtime_ns=np.int64(source_stat.st_mtime_ns))
+        os.replace(f.name, cache_file)
+
+    def topological_order(self) -> list[int]:
+        """Returns the nodes reachable from the root, each one after all its children."""
+        child_offsets, edge_to = self.child_offsets.tolist(), self.edge_to.tolist()
+        order = []
+        # 0: not visited, 1: children pushed, 2: done
+        state = bytearray(len(child_offsets))
+        stack = [self.root]
+        while stack:
+            node = stack[-1]
+            if state[node] == 0:
+                state[node] = 1
+                stack.extend(c for c in edge_to[child_offsets[node]:child_offsets[node + 1]] if state[c] == 0)
+            else:
+                stack.pop()
+                if state[node] == 1:
+                    state[node] = 2
+                    order.append(node)
+        return order
+
+    def count(self, n_vars: int) -> tuple[int, int]:
+        """Computes the model count over `n_vars` variables and the number of paths, in a single bottom-up pass.
+
+        The models of a path are counted as 2^k, where k is the number of variables not assigned by the path,
+        as done by enumerating the paths with `decdnnf_rs model-enumeration --compact-free-vars`.
+        To keep the counts integer, each node stores the sum of 2^(m - |p|) over its paths p, where m is the
+        maximum number of literals on its paths.
+        :return: The model count and the number of paths.
+        """
+        node_types, child_offsets = self.node_types.tolist(), self.child_offsets.tolist()
+        edge_to = self.edge_to.tolist()
+        lit_counts = np.diff(self.lit_offsets).tolist()
+        n = len(node_types)
+        max_lits, counts, n_paths = [0] * n, [0] * n, [0] * n
+
+        for node in self.topological_order():
+            node_type = node_types[node]
+            edges = range(child_offsets[node], child_offsets[node + 1])
+            if node_type == TRUE:
+                counts[node], n_paths[node] = 1, 1
+            elif node_type == OR:
+                m = max((lit_counts[e] + max_lits[edge_to[e]] for e in edges), default=0)
+                count, paths = 0, 0
+                for e in edges:
+                    c = edge_to[e]
+                    count += counts[c] << (m - lit_counts[e] - max_lits[c])
+                    paths += n_paths[c]
+                max_lits[node], counts[node], n_paths[node] = m, count, paths
+            elif node_type == AND:
+                m, count, paths = 0, 1, 1
+                for e in edges:
+                    c = edge_to[e]
+                    m += lit_counts[e] + max_lits[c]
+                    count *= counts[c]
+                    paths *= n_paths[c]
+                max_lits[node], counts[node], n_paths[node] = m, count, paths
+
+        m = max_lits[self.root]
+        if m > n_vars:
+            raise ValueError(f"A path assigns {m} literals, but there are only {n_vars} variables")
+        return counts[self.root] << (n_vars - m), n_paths[self.root]
+
+    def iter_paths(self) -> Iterator[tuple[int, ...]]:
+        """Streams the literals assigned by each path reaching TRUE, i.e. the models with free variables."""
+        yield from self._iter_paths(self.root)
+
+    def _iter_paths(self, node: int) -> Iterator[tuple[int, ...]]:
+        node_type = self.node_types[node]
+        if node_type == TRUE:
+            yield ()
+        elif node_type == OR:
+            for e in range(self.child_offsets[node], self.child_offsets[node + 1]):
+                yield from self._iter_edge_paths(e)
+        elif node_type == AND:
+            yield from self._iter_and_paths(list(range(self.child_offsets[node], self.child_offsets[node + 1])))
+
+    def _iter_edge_paths(self, edge: int) -> Iterator[tuple[int, ...]]:
+        lits = tuple(self.literals[self.lit_offsets[edge]:self.lit_offsets[edge + 1]].tolist())
+        for path in self._iter_paths(self.edge_to[edge]):
+            yield lits + path
+
+    def _iter_and_paths(self, edges: list[int]) -> Iterator[tuple[int, ...]]:
+        if not edges:
+            yield ()
+            return
+        for path in self._iter_edge_paths(edges[0]):
+            for rest in self._iter_and_paths(edges[1:]):
+                yield path + rest
+
+
+def load_ddnnf(nnf_file: str, cache: bool = False) -> DDNNF:
+    """Loads a d-DNNF in the NNF format of d4.
+
+    Nodes are declared by lines `<type> <id> 0`, where the type is one of o (OR), a (AND), t (TRUE) and f (FALSE),
+    and edges by lines `<from> <to> <literals> 0`.
+    The file is memory-mapped and parsed in large chunks with NumPy, without a Python step per line.
+    :param cache: Whether to store the arrays in a .npz file next to the NNF file, and to load them from there
+        as long as the NNF file is not modified.
+    """
+    stat = os.stat(nnf_file)
+    cache_file = nnf_file + DDNNF_CACHE_EXT
+    if cache and (ddnnf := _load_cached_ddnnf(cache_file, stat)) is not None:
+        return ddnnf
+    ddnnf = _parse_nnf(nnf_file)
+    if cache:
+        ddnnf.save(cache_file, stat)
+    return ddnnf
+
+
+def _parse_nnf(nnf_file: str) -> DDNNF:
+    parts = []
+    with open(nnf_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("Empty d-DNNF")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < len(mm):
+                end = start + NNF_CHUNK_SIZE
+                if end < len(mm):
+                    # chunks are extended to the end of their last line
+                    end = mm.find(b"\n", end) + 1 or len(mm)
+                parts.append(_parse_nnf_chunk(mm[start:end]))
+                start = end
+    node_ids, node_types, edge_from, edge_to, lit_counts, literals = (np.concatenate(arrays) for arrays in zip(*parts))
+    if len(node_ids) == 0:
+        raise ValueError("Empty d-DNNF")
+    return _build_ddnnf(node_ids, node_types, edge_from, edge_to, lit_counts, literals)
+
+
+def _parse_nnf_chunk(chunk: bytes) -> tuple[np.ndarray, ...]:
+    """Parses a chunk of whole lines of an NNF file.
+
+    Each line is a group of integers terminated by 0, which does not occur elsewhere since node ids start from 1:
+    the type of the line is given by its first character, and the letters of the node types are dropped before
+    parsing the integers all at once.
+    """
+    data = np.frombuffer(chunk, dtype=np.uint8)
+    line_starts = np.flatnonzero(np.concatenate(([True], data[:-1] == ord("\n"))))
+    line_types = _LINE_TYPES[data[line_starts]]
+    line_types = line_types[line_types != _BLANK]
+    if len(line_types) == 0:
+        return tuple(np.empty(0, dtype=dtype) for dtype in [np.int64, np.uint8, np.int64, np.int64, np.int64, np.int32])
+    if np.any(line_types == _INVALID):
+        raise ValueError("Malformed d-DNNF")
+
+    numbers = np.fromstring(chunk.translate(_DROP_NODE_TYPES), dtype=np.int64, sep=" ")
+    ends = np.flatnonzero(numbers == 0)
+    if len(ends) != len(line_types):
+        raise ValueError("Malformed d-DNNF")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    is_edge = line_types == _EDGE
+    node_starts = starts[~is_edge]
+    edge_starts, edge_ends = starts[is_edge], ends[is_edge]
+    lit_counts = edge_ends - edge_starts - 2
+    lit_offsets = np.concatenate(([0], np.cumsum(lit_counts)))
+    lit_index = np.repeat(edge_starts + 2 - lit_offsets[:-1], lit_counts) + np.arange(lit_offsets[-1])
+    return (numbers[node_starts], line_types[~is_edge], numbers[edge_starts], numbers[edge_starts + 1],
+            lit_counts, numbers[lit_index].astype(np.int32))
+
+
+def _load_cached_ddnnf(cache_file: str, stat: os.stat_result) -> DDNNF | None:
+    try:
+        with np.load(cache_file) as data:
+            if (int(data["source_size"]), int(data["source_mtime_ns"])) != (stat.st_size, stat.st_mtime_ns):
+                return None
+            return DDNNF(**{field: data[field] for field in _DDNNF_ARRAYS}, root=int(data["root"]))
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _build_ddnnf(node_ids: np.ndarray, node_types: np.ndarray, edge_from: np.ndarray, edge_to: np.ndarray,
+                 lit_counts: np.ndarray, literals: np.ndarray) -> DDNNF:
+    """Groups the edges, given in file order, by their origin node."""
+    n = int(max(node_ids.max(), edge_from.max(initial=0), edge_to.max(initial=0))) + 1
+    # ids not declared as nodes are marked with 255
+    types = np.full(n, 255, dtype=np.uint8)
+    types[node_ids] = node_types
+
+    order = np.argsort(edge_from, kind="stable")
+    lit_offsets = np.concatenate(([0], np.cumsum(lit_counts)))
+    sorted_lit_offsets = np.concatenate(([0], np.cumsum(lit_counts[order])))
+    # the k-th literal of the i-th sorted edge is moved from lit_offsets[order[i]] + k to sorted_lit_offsets[i] + k
+    lit_index = np.repeat(lit_offsets[order] - sorted_lit_offsets[:-1], lit_counts[order]) + np.arange(len(literals))
+    return DDNNF(
+        node_types=types,
+        child_offsets=np.concatenate(([0], np.cumsum(np.bincount(edge_from, minlength=n)))),
+        edge_to=edge_to[order],
+        lit_offsets=sorted_lit_offsets,
+        literals=literals[lit_index],
+        root=int(node_ids[0]),
+    )
@@ -1,9 +1,154 @@
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, TextIO
+
+import numpy as np
 from pysmt.environment import Environment, get_env
 from pysmt.fnode import FNode
 from pysmt.formula import FormulaManager
 from pysmt.typing import BOOL
 
-from allsat_cnf.utils import negate
+from allsat_cnf.clause_store import ClauseSink, VariableMap, T_IntClause
+from allsat_cnf.utils import negate, unique_everseen
+from .dimacs import DimacsInfo, DimacsWriter, HeaderMode
+
+
+@dataclass
+class AIG:
+    """An And-Inverter Graph, with literals encoded as in the AIGER format.
+
+    The variable of a literal `l` is `l // 2`, and the literal is negated if `l` is odd. Variable 0 is the
+    constant FALSE, variables 1..n_inputs are the inputs, and the following ones are the AND gates, in topological
+    order: the k-th row of `ands` holds the two input literals of the gate with variable n_inputs + 1 + k.
+    """
+    input_names: list[str]
+    ands: np.ndarray
+    outputs: list[int]
+
+    @property
+    def n_inputs(self) -> int:
+        return len(self.input_names)
+
+    @property
+    def n_vars(self) -> int:
+        return self.n_inputs + len(self.ands)
+
+    def input_symbols(self, mgr: FormulaManager) -> list[FNode]:
+        return [mgr.Symbol(name, BOOL) for name in self.input_names]
+
+    def to_pysmt_outputs(self, mgr: FormulaManager) -> list[FNode]:
+        """Builds the pysmt formulas of the outputs, sharing the nodes of common sub-circuits."""
+        nodes = [mgr.FALSE()]
+        nodes.extend(self.input_symbols(mgr))
+
+        def lit_node(lit: int) -> FNode:
+            node = nodes[lit >> 1]
+            return negate(node, mgr) if lit & 1 else node
+
+        for left, right in self.ands.tolist():
+            nodes.append(mgr.And(lit_node(left), lit_node(right)))
+        return [lit_node(lit) for lit in self.outputs]
+
+
+def read_aiger(filename: str) -> AIG:
+    """Reads a combinational circuit from an AIGER file, either in ASCII (.aag) or in binary (.aig) format.
+
+    The file is read with a single buffered read. ASCII circuits are renumbered so that inputs and AND gates
+    are numbered as in binary ones, which is always the case in the returned AIG.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    header_end = data.index(b"\n")
+    fmt, *counts = data[:header_end].split()
+    if fmt not in (b"aag", b"aig") or len(counts) < 5:
+        raise ValueError("Invalid AIGER header in {}".format(filename))
+    m, i, l, o, a, *extra = map(int, counts)
+    if l != 0:
+        raise ValueError("Latches are not supported")
+    if any(extra):
+        raise ValueError("Bad state, invariant constraint, justice and fairness properties are not supported")
+
+    if fmt == b"aag":
+        ands, outputs, symbols_start = _read_ascii(data, header_end + 1, m, i, o, a)
+    else:
+        ands, outputs, symbols_start = _read_binary(data, header_end + 1, i, o, a)
+    return AIG(_read_input_names(data, symbols_start, i), ands, outputs)
+
+
+def _read_ascii(data: bytes, start: int, m: int, i: int, o: int, a: int) -> tuple[np.ndarray, list[int], int]:
+    # the inputs, outputs and AND gates take one line each, with respectively 1, 1 and 3 numbers
+    end = start
+    for _ in range(i + o + a):
+        end = data.index(b"\n", end) + 1
+    numbers = np.fromstring(data[start:end].decode(), dtype=np.int64, sep=" ")
+    if len(numbers) != i + o + 3 * a:
+        raise ValueError("Invalid AIGER body: expected {} numbers, found {}".format(i + o + 3 * a, len(numbers)))
+    input_lits = numbers[:i]
+    outputs = numbers[i:i + o]
+    gates = numbers[i + o:].reshape(a, 3)
+    if np.any(input_lits & 1) or np.any(gates[:, 0] & 1):
+        raise ValueError("Inputs and AND gates must be defined by positive literals")
+
+    # renumber the variables: inputs first, then the AND gates in order of definition
+    new_var = np.full(m + 1, -1, dtype=np.int64)
+    new_var[0] = 0
+    new_var[input_lits >> 1] = np.arange(1, i + 1)
+    new_var[gates[:, 0] >> 1] = np.arange(i + 1, i + a + 1)
+
+    def renumber(lits: np.ndarray) -> np.ndarray:
+        variables = new_var[lits >> 1]
+        if np.any(variables < 0):
+            raise ValueError("Undefined variable in AIGER file")
+        return (variables << 1) | (lits & 1)
+
+    ands = renumber(gates[:, 1:])
+    if np.any(ands >> 1 >= np.arange(i + 1, i + a + 1)[:, None]):
+        raise ValueError("AND gates must be defined in topological order")
+    return ands, renumber(outputs).tolist(), end
+
+
+def _read_binary(data: bytes, start: int, i: int, o: int, a: int) -> tuple[np.ndarray, list[int], int]:
+    end = start
+    outputs = []
+    for _ in range(o):
+        line_end = data.index(b"\n", end)
+        outputs.append(int(data[end:line_end]))
+        end = line_end + 1
+
+    if a == 0:
+        return np.zeros((0, 2), dtype=np.int64), outputs, end
+
+    # each AND gate is encoded by the two differences lhs - rhs0 and rhs0 - rhs1, each as a sequence of 7-bit
+    # groups, least significant first, where the high bit of a byte is set if the number continues
+    buf = np.frombuffer(data, dtype=np.uint8, offset=end)
+    last_bytes = np.flatnonzero(buf < 0x80)[:2 * a]
+    if len(last_bytes) < 2 * a:
+        raise ValueError("Truncated AIGER file")
+    section_end = int(last_bytes[-1]) + 1
+    first_bytes = np.concatenate(([0], last_bytes[:-1] + 1))
+    # position of each byte within its number
+    position = np.arange(section_end) - np.repeat(first_bytes, last_bytes - first_bytes + 1)
+    groups = buf[:section_end].astype(np.uint64) & np.uint64(0x7F)
+    shifted = groups << (np.uint64(7) * position.astype(np.uint64))
+    deltas = np.bitwise_or.reduceat(shifted, first_bytes).astype(np.int64).reshape(a, 2)
+
+    lhs = 2 * np.arange(i + 1, i + a + 1, dtype=np.int64)
+    ands = np.empty((a, 2), dtype=np.int64)
+    ands[:, 0] = lhs - deltas[:, 0]
+    ands[:, 1] = ands[:, 0] - deltas[:, 1]
+    return ands, outputs, end + section_end
+
+
+def _read_input_names(data: bytes, start: int, i: int) -> list[str]:
+    names = [f"i{j}" for j in range(1, i + 1)]
+    for line in data[start:].split(b"\n"):
+        if line.startswith(b"c"):
+            # start of the comment section
+            break
+        if line.startswith(b"i"):
+            index, name = line[1:].split(b" ", 1)
+            names[int(index)] = name.decode()
+    return names
 
 
 class AIGAdapter:
@@ -19,85 +164,253 @@ class AIGAdapter:
     def __repr__(self):
         return self.aig.serialize()
 
-    @staticmethod
-    def _read_inputs(filename: str, mgr: FormulaManager) -> dict[int, FNode]:
-        inputs = {}
-        with open(filename, "r") as f:
-            fmt, m, i, l, o, a = f.readline().strip().split()
-            assert fmt == "aag"
-            for line in f:
-                if line.startswith("i"):
-                    index, name = line[1:].strip().split()
-                    inputs[int(index)] = mgr.Symbol(name, BOOL)
-        for index in range(1, int(i) + 1):
-            if index not in inputs:
-                inputs[index] = mgr.Symbol(f"i{index}")
-
-        return inputs
-
-    @staticmethod
-    def _parse_lit(lit: int) -> tuple[int, bool]:
-        return lit // 2, lit % 2 == 1
-
-    @classmethod
-    def _read_aag(cls, filename: str, inputs: dict[int, FNode], mgr: FormulaManager) -> FNode:
-        nodes = {0: mgr.FALSE()}
-        with open(filename, "r") as f:
-            # read first line
-            fmt, m, i, l, o, a = f.readline().strip().split()
-            m, i, l, o, a = map(int, (m, i, l, o, a))
-            assert l == 0, "Latches are not supported"
-            assert o == 1, "Only one output is supported"
-
-            # read inputs
-            for j in range(1, i + 1):
-                lit = int(f.readline().strip())
-                index, neg = cls._parse_lit(lit)
-                assert not neg, "Negated inputs are not supported"
-                nodes[index] = inputs[j]
-
-            # read outputs (only one supported)
-            lit = int(f.readline().strip())
-            output_idx, output_neg = cls._parse_lit(lit)
-            # read AND gates
-            for _ in range(a):
-                lit, left, right = map(int, f.readline().strip().split())
-                and_idx, and_neg = cls._parse_lit(lit)
-                left_idx, left_neg = cls._parse_lit(left)
-                right_idx, right_neg = cls._parse_lit(right)
-
-                left_node = nodes[left_idx]
-                if left_neg:
-                    left_node = negate(left_node, mgr)
-
-                right_node = nodes[right_idx]
-                if right_neg:
-                    right_node = negate(right_node, mgr)
-
-                and_node = mgr.And(left_node, right_node)
-                if and_neg:
-                    and_node = negate(and_node, mgr)
-
-                nodes[and_idx] = and_node
-
-        output_node = nodes[output_idx]
-        if output_neg:
-            output_node = negate(output_node, mgr)
-
-        return output_node
-
     @classmethod
     def from_file(cls, file: str, env: Environment | None = None):
+        """Reads the circuit in the file, whose formula is the conjunction of its outputs."""
         if env is None:
             env = get_env()
         mgr = env.formula_manager
 
-        if not file.endswith(".aag"):
-            raise ValueError("Only .aag files are supported")
-
-        inputs = cls._read_inputs(file, mgr)
+        if not (file.endswith(".aag") or file.endswith(".aig")):
+            raise ValueError("Only .aag and .aig files are supported")
 
-        return AIGAdapter(cls._read_aag(file, inputs, mgr), env)
+        outputs = read_aiger(file).to_pysmt_outputs(mgr)
+        return AIGAdapter(mgr.And(outputs), env)
 
     def to_pysmt(self) -> FNode:
         return self.aig
+
+
+_POS = 1
+_NEG = 2
+_DOUBLE = _POS | _NEG
+
+
+class AIGCNFizer:
+    """Converts the conjunction of the outputs of an AIG into CNF, straight from its gate array.
+
+    The conversion reproduces the one of `PolarityCNFizer` (or of `LabelCNFizer` if `tseitin` is set), without
+    NNF, on the formula built by `AIGAdapter`: the same clauses are produced in the same order, with the same
+    variables, so that the results are comparable with the ones obtained through pysmt. To this end, the
+    sub-circuits which are structurally equal are merged, as pysmt does, and the formula is walked in the same
+    order as pysmt's DAG walker. No pysmt node is built, apart from the input symbols. With `flatten`, the chains
+    of gates are merged into n-ary gates as done by `PolarityCNFizer` with `flatten`.
+    Literals of the AIG are used as node ids: `2v` is the v-th node, `2v + 1` its negation, 0 and 1 the constants
+    FALSE and TRUE; the conjunction of several outputs is the node after the last gate.
+    """
+
+    def __init__(self, tseitin: bool = False, label_neg_polarity: bool = False, flatten: bool = False):
+        self.tseitin = tseitin
+        self.label_neg_polarity = label_neg_polarity
+        self.flatten = flatten
+
+    def convert_to_sink(self, aig: AIG, sink: ClauseSink, inputs: list[FNode]) -> ClauseSink:
+        """Converts the AIG into CNF, passing each clause to the sink as soon as it is produced.
+        :param aig: The AIG to convert.
+        :param sink: The sink receiving the clauses. Its variable map is used to map inputs to variables.
+        :param inputs: The symbols of the inputs of the AIG.
+        :return: The sink.
+        """
+        top, left, right, outputs = self._merge_equal_gates(aig)
+        n_inputs = aig.n_inputs
+        top_node = 2 * (len(left) - 1)
+
+        def children(node: int) -> tuple[int, ...]:
+            var = node >> 1
+            if node & 1:
+                return (node - 1,) if var > 0 else ()
+            if node == top_node and len(outputs) > 1:
+                return tuple(outputs)
+            if var > n_inputs:
+                return left[var], right[var]
+            return ()
+
+        # as done by pysmt, the polarities are the ones of the circuit before the gates are merged
+        polarities = self._get_polarities(top, children, n_inputs, len(left))
+        if self.flatten:
+            children = self._flatten_children(top, children, n_inputs)
+        var_map = sink.var_map
+        mgr = var_map.mgr
+        memo = [0] * (2 * len(left))
+        pending: list[T_IntClause] = []
+        has_clauses = False
+
+        def flush(clauses: list[T_IntClause], tl: int = 0):
+            nonlocal has_clauses
+            if clauses:
+                has_clauses = True
+            simplified = (_simplify_clause(clause, tl, var_map) for clause in clauses)
+            for clause in unique_everseen(filter(None, simplified)):
+                sink.add_clause(clause)
+
+        stack = [(False, top)]
+        while stack:
+            was_expanded, node = stack.pop()
+            if not was_expanded:
+                stack.append((True, node))
+                stack.extend((False, c) for c in children(node) if not memo[c])
+                continue
+            if memo[node]:
+                continue
+            var = node >> 1
+            if node <= 1:
+                memo[node] = var_map.literal(mgr.TRUE() if node else mgr.FALSE())
+            elif node & 1:
+                memo[node] = -memo[node - 1]
+            elif var <= n_inputs:
+                memo[node] = var_map.literal(inputs[var - 1])
+            else:
+                args = [memo[c] for c in children(node)]
+                if len(args) == 1:
+                    # a flattened gate whose arguments are all equal
+                    memo[node] = args[0]
+                    continue
+                k = var_map.new_var()
+                pol = polarities[var]
+                if self.label_neg_polarity and pol == _NEG:
+                    k = -k
+                clauses = []
+                if pol & _POS:
+                    clauses += [(-k, a) for a in args]
+                if pol & _NEG:
+                    clauses += [tuple([k] + [-a for a in args])]
+                memo[node] = k
+                flush(pending)
+                pending = clauses
+
+        tl = memo[top]
+        flush(pending, tl)
+        if not has_clauses:
+            sink.add_clause([tl])
+        return sink
+
+    @staticmethod
+    def _merge_equal_gates(aig: AIG) -> tuple[int, list[int], list[int], list[int]]:
+        n_inputs = aig.n_inputs
+        # representative of each variable, and inputs of each representative gate
+        rep = list(range(n_inputs + 1))
+        left = [0] * (n_inputs + 1)
+        right = [0] * (n_inputs + 1)
+        table: dict[tuple[int, int], int] = {}
+        for a, b in aig.ands.tolist():
+            var = len(rep)
+            a = (rep[a >> 1] << 1) | (a & 1)
+            b = (rep[b >> 1] << 1) | (b & 1)
+            rep.append(table.setdefault((a, b), var))
+            left.append(a)
+            right.append(b)
+        outputs = [(rep[o >> 1] << 1) | (o & 1) for o in aig.outputs]
+        # the conjunction of the outputs, if any
+        left.append(0)
+        right.append(0)
+        if len(outputs) == 1:
+            top = outputs[0]
+        elif outputs:
+            top = 2 * (len(left) - 1)
+        else:
+            top = 1
+        return top, left, right, outputs
+
+    @staticmethod
+    def _flatten_children(top: int, children: Callable[[int], tuple[int, ...]],
+                          n_inputs: int) -> Callable[[int], tuple[int, ...]]:
+        """Returns the children of each node once the gates with a single parent are merged into their parent gate."""
+        # parents of each node in the DAG, as counted by pysmt: a negated node is the only parent of its gate
+        n_parents = Counter()
+        stack = [top]
+        seen = {top}
+        while stack:
+            node = stack.pop()
+            for c in children(node):
+                n_parents[c] += 1
+                if c not in seen:
+                    seen.add(c)
+                    stack.append(c)
+
+        def is_gate(node: int) -> bool:
+            return not node & 1 and node >> 1 > n_inputs
+
+        flat: dict[int, tuple[int, ...]] = {}
+
+        def flat_children(node: int) -> tuple[int, ...]:
+            if not is_gate(node):
+                return children(node)
+            args = flat.get(node)
+            if args is None:
+                args = []
+                to_merge = list(reversed(children(node)))
+                while to_merge:
+                    c = to_merge.pop()
+                    if is_gate(c) and n_parents[c] == 1:
+                        to_merge.extend(reversed(children(c)))
+                    elif c == 0:
+                        # FALSE absorbs the gate, TRUE is dropped
+                        args = [c]
+                        break
+                    elif c != 1:
+                        args.append(c)
+                args = flat[node] = tuple(unique_everseen(args)) or (1,)
+            return args
+
+        return flat_children
+
+    def _get_polarities(self, top: int, children, n_inputs: int, n_nodes: int) -> list[int]:
+        polarities = [0] * n_nodes
+        polarities[top >> 1] = _NEG if top & 1 else _POS
+        # parents have higher variables than their children
+        for var in range(n_nodes - 1, n_inputs, -1):
+            pol = polarities[var]
+            if not pol:
+                continue
+            if self.tseitin:
+                pol = polarities[var] = _DOUBLE
+            flipped = ((pol & _POS) << 1) | ((pol & _NEG) >> 1)
+            for c in children(2 * var):
+                polarities[c >> 1] |= flipped if c & 1 else pol
+        return polarities
+
+    @staticmethod
+    def support(aig: AIG) -> list[int]:
+        """Returns the variables of the inputs on which the outputs depend."""
+        n_inputs = aig.n_inputs
+        reached = bytearray(aig.n_vars + 1)
+        for o in aig.outputs:
+            reached[o >> 1] = 1
+        gates = aig.ands.tolist()
+        for var in range(aig.n_vars, n_inputs, -1):
+            if reached[var]:
+                a, b = gates[var - n_inputs - 1]
+                reached[a >> 1] = reached[b >> 1] = 1
+        return [var for var in range(1, n_inputs + 1) if reached[var]]
+
+
+def _simplify_clause(clause: T_IntClause, tl: int, var_map: VariableMap) -> T_IntClause | None:
+    # same simplification as PolarityCNFizer._simplify_clause
+    true_var = var_map.true_var
+    simp = []
+    for lit in clause:
+        if lit == true_var or -lit in simp or lit == tl:
+            return None
+        elif lit != -tl and lit != -true_var:
+            simp.append(lit)
+    if not simp:
+        return (var_map.literal(var_map.mgr.FALSE()),)
+    return tuple(unique_everseen(simp))
+
+
+def write_aig_dimacs(f: TextIO, aig: AIG, cnfizer: AIGCNFizer, header_mode: HeaderMode = HeaderMode.ZERO_TERMINATED,
+                     environment=None) -> tuple[DimacsInfo, set[FNode]]:
+    """Converts the AIG into CNF and streams it to a DIMACS file, as `write_dimacs` does for its pysmt formula.
+
+    The projected variables are the inputs on which the outputs depend, numbered first, in order of their names.
+    :return: The information on the DIMACS file and the projected variables.
+    """
+    var_map = VariableMap(environment)
+    inputs = aig.input_symbols(var_map.mgr)
+    projected_vars = {inputs[var - 1] for var in AIGCNFizer.support(aig)}
+    for var in sorted(projected_vars, key=str):
+        var_map.literal(var)
+    writer = DimacsWriter(f, var_map, projected_vars, header_mode)
+    cnfizer.convert_to_sink(aig, writer, inputs)
+    writer.close()
+    return DimacsInfo(var_map.atoms(), writer.n_vars, writer.n_clauses), projected_vars
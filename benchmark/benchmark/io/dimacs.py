@@ -1,12 +1,19 @@
-import math
 import re
+import warnings
+from array import array
+from dataclasses import dataclass
 from enum import Enum
-from typing import Generator, TextIO, Iterable
+from typing import Generator, TextIO, Iterable, BinaryIO
 
+import numpy as np
+
+from pysmt.environment import get_env
 from pysmt.fnode import FNode
-from pysmt.shortcuts import get_free_variables, And, Or, Symbol
+from pysmt.shortcuts import get_free_variables, Or
 from pysmt.typing import BOOL
 
+from allsat_cnf.clause_store import ClauseStore, ClauseSink, VariableMap, T_IntClause
+from allsat_cnf.polarity_cnfizer import PolarityCNFizer
 from allsat_cnf.utils import is_cnf, get_clauses, get_literals, negate
 
 
@@ -58,61 +65,232 @@ def pysmt_to_dimacs(formula: FNode, projected_vars: Iterable[FNode], var_map: di
     clauses = get_clauses(formula)
     n_clauses = len(clauses)
     pv = sorted(var_map[var] for var in projected_vars)
+    yield from dimacs_header(n_vars, n_clauses, pv, header_mode)
+    for clause in clauses:
+        yield clause_to_dimacs(clause, var_map)
+
+
+def clause_store_to_dimacs(store: ClauseStore, projected_vars: Iterable[FNode],
+                           header_mode: HeaderMode = HeaderMode.ZERO_TERMINATED) -> Generator[str, None, None]:
+    """Converts a CNF stored as integer literals to the DIMACS format.
+
+    The variables of the store are used as DIMACS variables, so that no pysmt node is built.
+    Yields lines of the DIMACS format.
+    """
+    assert all(atom.is_symbol(BOOL) or atom.is_bool_constant() for atom in store.var_map.atoms())
+    # projected variables not occurring in the CNF are added to the variable map
+    pv = sorted(store.var_map.literal(var) for var in projected_vars)
+    true_clauses = constant_clauses(store.var_map)
+    yield from dimacs_header(store.n_vars, len(store) + len(true_clauses), pv, header_mode)
+    for clause in store:
+        yield f"{' '.join(map(str, clause))} 0\n"
+    for clause in true_clauses:
+        yield f"{' '.join(map(str, clause))} 0\n"
+
+
+def constant_clauses(var_map: VariableMap) -> list[T_IntClause]:
+    """Returns the unit clause forcing the variable of TRUE, if TRUE is mapped.
+
+    DIMACS has no constants, so TRUE is written as an ordinary variable, which would be unconstrained without it:
+    e.g. the CNF of FALSE, the unit clause of the negated variable of TRUE, would be satisfiable.
+    """
+    return [(var_map.true_var,)] if var_map.true_var else []
+
+
+def dimacs_header(n_vars: int, n_clauses: int, projected_ids: list[int],
+                  header_mode: HeaderMode) -> Generator[str, None, None]:
     match header_mode:
         case HeaderMode.WITH_NUM_PROJECTED_VARS:
-            yield f"p cnf {n_vars} {n_clauses} {len(projected_vars)}\n"
-            yield f"c p show {' '.join(map(str, pv))}\n"
+            yield f"p cnf {n_vars} {n_clauses} {len(projected_ids)}\n"
+            yield f"c p show {' '.join(map(str, projected_ids))}\n"
         case HeaderMode.ZERO_TERMINATED:
             yield f"p cnf {n_vars} {n_clauses}\n"
-            yield f"c p show {' '.join(map(str, pv))} 0\n"
-    for clause in clauses:
-        yield clause_to_dimacs(clause, var_map)
+            yield f"c p show {' '.join(map(str, projected_ids))} 0\n"
 
 
-RE_HEADER = re.compile(r"p cnf (\d+) (\d+)")
-RE_PROJECTION = re.compile(r"c p show (.+) 0")
-RE_CLAUSE = re.compile(r"(-?\d+ )+0")
+@dataclass
+class DimacsInfo:
+    var_map: dict[FNode, int]
+    n_vars: int
+    n_clauses: int
 
+    @classmethod
+    def from_store(cls, store: ClauseStore) -> "DimacsInfo":
+        """Returns the information on the DIMACS file written from the store by `write_dimacs_from_store`."""
+        return cls(store.var_map.atoms(), store.n_vars, len(store) + len(constant_clauses(store.var_map)))
 
-def dimacs_to_pysmt(dimacs_file: TextIO) -> tuple[FNode, set[FNode], dict[int, FNode]]:
-    """Reads a exetenal CNF file in DIMACS format and returns a pysmt formula."""
-    var_map = {}
-    clauses = []
-    projected_vars = set()
-
-    ii = iter(dimacs_file)
-    # read header
-    for line in ii:
-        m = RE_HEADER.match(line)
-        if m is not None:
-            n_vars, n_clauses = map(int, m.groups())
-            break
-    else:
-        raise ValueError("Header not found")
 
-    n_digits_dec = int(math.log10(n_vars) + 1)
-    var_name_template = f"v{{:0{n_digits_dec}d}}"
+class DimacsWriter(ClauseSink):
+    """Writes the clauses it receives to a DIMACS file as soon as they are produced.
 
-    var_map = {i + 1: Symbol(var_name_template.format(i + 1), BOOL) for i in range(n_vars)}
+    Since the number of variables and clauses is known only at the end, a fixed-width header is reserved
+    at the beginning of the file and rewritten by `close`, so the file must be seekable.
+    """
+    HEADER_WIDTH = 64
 
-    # read projection
-    for line in ii:
-        m = RE_PROJECTION.match(line)
-        if m is not None:
-            projected_vars = {var_map[int(var)] for var in m.group(1).split()}
-            break
-    else:
-        raise ValueError("Projection not found")
+    def __init__(self, f: TextIO, var_map: VariableMap, projected_vars: Iterable[FNode],
+                 header_mode: HeaderMode = HeaderMode.ZERO_TERMINATED):
+        super().__init__(var_map)
+        self.f = f
+        self.header_mode = header_mode
+        self.n_clauses = 0
+        self.projected_ids = sorted(var_map.literal(var) for var in projected_vars)
+        self._header_start = f.tell()
+        self._write_header()
+
+    def add_clause(self, clause: Iterable[int]):
+        self.f.write(f"{' '.join(map(str, clause))} 0\n")
+        self.n_clauses += 1
+
+    def close(self):
+        assert all(atom.is_symbol(BOOL) or atom.is_bool_constant() for atom in self.var_map.atoms())
+        for clause in constant_clauses(self.var_map):
+            self.add_clause(clause)
+        end = self.f.tell()
+        self.f.seek(self._header_start)
+        self._write_header()
+        self.f.seek(end)
+        self.f.flush()
+
+    def _write_header(self):
+        problem_line, *lines = dimacs_header(self.n_vars, self.n_clauses, self.projected_ids, self.header_mode)
+        self.f.write(problem_line[:-1].ljust(self.HEADER_WIDTH) + "\n")
+        self.f.writelines(lines)
+
+
+def write_dimacs(f: TextIO, formula: FNode, projected_vars: Iterable[FNode], cnfizer: PolarityCNFizer,
+                 header_mode: HeaderMode = HeaderMode.ZERO_TERMINATED) -> DimacsInfo:
+    """Converts a formula into CNF and streams it to a DIMACS file while the formula is walked.
 
-    # read clauses
-    for line in ii:
-        m = RE_CLAUSE.match(line)
-        if m is None:
-            continue
-        clause = dimacs_to_clause(line, var_map)
-        clauses.append(clause)
-    assert len(clauses) == n_clauses, f"Expected {n_clauses} clauses, got {len(clauses)}"
+    Projected variables are numbered first, from 1, in order of their names.
+    """
+    var_map = VariableMap(cnfizer.env)
+    for var in sorted(projected_vars, key=str):
+        var_map.literal(var)
+    writer = DimacsWriter(f, var_map, projected_vars, header_mode)
+    cnfizer.convert_to_sink(formula, writer)
+    writer.close()
+    return DimacsInfo(var_map.atoms(), writer.n_vars, writer.n_clauses)
+
+
+def write_dimacs_from_store(f: TextIO, store: ClauseStore, projected_vars: Iterable[FNode],
+                            header_mode: HeaderMode = HeaderMode.ZERO_TERMINATED) -> DimacsInfo:
+    """Writes a CNF stored as integer literals to a DIMACS file, keeping the variables of the store."""
+    f.writelines(clause_store_to_dimacs(store, projected_vars, header_mode))
+    f.flush()
+    return DimacsInfo.from_store(store)
+
+
+RE_HEADER = re.compile(r"^p cnf (\d+) (\d+)", re.MULTILINE)
+RE_PROJECTION = re.compile(r"^c p show([\d \t]*)$", re.MULTILINE)
+RE_COMMENT = re.compile(r"^c.*$", re.MULTILINE)
+RE_END = re.compile(r"^%", re.MULTILINE)
+
+
+@dataclass
+class DimacsCNF:
+    """A CNF read from a DIMACS file, stored as a flat array of integer literals plus the clause offsets.
+
+    No pysmt node is built until `to_store` or `to_pysmt` is called.
+    """
+    n_vars: int
+    literals: np.ndarray
+    offsets: np.ndarray
+    projected_ids: list[int] | None = None
+
+    @property
+    def n_clauses(self) -> int:
+        return len(self.offsets) - 1
+
+    def clause(self, i: int) -> T_IntClause:
+        return tuple(self.literals[self.offsets[i]:self.offsets[i + 1]].tolist())
+
+    def clause_lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def stats(self) -> dict[str, int | float]:
+        lengths = self.clause_lengths()
+        return {
+            "n_vars": self.n_vars,
+            "n_clauses": self.n_clauses,
+            "n_literals": len(self.literals),
+            "n_occurring_vars": len(np.unique(np.abs(self.literals))),
+            "n_unit_clauses": int(np.count_nonzero(lengths == 1)),
+            "max_clause_length": int(lengths.max(initial=0)),
+            "avg_clause_length": float(lengths.mean()) if len(lengths) > 0 else 0.,
+        }
+
+    def symbols(self, environment=None) -> dict[int, FNode]:
+        """Returns the pysmt symbols of the variables, named `v<id>` with ids padded to the same width."""
+        mgr = (environment or get_env()).formula_manager
+        n_digits_dec = len(str(self.n_vars))
+        var_name_template = f"v{{:0{n_digits_dec}d}}"
+        return {i: mgr.Symbol(var_name_template.format(i), BOOL) for i in range(1, self.n_vars + 1)}
 
-    cnf = And(clauses)
+    def to_store(self, environment=None) -> ClauseStore:
+        var_map = VariableMap.from_atoms(
+            {symbol: i for i, symbol in self.symbols(environment).items()}, self.n_vars, environment)
+        store = ClauseStore(var_map)
+        store.literals = array("i", self.literals.astype(np.int32).tobytes())
+        store.offsets = array("q", self.offsets.astype(np.int64).tobytes())
+        return store
 
-    return cnf, projected_vars, var_map
+    def to_pysmt(self, environment=None) -> tuple[FNode, set[FNode], dict[int, FNode]]:
+        """Builds the pysmt formula, the projected symbols and the mapping from the variables to the symbols."""
+        if self.projected_ids is None:
+            raise ValueError("Projection not found")
+        store = self.to_store(environment)
+        var_map = {i: store.var_map.to_fnode(i) for i in range(1, self.n_vars + 1)}
+        return store.as_formula(), {var_map[i] for i in self.projected_ids}, var_map
+
+
+def read_dimacs(dimacs_file: TextIO | BinaryIO) -> DimacsCNF:
+    """Reads a CNF file in DIMACS format, parsing all the clauses at once into integer arrays.
+
+    Clauses may span several lines, and comment lines may appear anywhere.
+    A line starting with `%` ends the clauses, as in the SATLIB benchmarks.
+    """
+    text = dimacs_file.read()
+    if isinstance(text, bytes):
+        text = text.decode()
+
+    m = RE_HEADER.search(text)
+    if m is None:
+        raise ValueError("Header not found")
+    n_vars, n_clauses = map(int, m.groups())
+    preamble, body = text[:m.start()], text[text.find("\n", m.end()) + 1 or len(text):]
+
+    projected_ids = None
+    m = RE_PROJECTION.search(body) or RE_PROJECTION.search(preamble)
+    if m is not None:
+        # the projection is either zero-terminated or preceded by the number of projected variables
+        projected_ids = [int(var) for var in m.group(1).split() if var != "0"]
+
+    if (m := RE_END.search(body)) is not None:
+        body = body[:m.start()]
+    body = RE_COMMENT.sub("", body).strip()
+    with warnings.catch_warnings():
+        # older versions of numpy only warn when the text is not made of integers
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            # an empty text would be parsed as a single 0
+            numbers = np.fromstring(body, dtype=np.int64, sep=" ") if body else np.empty(0, dtype=np.int64)
+        except (ValueError, DeprecationWarning) as e:
+            raise ValueError("Malformed clauses") from e
+
+    ends = np.flatnonzero(numbers == 0)
+    if len(numbers) > 0 and numbers[-1] != 0:
+        raise ValueError("Last clause is not terminated by 0")
+    if len(ends) != n_clauses:
+        raise ValueError(f"Expected {n_clauses} clauses, got {len(ends)}")
+    literals = numbers[numbers != 0]
+    if len(literals) > 0 and np.abs(literals).max() > n_vars:
+        raise ValueError(f"Variable out of range, expected at most {n_vars}")
+    # the end of the i-th clause in the literals is its position in the numbers minus the i preceding zeros
+    offsets = np.concatenate(([0], ends - np.arange(len(ends))))
+    return DimacsCNF(n_vars, literals.astype(np.int32), offsets, projected_ids)
+
+
+def dimacs_to_pysmt(dimacs_file: TextIO) -> tuple[FNode, set[FNode], dict[int, FNode]]:
+    """Reads a exetenal CNF file in DIMACS format and returns a pysmt formula."""
+    return read_dimacs(dimacs_file).to_pysmt()
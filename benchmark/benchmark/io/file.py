@@ -43,29 +43,89 @@ def check_output_can_be_created(output_path):
         print("'{}' does not exists, creating it...".format(path))
 
 
-def write_result(args, res, output_file):
-    if not os.path.exists(output_file):
-        with_repetitions = args.with_repetitions if "with_repetitions" in args else False
-        info = {
-            "mode": args.mode,
-            "with_repetitions": with_repetitions,
-            "results": [res]
-        }
-    else:
-        with open(output_file, 'r') as f:
-            info = json.load(f)
-        info["results"].append(res)
+RESULT_LOG_EXT = ".jsonl"
+
 
-    with open(output_file, 'w') as f:
-        json.dump(info, f, indent=4)
+class ResultLog:
+    """Append-only log of the results of a run, stored as JSON lines next to the JSON output file.
 
+    The first line holds the header of the run (mode and with_repetitions), and each following line holds one
+    result. A result is appended with a single write, so that a run killed while writing loses at most that result,
+    and the filenames of the results are kept in memory, so that checking whether an instance was already computed
+    does not read the log again. `export` writes the results to the output file, in the JSON layout read by
+    plot.py and check_results.py.
+    When the log already exists, the header is read from it, and the given mode is ignored.
+    """
 
-def result_exists(output_file, filename):
-    if not os.path.exists(output_file):
-        return False
-    with open(output_file, 'r') as f:
-        info = json.load(f)
-    return any(r["filename"] == filename for r in info["results"])
+    def __init__(self, output_file: str, mode: str | None = None, with_repetitions: bool = False):
+        self.output_file = output_file
+        self.log_file = os.path.splitext(output_file)[0] + RESULT_LOG_EXT
+        self.header = {"mode": mode, "with_repetitions": with_repetitions}
+        self._filenames: set[str] = set()
+        if os.path.exists(self.log_file):
+            self._load()
+        else:
+            results = []
+            if os.path.exists(output_file):
+                # resume a run whose results were only written to the JSON output file
+                with open(output_file, 'r') as f:
+                    info = json.load(f)
+                self.header = {"mode": info["mode"], "with_repetitions": info["with_repetitions"]}
+                results = info["results"]
+            with open(self.log_file, 'w') as f:
+                for record in [self.header] + results:
+                    f.write(json.dumps(record) + "\n")
+            self._filenames.update(res["filename"] for res in results)
+
+    def _load(self):
+        with open(self.log_file, 'rb+') as f:
+            valid_end = 0
+            for i, line in enumerate(f):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                if i == 0:
+                    self.header = record
+                else:
+                    self._filenames.add(record["filename"])
+                valid_end += len(line)
+            # drop a result left incomplete by an interrupted write
+            f.truncate(valid_end)
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self._filenames
+
+    def __len__(self) -> int:
+        return len(self._filenames)
+
+    def append(self, res: dict):
+        line = json.dumps(res) + "\n"
+        with open(self.log_file, 'a') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._filenames.add(res["filename"])
+
+    def results(self) -> list[dict]:
+        with open(self.log_file, 'r') as f:
+            next(f)
+            return [json.loads(line) for line in f]
+
+    def export(self):
+        """Writes the results to the output file, replacing it atomically."""
+        info = dict(self.header, results=self.results())
+        tmp_file = self.output_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(info, f, indent=4)
+        os.replace(tmp_file, self.output_file)
+
+
+def open_result_log(args, output_file) -> ResultLog:
+    with_repetitions = args.with_repetitions if "with_repetitions" in args else False
+    return ResultLog(output_file, args.mode, with_repetitions)
 
 
 def read_formula_from_file(filename):
@@ -0,0 +1,152 @@
+import argparse
+import hashlib
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import Enum
+from tempfile import NamedTemporaryFile, mkdtemp
+from typing import Callable, Iterable, Iterator, TextIO
+
+
+class InputMode(Enum):
+    """How the input of a solver is handed to it.
+
+    FILE writes the whole input to a temporary file before the solver starts, and is needed by solvers seeking in
+    their input. STDIN and FIFO stream the input while the solver reads it, without touching the disk: the solver
+    reads either its standard input, through the path /dev/stdin, or a named pipe.
+    """
+    FILE = "file"
+    STDIN = "stdin"
+    FIFO = "fifo"
+
+
+@dataclass
+class SolverInput:
+    """The input of a solver: the path to give it and, if the input is streamed to its standard input, the file
+    descriptor to use as stdin. If requested, the SHA-256 digest of the input is computed before the solver starts,
+    e.g. to look up its result in a cache."""
+    name: str
+    stdin: int | None = None
+    digest: str | None = None
+
+
+class _HashingFile:
+    """A text file computing the digest of what is written to it, without storing it."""
+
+    def __init__(self):
+        self.hash = hashlib.sha256()
+
+    def write(self, s: str):
+        self.hash.update(s.encode())
+
+    def writelines(self, lines: Iterable[str]):
+        for line in lines:
+            self.hash.update(line.encode())
+
+    def flush(self):
+        pass
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+
+class _InputWriter(threading.Thread):
+    """Writes the input of a solver to a pipe, while the solver reads it."""
+
+    def __init__(self, open_pipe: Callable[[], TextIO], write: Callable[[TextIO], object]):
+        super().__init__(daemon=True)
+        self.open_pipe = open_pipe
+        self.write = write
+        self.error: BaseException | None = None
+
+    def run(self):
+        try:
+            with self.open_pipe() as f:
+                self.write(f)
+        except BrokenPipeError:
+            # the solver stopped reading, e.g. because it failed or timed out: its own error is reported instead
+            pass
+        except BaseException as e:
+            self.error = e
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError("Failed to write the input of the solver") from self.error
+
+
+@contextmanager
+def solver_input(write: Callable[[TextIO], object], input_mode: InputMode = InputMode.FILE,
+                 tmp_dir: str | None = None, suffix: str = ".cnf", digest: bool = False) -> Iterator[SolverInput]:
+    """Provides the input written by `write` to a solver run within the context.
+
+    With InputMode.FILE, the input is written before entering the context. Otherwise, it is written by a thread
+    while the solver reads it, so the solver must be run exactly once within the context, and `write` must not
+    need to seek in the file.
+    :param digest: Whether to compute the digest of the input. The file is read back with InputMode.FILE, while the
+        streamed inputs are written twice, first only to compute their digest.
+    """
+    if input_mode == InputMode.FILE:
+        with NamedTemporaryFile("w", dir=tmp_dir, suffix=suffix) as f:
+            write(f)
+            f.flush()
+            yield SolverInput(f.name, digest=_file_digest(f.name) if digest else None)
+        return
+
+    input_digest = None
+    if digest:
+        hashing_file = _HashingFile()
+        write(hashing_file)
+        input_digest = hashing_file.hexdigest()
+
+    if input_mode == InputMode.STDIN:
+        read_fd, write_fd = os.pipe()
+        writer = _InputWriter(lambda: open(write_fd, "w"), write)
+        writer.start()
+        try:
+            yield SolverInput("/dev/stdin", read_fd, input_digest)
+        finally:
+            # if the solver did not read all its input, the writer gets a broken pipe once no reader is left
+            os.close(read_fd)
+            writer.join()
+        writer.check()
+        return
+
+    fifo_dir = mkdtemp(dir=tmp_dir)
+    try:
+        fifo = os.path.join(fifo_dir, "input" + suffix)
+        os.mkfifo(fifo)
+        # opening the FIFO for writing blocks until the solver opens it for reading
+        writer = _InputWriter(lambda: open(fifo, "w"), write)
+        writer.start()
+        try:
+            yield SolverInput(fifo, digest=input_digest)
+        finally:
+            if writer.is_alive():
+                # unblock the writer if the solver did not open the FIFO, or did not read all of it
+                fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+                writer.join(0.1)
+                os.close(fd)
+            writer.join()
+        writer.check()
+    finally:
+        shutil.rmtree(fifo_dir, ignore_errors=True)
+
+
+def _file_digest(filename: str) -> str:
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def add_input_mode_argument(parser: argparse.ArgumentParser):
+    parser.add_argument('--input-mode', choices=[m.value for m in InputMode], default=InputMode.FILE.value,
+                        help='How the DIMACS input is handed to the solver: written to a temporary file, or streamed '
+                             'through its standard input or a named pipe without touching the disk (default: file)')
+
+
+def get_input_mode(args) -> InputMode:
+    return InputMode(args.input_mode)
@@ -0,0 +1,32 @@
+from io import StringIO
+from typing import Iterable
+
+import pysmt.smtlib.commands as smtcmd
+from pysmt.fnode import FNode
+from pysmt.smtlib.parser import SmtLibParser
+from pysmt.smtlib.script import SmtLibScript
+
+
+def formulas_to_smtlib(formulas: Iterable[FNode]) -> str:
+    """Serializes a list of formulas as an SMT-LIB script, declaring their symbols and asserting each formula.
+
+    The formulas are printed as DAGs, so that shared sub-formulas are printed once per formula.
+    """
+    formulas = list(formulas)
+    script = SmtLibScript()
+    symbols = set()
+    for f in formulas:
+        symbols.update(f.get_free_variables())
+    for symbol in sorted(symbols, key=lambda x: x.symbol_name()):
+        script.add(smtcmd.DECLARE_FUN, [symbol])
+    for f in formulas:
+        script.add(smtcmd.ASSERT, [f])
+    buf = StringIO()
+    script.serialize(buf, daggify=True)
+    return buf.getvalue()
+
+
+def smtlib_to_formulas(text: str, environment=None) -> list[FNode]:
+    """Reads back the formulas serialized by `formulas_to_smtlib`, in the same order."""
+    script = SmtLibParser(environment).get_script(StringIO(text))
+    return [cmd.args[0] for cmd in script.filter_by_command_name(smtcmd.ASSERT)]
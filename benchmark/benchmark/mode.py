@@ -17,4 +17,14 @@ class Mode(enum.Enum):
     IF_LABELNEG_POL = "IF_LABELNEG_POL"
     IF_NNF_MUTEX_POL = "IF_NNF_MUTEX_POL"
 
+    STRASH_LAB = "STRASH_LAB"
+    STRASH_POL = "STRASH_POL"
+    STRASH_LABELNEG_POL = "STRASH_LABELNEG_POL"
+    STRASH_NNF_MUTEX_POL = "STRASH_NNF_MUTEX_POL"
+
+    FLAT_LAB = "FLAT_LAB"
+    FLAT_POL = "FLAT_POL"
+    FLAT_LABELNEG_POL = "FLAT_LABELNEG_POL"
+    FLAT_NNF_MUTEX_POL = "FLAT_NNF_MUTEX_POL"
+
     TTA = "TTA"
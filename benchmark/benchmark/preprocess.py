@@ -1,26 +1,141 @@
-from typing import Iterable
+from contextlib import contextmanager
+from typing import Iterable, Iterator, TextIO
 
 from pysmt.fnode import FNode
 
+from allsat_cnf.clause_store import ClauseStore, VariableMap
 from allsat_cnf.label_cnfizer import LabelCNFizer
 from allsat_cnf.polarity_cnfizer import PolarityCNFizer
 from allsat_cnf.utils import get_boolean_variables, get_lra_atoms, is_cnf
+from .io.aig import AIGCNFizer, read_aiger
+from .io.dimacs import DimacsInfo
+from .io.file import read_formula_from_file
+from .io.pipe import InputMode, SolverInput, solver_input
 from .run import PreprocessOptions
 
 
 def preprocess_formula(phi, preprocess_options: PreprocessOptions) -> tuple[FNode, Iterable[FNode]]:
-    atoms = get_boolean_variables(phi).union(
+    atoms = get_projected_atoms(phi)
+    phi = get_cnfizer(preprocess_options).convert_as_formula(phi)
+    assert is_cnf(phi)
+
+    return phi, atoms
+
+
+def get_projected_atoms(phi: FNode) -> set[FNode]:
+    return get_boolean_variables(phi).union(
         {a for a in get_lra_atoms(phi) if not a.is_equals()}  # NOTICE: exclude equalities for WMI problems
     )
 
+
+def get_cnfizer(preprocess_options: PreprocessOptions) -> PolarityCNFizer:
     if preprocess_options.cnf_type == "POL":
-        phi = PolarityCNFizer(nnf=preprocess_options.do_nnf, mutex_nnf_labels=preprocess_options.mutex_nnf_labels,
-                              label_neg_polarity=preprocess_options.label_neg_polarity).convert_as_formula(phi)
+        return PolarityCNFizer(nnf=preprocess_options.do_nnf, mutex_nnf_labels=preprocess_options.mutex_nnf_labels,
+                               label_neg_polarity=preprocess_options.label_neg_polarity,
+                               strash=preprocess_options.strash, flatten=preprocess_options.flatten)
     elif preprocess_options.cnf_type == "LAB":
-        phi = LabelCNFizer(nnf=preprocess_options.do_nnf,
-                           mutex_nnf_labels=preprocess_options.mutex_nnf_labels).convert_as_formula(phi)
+        return LabelCNFizer(nnf=preprocess_options.do_nnf, mutex_nnf_labels=preprocess_options.mutex_nnf_labels,
+                            strash=preprocess_options.strash, flatten=preprocess_options.flatten)
     else:
         raise ValueError("Unknown CNF type: {}".format(preprocess_options.cnf_type))
-    assert is_cnf(phi)
 
-    return phi, atoms
+
+def get_aig_cnfizer(preprocess_options: PreprocessOptions) -> AIGCNFizer | None:
+    """Returns the encoder converting AIGs straight into CNF, or None if it does not support the options (NNF,
+    structural hashing), in which case the AIG is converted through pysmt."""
+    if preprocess_options.do_nnf or preprocess_options.strash:
+        return None
+    if preprocess_options.cnf_type == "POL":
+        return AIGCNFizer(label_neg_polarity=preprocess_options.label_neg_polarity,
+                          flatten=preprocess_options.flatten)
+    elif preprocess_options.cnf_type == "LAB":
+        return AIGCNFizer(tseitin=True, flatten=preprocess_options.flatten)
+    else:
+        raise ValueError("Unknown CNF type: {}".format(preprocess_options.cnf_type))
+
+
+def is_aiger_file(filename: str) -> bool:
+    return filename.endswith(".aag") or filename.endswith(".aig")
+
+
+def convert_file_to_store(filename: str, preprocess_options: PreprocessOptions) -> tuple[ClauseStore, set[FNode]]:
+    """Converts the formula in the file into CNF, numbering the projected atoms first, as `write_dimacs` does.
+    :return: The CNF and the projected atoms.
+    """
+    aig_cnfizer = get_aig_cnfizer(preprocess_options) if is_aiger_file(filename) else None
+    store = ClauseStore()
+    if aig_cnfizer is not None:
+        aig = read_aiger(filename)
+        inputs = aig.input_symbols(store.var_map.mgr)
+        atoms = {inputs[var - 1] for var in AIGCNFizer.support(aig)}
+    else:
+        phi = read_formula_from_file(filename)
+        atoms = get_projected_atoms(phi)
+    for var in sorted(atoms, key=str):
+        store.var_map.literal(var)
+    if aig_cnfizer is not None:
+        aig_cnfizer.convert_to_sink(aig, store, inputs)
+    else:
+        get_cnfizer(preprocess_options).convert_to_sink(phi, store)
+    return store, atoms
+
+
+def get_input_store(filename: str, preprocess_options: PreprocessOptions,
+                    cnf_cache=None) -> tuple[ClauseStore, set[FNode]]:
+    """Returns the CNF of the formula in the file, taken from the cache if given and computed by
+    `convert_file_to_store` otherwise, so that the CNF is the same with and without the cache.
+    :param cnf_cache: The `CNFCache` to use, if any.
+    :return: The CNF and the projected atoms.
+    """
+    if cnf_cache is not None:
+        cnf = cnf_cache.get(filename, preprocess_options)
+        return cnf.store, cnf.projected_atoms
+    return convert_file_to_store(filename, preprocess_options)
+
+
+def write_input_dimacs(solver, f: TextIO, filename: str, preprocess_options: PreprocessOptions,
+                       cnf_cache=None) -> tuple[DimacsInfo, set[FNode]]:
+    """Writes the CNF of the formula in the file to the DIMACS file given as input to the solver.
+
+    The CNF is taken from the cache, if given. Otherwise, AIGs are converted straight from their gate array when
+    the options allow it, and the other formulas are converted through pysmt.
+    :param solver: The interface of the solver, e.g. `D4Interface` or `TabularAllSATInterface`.
+    :param cnf_cache: The `CNFCache` to use, if any.
+    :return: The information on the DIMACS file and the projected atoms.
+    """
+    if cnf_cache is not None:
+        cnf = cnf_cache.get(filename, preprocess_options)
+        return solver.write_dimacs_from_store(f, cnf.store, cnf.projected_atoms), cnf.projected_atoms
+    aig_cnfizer = get_aig_cnfizer(preprocess_options) if is_aiger_file(filename) else None
+    if aig_cnfizer is not None:
+        return solver.write_aig_dimacs(f, read_aiger(filename), aig_cnfizer)
+    phi = read_formula_from_file(filename)
+    atoms = get_projected_atoms(phi)
+    return solver.write_dimacs(f, phi, atoms, get_cnfizer(preprocess_options)), atoms
+
+
+@contextmanager
+def open_input_dimacs(solver, filename: str, preprocess_options: PreprocessOptions,
+                      input_mode: InputMode = InputMode.FILE, tmp_dir: str | None = None,
+                      cnf_cache=None, digest: bool = False) -> Iterator[tuple[SolverInput, DimacsInfo, set[FNode]]]:
+    """Provides the CNF of the formula in the file as the DIMACS input of the solver run within the context.
+
+    With InputMode.FILE, the CNF is streamed to a temporary file while it is converted, as in `write_input_dimacs`.
+    Otherwise, the header of the DIMACS has to be written before the clauses, so the CNF is first converted to a
+    `ClauseStore` (or taken from the cache) and then streamed to the solver while it reads it.
+    :param digest: Whether to compute the digest of the DIMACS, e.g. to look up the result of the solver in a cache.
+    :return: The input to give to the solver, the information on the DIMACS and the projected atoms.
+    """
+    if input_mode == InputMode.FILE:
+        written = []
+        with solver_input(lambda f: written.extend(write_input_dimacs(solver, f, filename, preprocess_options,
+                                                                      cnf_cache)),
+                          input_mode, tmp_dir, digest=digest) as solver_in:
+            yield solver_in, *written
+        return
+
+    store, atoms = get_input_store(filename, preprocess_options, cnf_cache)
+    dimacs_info = DimacsInfo.from_store(store)
+    with solver_input(lambda f: solver.write_dimacs_from_store(f, store, atoms), input_mode, tmp_dir,
+                      digest=digest) as solver_in:
+        yield solver_in, dimacs_info, atoms
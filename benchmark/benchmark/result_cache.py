@@ -0,0 +1,108 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from tempfile import mkdtemp
+
+
+@dataclass
+class CachedResult:
+    output: dict
+    time: float
+    files: dict[str, str]
+
+
+class SolverResultCache:
+    """On-disk cache of the results of the solvers, keyed by the solver and the content of its input.
+
+    Each entry is a folder holding the parsed output of the solver and the time it took, plus the files it produced,
+    e.g. the d-DNNF compiled by d4. When the cache exceeds its maximum size, the least recently used entries are
+    removed.
+    """
+    RESULT_FILE = "result.json"
+
+    def __init__(self, cache_dir: str, max_size: int | None = None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(solver_bin: str, *parts) -> str:
+        """Returns the key of a run of the solver binary, which is invalidated when the binary changes.
+        :param parts: What determines the result of the run, e.g. the digest of the input, the projected variables
+            and the mode of the solver, as JSON-serializable values.
+        """
+        stat = os.stat(solver_bin)
+        key = json.dumps([os.path.realpath(solver_bin), stat.st_size, stat.st_mtime_ns, *parts])
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key: str) -> CachedResult | None:
+        entry = os.path.join(self.cache_dir, key)
+        result_file = os.path.join(entry, self.RESULT_FILE)
+        try:
+            with open(result_file) as f:
+                data = json.load(f)
+            # the modification time of the result marks the last use of the entry
+            os.utime(result_file)
+        except (OSError, ValueError):
+            return None
+        return CachedResult(data["output"], data["time"], {name: os.path.join(entry, name) for name in data["files"]})
+
+    def put(self, key: str, output: dict, time: float, files: dict[str, str] | None = None):
+        """Stores the result of a run, copying the given files into the entry.
+        :param files: The files produced by the run, by name.
+        """
+        files = files or {}
+        # the entry is filled in a temporary folder first, so that concurrent runs never read a partial entry
+        tmp_entry = mkdtemp(dir=self.cache_dir, prefix=".tmp")
+        try:
+            for name, path in files.items():
+                shutil.copyfile(path, os.path.join(tmp_entry, name))
+            with open(os.path.join(tmp_entry, self.RESULT_FILE), "w") as f:
+                json.dump({"output": output, "time": time, "files": list(files)}, f)
+            os.rename(tmp_entry, os.path.join(self.cache_dir, key))
+        except OSError:
+            # e.g. the same entry was stored by a concurrent run
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        self._evict()
+
+    def _evict(self):
+        if self.max_size is None:
+            return
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, key)
+            if key.startswith("."):
+                continue
+            try:
+                last_used = os.stat(os.path.join(entry, self.RESULT_FILE)).st_mtime
+                size = sum(f.stat().st_size for f in os.scandir(entry))
+            except OSError:
+                continue
+            entries.append((last_used, size, entry))
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        # the most recently used entry is always kept
+        for _, size, entry in entries[:-1]:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+
+
+def add_result_cache_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--result-cache', type=str, default=None,
+                        help='Folder where to cache the results of the solver, keyed by its binary and the content of '
+                             'its input (default: no cache)')
+    parser.add_argument('--result-cache-size', type=float, default=None,
+                        help='Maximum size of the result cache in GB, after which the least recently used results '
+                             'are removed (default: unlimited)')
+
+
+def get_result_cache(args) -> SolverResultCache | None:
+    if args.result_cache is None:
+        return None
+    max_size = int(args.result_cache_size * 2 ** 30) if args.result_cache_size is not None else None
+    return SolverResultCache(args.result_cache, max_size)
@@ -1,16 +1,27 @@
+import argparse
+import os
+import resource
 import signal
 import subprocess
 import time
+import traceback
+from collections import deque
 from dataclasses import dataclass
-from multiprocessing import get_context
+from multiprocessing import get_context, util
+from multiprocessing.connection import wait
 from queue import Empty
-from typing import Iterator, TextIO
+from typing import Callable, Iterator, TextIO, TypeVar
 
 import psutil as psutil
+from pysmt.fnode import FNode
 
 from allsat_cnf.utils import SolverOptions
+from .io.smtlib import formulas_to_smtlib, smtlib_to_formulas
 from .mode import Mode
-from .parsing import remove_prefix
+from .parsing import remove_prefix, arg_positive
+
+T = TypeVar("T")
+R = TypeVar("R")
 
 
 def wrap_fn(fn, q, *args, **kwargs):
@@ -18,7 +29,8 @@ def wrap_fn(fn, q, *args, **kwargs):
     q.put(res, block=True)
 
 
-def run_with_timeout(fn, timeout, *args, **kwargs):
+def run_in_fresh_process(fn, timeout, *args, **kwargs):
+    """Run fn in a newly spawned process, killing it after timeout seconds."""
     ctx = get_context("spawn")
     q = ctx.Queue()
     timed_proc = ctx.Process(
@@ -34,6 +46,130 @@ def run_with_timeout(fn, timeout, *args, **kwargs):
         raise TimeoutError("Process was killed due to timeout")
 
 
+def run_with_timeout(fn, timeout, *args, **kwargs):
+    """
+    Run fn in a separate process, killing it after timeout seconds.
+
+    The call is run on a persistent worker process, which is started on the first call and has pysmt and the
+    solver bindings already imported on the following ones. The formulas in the arguments and in the result are
+    sent as SMT-LIB text, with the sub-formulas they share sent once. The worker is replaced only when it is killed
+    due to timeout, or when it dies.
+    """
+    global _warm_worker
+    if _warm_worker is None:
+        _warm_worker = WarmWorker()
+        # stopped before multiprocessing joins the children at exit, also when run inside a worker process
+        util.Finalize(None, _warm_worker.stop, exitpriority=10)
+    return _warm_worker.run(fn, timeout, *args, **kwargs)
+
+
+_warm_worker: "WarmWorker | None" = None
+
+
+class WarmWorker:
+    """A worker process which runs functions on request, with a timeout."""
+
+    def __init__(self):
+        self._ctx = get_context("spawn")
+        self._start()
+
+    def _start(self):
+        self.conn, child_conn = self._ctx.Pipe()
+        self.process = self._ctx.Process(target=_warm_worker_loop, args=(child_conn,))
+        self.process.start()
+        child_conn.close()
+
+    def run(self, fn, timeout, *args, **kwargs):
+        self.conn.send((fn, _encode_formulas((args, kwargs))))
+        if not self.conn.poll(timeout):
+            self.restart()
+            raise TimeoutError("Process was killed due to timeout")
+        try:
+            ok, value = self.conn.recv()
+        except (EOFError, ConnectionResetError):
+            self.restart()
+            raise RuntimeError("Worker died (e.g. out of memory)")
+        if not ok:
+            timed_out, trace = value
+            if timed_out:
+                # the function stopped itself at its own time limit, leaving the worker alive
+                raise TimeoutError("Worker timed out:\n{}".format(trace))
+            raise RuntimeError("Worker failed:\n{}".format(trace))
+        return _decode_formulas(value)
+
+    def restart(self):
+        self.stop(kill=True)
+        self._start()
+
+    def stop(self, kill: bool = False):
+        self.conn.close()
+        if not kill:
+            self.process.join(timeout=1)
+        if self.process.is_alive():
+            kill_process_and_children(self.process)
+        self.process.join()
+
+
+def _warm_worker_loop(conn):
+    # imported here to have them loaded before the first call
+    import allsat_cnf.utils  # noqa: F401
+    import pysmt.shortcuts  # noqa: F401
+    from pysmt.environment import get_env, reset_env
+
+    while True:
+        try:
+            fn, encoded = conn.recv()
+        except EOFError:
+            break
+        try:
+            # each call gets a fresh environment, as a fresh process would: the formulas of the previous calls are
+            # released, and symbols can be declared again with another type
+            reset_env()
+            get_env().enable_infix_notation = True
+            args, kwargs = _decode_formulas(encoded)
+            conn.send((True, _encode_formulas(fn(*args, **kwargs))))
+        except Exception as e:
+            conn.send((False, (isinstance(e, TimeoutError), traceback.format_exc())))
+
+
+class _FormulaRef(int):
+    """Index of a formula in the SMT-LIB text sent along with an encoded object."""
+
+
+def _encode_formulas(obj) -> tuple[str, object]:
+    formulas: dict[FNode, int] = {}
+    encoded = _replace_formulas(obj, formulas)
+    if not formulas:
+        return "", encoded
+    return formulas_to_smtlib(formulas), encoded
+
+
+def _replace_formulas(obj, formulas: dict[FNode, int]):
+    if isinstance(obj, FNode):
+        return _FormulaRef(formulas.setdefault(obj, len(formulas)))
+    if type(obj) in (list, tuple, set, frozenset):
+        return type(obj)(_replace_formulas(x, formulas) for x in obj)
+    if type(obj) is dict:
+        return {k: _replace_formulas(v, formulas) for k, v in obj.items()}
+    return obj
+
+
+def _decode_formulas(message: tuple[str, object]):
+    text, encoded = message
+    formulas = smtlib_to_formulas(text) if text else []
+    return _restore_formulas(encoded, formulas)
+
+
+def _restore_formulas(obj, formulas: list[FNode]):
+    if isinstance(obj, _FormulaRef):
+        return formulas[obj]
+    if type(obj) in (list, tuple, set, frozenset):
+        return type(obj)(_restore_formulas(x, formulas) for x in obj)
+    if type(obj) is dict:
+        return {k: _restore_formulas(v, formulas) for k, v in obj.items()}
+    return obj
+
+
 def kill_process_and_children(timed_proc):
     pid = timed_proc.pid
     proc = psutil.Process(pid)
@@ -50,7 +186,7 @@ def kill_process_and_children(timed_proc):
 
 def run_cmd_with_timeout(
         cmd: list[str],
-        stdin: TextIO | None = None,
+        stdin: int | TextIO | None = None,
         timeout: int | None = None
 ) -> Iterator[str]:
     """
@@ -89,12 +225,16 @@ class PreprocessOptions:
     do_nnf: bool
     mutex_nnf_labels: bool
     label_neg_polarity: bool
+    strash: bool = False
+    flatten: bool = False
 
 
 def get_options(args) -> tuple[PreprocessOptions, SolverOptions]:
     do_nnf = False
     mutex_nnf_labels = False
     label_neg_polarity = False
+    strash = False
+    flatten = False
     phase_caching = True
     first_assign = SolverOptions.FirstAssign.NONE
     mode = args.mode
@@ -105,6 +245,12 @@ def get_options(args) -> tuple[PreprocessOptions, SolverOptions]:
     elif mode.startswith("IF_"):
         mode = remove_prefix(mode, "IF_")
         first_assign = SolverOptions.FirstAssign.IRRELEVANT
+    if mode.startswith("STRASH_"):
+        mode = remove_prefix(mode, "STRASH_")
+        strash = True
+    if mode.startswith("FLAT_"):
+        mode = remove_prefix(mode, "FLAT_")
+        flatten = True
     if mode.startswith("NNF_"):
         do_nnf = True
         mode = remove_prefix(mode, "NNF_")
@@ -118,8 +264,159 @@ def get_options(args) -> tuple[PreprocessOptions, SolverOptions]:
     with_repetitions = args.with_repetitions if "with_repetitions" in args else False
 
     preprocess_options = PreprocessOptions(cnf_type=mode, do_nnf=do_nnf, mutex_nnf_labels=mutex_nnf_labels,
-                                           label_neg_polarity=label_neg_polarity)
+                                           label_neg_polarity=label_neg_polarity, strash=strash,
+                                           flatten=flatten)
     solver_options = SolverOptions(timeout=args.timeout, with_repetitions=with_repetitions,
                                    use_ta=mode != Mode.TTA, phase_caching=phase_caching, first_assign=first_assign)
 
     return preprocess_options, solver_options
+
+
+@dataclass
+class BatchOptions:
+    n_workers: int = 1
+    cpus: list[int] | None = None
+    memory_limit: int | None = None
+    task_timeout: float | None = None
+
+    def is_sequential(self) -> bool:
+        return self.n_workers == 1 and self.cpus is None and self.memory_limit is None and self.task_timeout is None
+
+
+def add_batch_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('-j', '--jobs', type=arg_positive, default=1,
+                        help='Number of instances to run concurrently (default: 1)')
+    parser.add_argument('--cpus', type=str, default=None,
+                        help='Comma-separated list of CPUs to pin the workers to, one per worker (default: no pinning)')
+    parser.add_argument('--memory-limit', type=arg_positive, default=None,
+                        help='Memory limit in MB for each worker and each process it spawns (default: no limit)')
+    parser.add_argument('--task-timeout', type=arg_positive, default=None,
+                        help='Time limit in seconds for each instance, after which its worker is killed '
+                             '(default: no limit)')
+
+
+def get_batch_options(args) -> BatchOptions:
+    cpus = [int(cpu) for cpu in args.cpus.split(",")] if args.cpus else None
+    memory_limit = args.memory_limit * 1024 * 1024 if args.memory_limit else None
+    return BatchOptions(n_workers=args.jobs, cpus=cpus, memory_limit=memory_limit, task_timeout=args.task_timeout)
+
+
+def run_batch(fn: Callable[[T], R], tasks: list[T], on_result: Callable[[T, R], None],
+              batch_options: BatchOptions | None = None):
+    """
+    Run fn on each task, possibly on a pool of worker processes, and pass each result to on_result.
+
+    Results are passed to on_result in the main process, in the order of the tasks, regardless of the order in
+    which they complete: the output is the same as the one of a sequential run, and an interrupted run can be resumed
+    by skipping the tasks whose result was written.
+    Each worker is pinned to one of the given CPUs, and the address space of the worker and of each process it spawns
+    is capped to the memory limit. A task which raises an exception, runs out of memory, or exceeds the task timeout
+    is reported and skipped, so that it is run again on resume. A worker killed due to timeout is replaced.
+    With the default options, the tasks are simply run one after the other in the current process.
+    """
+    if batch_options is None:
+        batch_options = BatchOptions()
+    if batch_options.is_sequential():
+        for task in tasks:
+            on_result(task, fn(task))
+        return
+
+    ctx = get_context("spawn")
+    workers = [_BatchWorker(ctx, fn, k, batch_options) for k in range(min(batch_options.n_workers, len(tasks)))]
+    queue = deque(enumerate(tasks))
+    # results of the completed tasks which are not flushed yet, None if the task failed
+    done: dict[int, tuple[R] | None] = {}
+    next_to_flush = 0
+    try:
+        while True:
+            for worker in workers:
+                if worker.task is None and queue:
+                    worker.submit(*queue.popleft())
+            busy = [w for w in workers if w.task is not None]
+            if not busy:
+                break
+
+            timeout = None
+            if batch_options.task_timeout is not None:
+                timeout = max(0.0, min(w.start_time for w in busy) + batch_options.task_timeout - time.time())
+            ready = wait([w.conn for w in busy], timeout=timeout)
+            for worker in busy:
+                if worker.conn in ready:
+                    index, task = worker.task
+                    try:
+                        ok, value = worker.conn.recv()
+                    except (EOFError, ConnectionResetError):
+                        ok, value = False, "Worker died (e.g. out of memory)"
+                        worker.restart()
+                    worker.task = None
+                    if not ok:
+                        print("\nTask {} failed: {}".format(task, value))
+                    done[index] = (value,) if ok else None
+                elif batch_options.task_timeout is not None \
+                        and time.time() - worker.start_time > batch_options.task_timeout:
+                    index, task = worker.task
+                    print("\nTask {} killed due to timeout".format(task))
+                    worker.restart()
+                    done[index] = None
+
+            while next_to_flush in done:
+                result = done.pop(next_to_flush)
+                if result is not None:
+                    on_result(tasks[next_to_flush], result[0])
+                next_to_flush += 1
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+class _BatchWorker:
+    def __init__(self, ctx, fn, k: int, batch_options: BatchOptions):
+        self._ctx = ctx
+        self._fn = fn
+        self._cpus = None if batch_options.cpus is None else {batch_options.cpus[k % len(batch_options.cpus)]}
+        self._memory_limit = batch_options.memory_limit
+        self.task: tuple[int, object] | None = None
+        self.start_time = 0.0
+        self._start()
+
+    def _start(self):
+        self.conn, child_conn = self._ctx.Pipe()
+        self.process = self._ctx.Process(target=_batch_worker_loop,
+                                         args=(self._fn, child_conn, self._cpus, self._memory_limit))
+        self.process.start()
+        child_conn.close()
+
+    def submit(self, index: int, task):
+        self.task = (index, task)
+        self.start_time = time.time()
+        self.conn.send(task)
+
+    def restart(self):
+        self.stop()
+        self.task = None
+        self._start()
+
+    def stop(self):
+        # an idle worker exits as soon as its connection is closed, a busy one is killed
+        self.conn.close()
+        if self.task is None:
+            self.process.join(timeout=1)
+        if self.process.is_alive():
+            kill_process_and_children(self.process)
+        self.process.join()
+
+
+def _batch_worker_loop(fn, conn, cpus: set[int] | None, memory_limit: int | None):
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        try:
+            conn.send((True, fn(task)))
+        except Exception as e:
+            conn.send((False, (isinstance(e, TimeoutError), traceback.format_exc())))
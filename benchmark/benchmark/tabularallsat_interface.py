@@ -1,15 +1,21 @@
+import dataclasses
 import re
+import time
 from dataclasses import dataclass
-from tempfile import NamedTemporaryFile
+from typing import TextIO
 
 from pysmt.fnode import FNode
 
-from allsat_cnf.utils import get_clauses
-from .io.dimacs import pysmt_to_dimacs, dimacs_var_map, HeaderMode
+from allsat_cnf.clause_store import ClauseStore
+from allsat_cnf.polarity_cnfizer import PolarityCNFizer
+from .io.aig import AIG, AIGCNFizer, write_aig_dimacs
+from .io.dimacs import write_dimacs, write_dimacs_from_store, DimacsInfo, HeaderMode
+from .result_cache import SolverResultCache
 from .run import run_cmd_with_timeout
 
 # Regular expressions for parsing tabularallsat output
-RE_HEADER = re.compile(r"c parsed header 'p cnf (\d+) (\d+) (\d+)'")
+# (the header written by DimacsWriter is padded with trailing spaces)
+RE_HEADER = re.compile(r"c parsed header 'p cnf (\d+) (\d+) (\d+)\s*'")
 RE_NUM_CLAUSES = re.compile(r"c parsed all (\d+) clauses")
 RE_MODEL_COUNT = re.compile(r"s MODEL COUNT")
 RE_NUM_PARTIAL_ASSIGNMENTS = re.compile(r"c n-partial-assignments (\d+)")
@@ -27,31 +33,59 @@ class _Output:
 class TabularAllSATInterface:
     """Adapter for TabularAllSAT"""
 
-    def __init__(self, ta_bin: str):
+    def __init__(self, ta_bin: str, result_cache: SolverResultCache | None = None):
         self.ta_bin = ta_bin
         self.next_line_mc = False
-
-    def projected_allsat(self, formula: FNode, projected_vars: set[FNode], timeout: int | None = None) \
-            -> tuple[int, int]:
-        output = self._invoke_solver(formula, projected_vars, timeout)
+        self.result_cache = result_cache
+        # time taken by the runs of tabularallsat whose results were taken from the cache
+        self.cached_time = 0.
+
+    def write_dimacs(self, f: TextIO, formula: FNode, projected_vars: set[FNode],
+                     cnfizer: PolarityCNFizer) -> DimacsInfo:
+        """Converts the formula into CNF, streaming it to the DIMACS file given as input to tabularallsat."""
+        return write_dimacs(f, formula, projected_vars, cnfizer, HeaderMode.WITH_NUM_PROJECTED_VARS)
+
+    def write_dimacs_from_store(self, f: TextIO, store: ClauseStore, projected_vars: set[FNode]) -> DimacsInfo:
+        """Writes a CNF already converted, e.g. read from the CNF cache, to the DIMACS file given as input to tabularallsat."""
+        return write_dimacs_from_store(f, store, projected_vars, HeaderMode.WITH_NUM_PROJECTED_VARS)
+
+    def write_aig_dimacs(self, f: TextIO, aig: AIG, cnfizer: AIGCNFizer) -> tuple[DimacsInfo, set[FNode]]:
+        """Converts the AIG into CNF, streaming it to the DIMACS file given as input to tabularallsat."""
+        return write_aig_dimacs(f, aig, cnfizer, HeaderMode.WITH_NUM_PROJECTED_VARS)
+
+    def projected_allsat(self, dimacs_file: str, dimacs_info: DimacsInfo, projected_vars: set[FNode],
+                         timeout: int | None = None, stdin: int | None = None,
+                         dimacs_digest: str | None = None) -> tuple[int, int]:
+        output = self._invoke_solver(dimacs_file, dimacs_info, projected_vars, timeout, stdin, dimacs_digest)
         return output.num_partial_assignments, output.model_count
 
-    def _invoke_solver(self, formula: FNode, projected_vars: set[FNode], timeout: int | None = None) -> _Output:
-        with NamedTemporaryFile() as f:
-            dimacs_file = f.name
-
-            var_map = dimacs_var_map(formula, projected_vars)
-            with open(dimacs_file, "w") as fw:
-                fw.writelines(pysmt_to_dimacs(formula, projected_vars, var_map, HeaderMode.WITH_NUM_PROJECTED_VARS))
-
-            cmd = [self.ta_bin, dimacs_file]
+    def _invoke_solver(self, dimacs_file: str, dimacs_info: DimacsInfo, projected_vars: set[FNode],
+                       timeout: int | None = None, stdin: int | None = None,
+                       dimacs_digest: str | None = None) -> _Output:
+        """Runs tabularallsat, unless its result is in the result cache.
+        :param dimacs_digest: The digest of the DIMACS file, needed to use the result cache.
+        """
+        cmd = [self.ta_bin, dimacs_file]
+
+        cache_key = None
+        if self.result_cache is not None and dimacs_digest is not None:
+            projected_ids = sorted(dimacs_info.var_map[v] for v in projected_vars)
+            cache_key = self.result_cache.key(self.ta_bin, dimacs_digest, projected_ids)
+
+        if cache_key is not None and (cached := self.result_cache.get(cache_key)) is not None:
+            output = _Output(**cached.output)
+            self.cached_time += cached.time
+        else:
+            time_start = time.time()
             output = _Output(0, 0, 0, 0, 0)
-
-            for line in run_cmd_with_timeout(cmd, timeout=timeout):
+            for line in run_cmd_with_timeout(cmd, stdin=stdin, timeout=timeout):
                 output = self._read_output_line(output, line)
 
-        assert output.num_vars == (nv := len(var_map)), f"{output.num_vars} != {nv}"
-        assert output.num_clauses == (cc := len(get_clauses(formula))), f"{output.num_clauses} != {cc}"
+            if cache_key is not None:
+                self.result_cache.put(cache_key, dataclasses.asdict(output), time.time() - time_start)
+
+        assert output.num_vars == (nv := dimacs_info.n_vars), f"{output.num_vars} != {nv}"
+        assert output.num_clauses == (cc := dimacs_info.n_clauses), f"{output.num_clauses} != {cc}"
         assert output.projected_vars == (pv := len(projected_vars)), f"{output.projected_vars} != {pv}"
 
         return output
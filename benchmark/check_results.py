@@ -3,13 +3,16 @@ import json
 
 import pandas as pd
 
-from benchmark.io.file import get_input_files
+from benchmark.io.file import get_input_files, RESULT_LOG_EXT
 
 
 def parse_inputs(input_files: list[str]) -> pd.DataFrame:
     data = []
 
     for filename in input_files:
+        if filename.endswith(RESULT_LOG_EXT):
+            # logs of the runs, exported to the .json files
+            continue
         with open(filename) as f:
             try:
                 result_out = json.load(f)
@@ -3,20 +3,26 @@ import os
 import sys
 import time
 from datetime import datetime
+from functools import partial
 from tempfile import NamedTemporaryFile
 from typing import Iterable
 
 from pysmt.environment import reset_env, get_env
 from pysmt.fnode import FNode
 
-from allsat_cnf.utils import SolverOptions, get_clauses
+from allsat_cnf.utils import SolverOptions
 from benchmark.d4_interface import D4Interface, D4EnumeratorInterface
-from benchmark.io.file import get_output_filename, check_inputs_exist, write_result, get_input_files, \
-    read_formula_from_file, check_output_can_be_created, result_exists
+from benchmark.ddnnf import load_ddnnf
+from benchmark.cnf_cache import add_cnf_cache_argument, get_cnf_cache
+from benchmark.io.dimacs import DimacsInfo
+from benchmark.io.file import get_output_filename, check_inputs_exist, get_input_files, \
+    check_output_can_be_created, open_result_log
 from benchmark.mode import Mode
 from benchmark.parsing import arg_positive
-from benchmark.preprocess import preprocess_formula
-from benchmark.run import get_options
+from benchmark.io.pipe import SolverInput, add_input_mode_argument, get_input_mode
+from benchmark.preprocess import open_input_dimacs
+from benchmark.result_cache import add_result_cache_arguments, get_result_cache
+from benchmark.run import get_options, run_batch, add_batch_arguments, get_batch_options
 
 MC_CHECK_MSG = "Checking model count..."
 
@@ -50,9 +56,19 @@ def parse_args():
     parser.add_argument('--timeout', type=arg_positive, default=3600,
                         help='Timeout for the solver')
     parser.add_argument('--d4-path', type=str, required=True, help='Path to the d4 (v2) binary')
-    parser.add_argument('--decdnnf-path', type=str, required=True, help='Path to the decdnnf_rs binary')
-
-    return parser.parse_args()
+    parser.add_argument('--enumerator', choices=["native", "decdnnf"], default="native",
+                        help='How to enumerate the paths of the d-DNNF in enum mode: in process, or with decdnnf_rs '
+                             '(default: native)')
+    parser.add_argument('--decdnnf-path', type=str, default=None,
+                        help='Path to the decdnnf_rs binary, required by --enumerator decdnnf')
+    add_cnf_cache_argument(parser)
+    add_input_mode_argument(parser)
+    add_result_cache_arguments(parser)
+    add_batch_arguments(parser)
+    args = parser.parse_args()
+    if args.d4_mode == "enum" and args.enumerator == "decdnnf" and args.decdnnf_path is None:
+        parser.error("--decdnnf-path is required by --enumerator decdnnf")
+    return args
 
 
 def main():
@@ -67,78 +83,107 @@ def main():
 
     time_start = time.time()
 
+    results = open_result_log(args, output_file)
+    tasks = []
     for i, filename in enumerate(input_files):
-        if result_exists(output_file, filename):
+        if filename in results:
             log("Already computed, skipping...", filename, i, input_files)
-            continue
         else:
-            log("Processing...", filename, i, input_files)
+            tasks.append((i, filename))
+    try:
+        run_batch(partial(evaluate, args=args, input_files=input_files), tasks,
+                  lambda _, res: results.append(res), get_batch_options(args))
+    finally:
+        results.export()
+
+    seconds = time.time() - time_start
+    print("Done! {:.3f}s".format(seconds))
 
-        setup()
-        phi = read_formula_from_file(filename)
-        enum_timed_out = False
-        count = None
-        n_paths = None
 
-        preprocess_options, solver_options = get_options(args)
-        phi_cnf, atoms = preprocess_formula(phi, preprocess_options)
-        n_clauses = len(get_clauses(phi_cnf))
+def evaluate(task: tuple[int, str], args, input_files: list[str]) -> dict:
+    i, filename = task
+    log("Processing...", filename, i, input_files)
+
+    setup()
+    enum_timed_out = False
+    count = None
+    n_paths = None
+
+    preprocess_options, solver_options = get_options(args)
+    d4 = D4Interface(args.d4_path, get_result_cache(args))
+    with open_input_dimacs(d4, filename, preprocess_options, get_input_mode(args), args.tmp_dir, get_cnf_cache(args),
+                           digest=d4.result_cache is not None) as (dimacs_in, dimacs_info, atoms):
+        n_clauses = dimacs_info.n_clauses
         try:
             log(COUNTING_LOG, filename, i, input_files)
             time_init = time.time()
             mode = args.d4_mode
             if mode == "counting":
-                count = model_count_or_timeout(phi_cnf, atoms, solver_options, args.d4_path, args.tmp_dir)
+                count = model_count_or_timeout(d4, dimacs_in, dimacs_info, atoms, solver_options)
                 n_paths = count
             elif mode == "enum":
-                count, n_paths = enumerate_paths_or_timeout(phi_cnf, atoms, solver_options, args.d4_path,
-                                                            args.decdnnf_path, args.tmp_dir)
-            total_time = time.time() - time_init
+                decdnnf_path = args.decdnnf_path if args.enumerator == "decdnnf" else None
+                count, n_paths = enumerate_paths_or_timeout(d4, dimacs_in, dimacs_info, atoms,
+                                                            solver_options, decdnnf_path, args.tmp_dir)
+            # results taken from the cache are reported with the time of the run that computed them
+            total_time = time.time() - time_init + d4.cached_time
         except TimeoutError:
             total_time = args.timeout
             enum_timed_out = True
 
-        res = {
-            "filename": filename,
-            "n_clauses": n_clauses,
-            "models": n_paths,
-            "model_count": count,
-            "time": total_time,
-            "enum_timed_out": enum_timed_out,
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        }
-
-        write_result(args, res, output_file)
+    res = {
+        "filename": filename,
+        "n_clauses": n_clauses,
+        "models": n_paths,
+        "model_count": count,
+        "time": total_time,
+        "enum_timed_out": enum_timed_out,
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
 
-    seconds = time.time() - time_start
-    print("Done! {:.3f}s".format(seconds))
+    return res
 
 
 def setup():
+    sys.setrecursionlimit(10000)
     reset_env()
     get_env().enable_infix_notation = True
 
 
-def model_count_or_timeout(phi: FNode, atoms: Iterable[FNode], solver_options: SolverOptions,
-                           d4_path: str, tmp_dir: str | None) -> int:
-    d4 = D4Interface(d4_path)
-    return d4.projected_model_count(phi, set(atoms), tmp_dir=tmp_dir, timeout=solver_options.timeout)
-
+def model_count_or_timeout(d4: D4Interface, dimacs_in: SolverInput, dimacs_info: DimacsInfo, atoms: Iterable[FNode],
+                           solver_options: SolverOptions) -> int:
+    return d4.projected_model_count(dimacs_in.name, dimacs_info, set(atoms), timeout=solver_options.timeout,
+                                    stdin=dimacs_in.stdin, dimacs_digest=dimacs_in.digest)
 
-def enumerate_paths_or_timeout(phi: FNode, atoms: Iterable[FNode], solver_options: SolverOptions, d4_path: str,
-                               decdnnf_path: str, tmp_dir: str | None) -> tuple[int, int]:
-    d4 = D4Interface(d4_path)
-    d4enum = D4EnumeratorInterface(decdnnf_path)
 
+def enumerate_paths_or_timeout(d4: D4Interface, dimacs_in: SolverInput, dimacs_info: DimacsInfo, atoms: Iterable[FNode],
+                               solver_options: SolverOptions, decdnnf_path: str | None,
+                               tmp_dir: str | None) -> tuple[int, int]:
+    """Compiles the CNF into a d-DNNF with d4 and counts its paths, with decdnnf_rs if its path is given,
+    otherwise in process. The timeout covers both the compilation and the count."""
     with NamedTemporaryFile(dir=tmp_dir) as nnf_file:
         init_time = time.time()
-        _, var_map = d4.compile(phi, set(atoms), nnf_file=nnf_file.name, tmp_dir=tmp_dir,
-                                timeout=solver_options.timeout)
-        timeout = int(solver_options.timeout - (time.time() - init_time))
-        count, n_paths = d4enum.enumerate_paths(nnf_file.name, var_map, set(atoms), timeout)
+        d4.compile(dimacs_in.name, dimacs_info, set(atoms), nnf_file=nnf_file.name, timeout=solver_options.timeout,
+                   stdin=dimacs_in.stdin, dimacs_digest=dimacs_in.digest)
+        if decdnnf_path is not None:
+            timeout = int(remaining_time(init_time, d4, solver_options))
+            if timeout <= 0:
+                raise TimeoutError("Compilation took the whole time budget")
+            d4enum = D4EnumeratorInterface(decdnnf_path)
+            count, n_paths = d4enum.enumerate_paths(nnf_file.name, dimacs_info.var_map, set(atoms), timeout)
+        else:
+            # the d-DNNF is projected on the atoms, numbered from 1
+            count, n_paths = load_ddnnf(nnf_file.name).count(len(set(atoms)))
+            if remaining_time(init_time, d4, solver_options) < 0:
+                raise TimeoutError(f"Compilation and count took more than {solver_options.timeout} seconds")
 
     return count, n_paths
 
 
+def remaining_time(init_time: float, d4: D4Interface, solver_options: SolverOptions) -> float:
+    # a compilation taken from the cache counts with the time of the run that computed it
+    return solver_options.timeout - (time.time() - init_time + d4.cached_time)
+
+
 if __name__ == '__main__':
     main()
@@ -3,6 +3,7 @@ import os
 import sys
 import time
 from datetime import datetime
+from functools import partial
 from typing import Iterable
 
 from pysmt.environment import reset_env, get_env
@@ -10,15 +11,17 @@ from pysmt.fnode import FNode
 
 from allsat_cnf.utils import check_models
 from allsat_cnf.utils import get_allsat, SolverOptions, check_sat
-from benchmark.io.file import get_output_filename, check_inputs_exist, write_result, get_input_files, \
-    read_formula_from_file, check_output_can_be_created, result_exists
+from benchmark.cnf_cache import add_cnf_cache_argument, get_cnf_cache
+from benchmark.io.file import get_output_filename, check_inputs_exist, get_input_files, \
+    read_formula_from_file, check_output_can_be_created, open_result_log
 from benchmark.mode import Mode
 from benchmark.parsing import arg_positive
-from benchmark.preprocess import preprocess_formula
-from benchmark.run import get_options
+from benchmark.preprocess import get_input_store
+from benchmark.run import get_options, run_batch, add_batch_arguments, get_batch_options
 from benchmark.run import run_with_timeout
 
 MODELS_CHECK_MSG = "Checking models..."
+CHECK_GRACE_PERIOD = 10
 
 PARTIAL_MODELS_MSG = "Generating partial models..."
 
@@ -50,6 +53,10 @@ def parse_args():
     parser.add_argument('--timeout', type=arg_positive, default=3600,
                         help='Timeout for the solver')
     parser.add_argument('--sat', action='store_true', help='Only check satisfiability')
+    parser.add_argument('--check-workers', type=arg_positive, default=1,
+                        help='Number of processes checking the models (default: 1)')
+    add_cnf_cache_argument(parser)
+    add_batch_arguments(parser)
     return parser.parse_args()
 
 
@@ -65,60 +72,87 @@ def main():
 
     time_start = time.time()
 
+    results = open_result_log(args, output_file)
+    tasks = []
     for i, filename in enumerate(input_files):
-        if result_exists(output_file, filename):
+        if filename in results:
             log("Already computed, skipping...", filename, i, input_files)
-            continue
-
-        setup()
-        phi = read_formula_from_file(filename)
-        log(PARTIAL_MODELS_MSG, filename, i, input_files)
-        enum_timed_out = False
-        models = None
-        count = None
-        preprocess_options, solver_options = get_options(args)
-        phi_cnf, atoms = preprocess_formula(phi, preprocess_options)
-        n_clauses = len(phi_cnf.args())
-        try:
-            time_init = time.time()
-            if args.sat:
-                is_sat = check_sat_or_timeout(phi_cnf, solver_options)
-                if is_sat:
-                    models = [set()]
-                else:
-                    models = []
-            else:
-                models, count = get_allsat_or_timeout(phi_cnf, atoms, solver_options)
-            total_time = time.time() - time_init
-        except TimeoutError:
-            total_time = args.timeout
-            enum_timed_out = True
-
-        check_timed_out = False
-        if not enum_timed_out and should_check_models(args):
-            log(MODELS_CHECK_MSG, filename, i, input_files, len(models))
-            try:
-                check_models_or_timeout(models, phi, atoms, args)
-            except TimeoutError:
-                check_timed_out = True
-
-        res = {
-            "filename": filename,
-            "n_clauses": n_clauses,
-            "models": None if models is None else len(models),
-            "model_count": count,
-            "time": total_time,
-            "enum_timed_out": enum_timed_out,
-            "check_timed_out": check_timed_out,
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        }
-        write_result(args, res, output_file)
+        else:
+            tasks.append((i, filename))
+    try:
+        run_batch(partial(evaluate, args=args, input_files=input_files), tasks,
+                  lambda _, res: results.append(res), get_batch_options(args))
+    finally:
+        results.export()
 
     seconds = time.time() - time_start
     print("Done! {:.3f}s".format(seconds))
 
 
+def evaluate(task: tuple[int, str], args, input_files: list[str]) -> dict:
+    i, filename = task
+    setup()
+    phi = read_formula_from_file(filename)
+    log(PARTIAL_MODELS_MSG, filename, i, input_files)
+    enum_timed_out = False
+    enum_failed = False
+    models = None
+    count = None
+    preprocess_options, solver_options = get_options(args)
+    store, atoms = get_input_store(filename, preprocess_options, get_cnf_cache(args))
+    phi_cnf = store.as_formula()
+    n_clauses = len(store)
+    try:
+        time_init = time.time()
+        if args.sat:
+            is_sat = check_sat_or_timeout(phi_cnf, solver_options)
+            if is_sat:
+                models = [set()]
+            else:
+                models = []
+        else:
+            models, count = get_allsat_or_timeout(phi_cnf, atoms, solver_options)
+        total_time = time.time() - time_init
+    except TimeoutError:
+        total_time = args.timeout
+        enum_timed_out = True
+    except RuntimeError as e:
+        # e.g. the worker died: the instance is recorded as unsolved, and the evaluation goes on
+        print("\n{}".format(e))
+        total_time = args.timeout
+        enum_failed = True
+
+    check_timed_out = False
+    check_failed = False
+    if not enum_timed_out and not enum_failed and should_check_models(args):
+        log(MODELS_CHECK_MSG, filename, i, input_files, len(models))
+        try:
+            check_models_or_timeout(models, phi, atoms, not solver_options.with_repetitions, args)
+        except TimeoutError:
+            check_timed_out = True
+        except RuntimeError as e:
+            # the models are wrong, or the worker died
+            print("\n{}".format(e))
+            check_failed = True
+
+    res = {
+        "filename": filename,
+        "n_clauses": n_clauses,
+        "models": None if models is None else len(models),
+        "model_count": count,
+        "time": total_time,
+        "enum_timed_out": enum_timed_out,
+        "enum_failed": enum_failed,
+        "check_timed_out": check_timed_out,
+        "check_failed": check_failed,
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+    return res
+
+
 def setup():
+    sys.setrecursionlimit(10000)
     reset_env()
     get_env().enable_infix_notation = True
 
@@ -151,8 +185,11 @@ def should_check_models(args) -> bool:
     return not args.sat and not args.no_check and args.mode != "TTA"
 
 
-def check_models_or_timeout(models, phi, relevant_atoms, args) -> None:
-    return run_with_timeout(check_models, args.timeout, models, phi, relevant_atoms=relevant_atoms)
+def check_models_or_timeout(models, phi, relevant_atoms, disjoint, args) -> None:
+    # the parallel check stops its pool at the timeout, while the worker is killed only if it does not return
+    # within a grace period, e.g. if it is stuck in the completeness check
+    return run_with_timeout(partial(check_models, timeout=args.timeout), args.timeout + CHECK_GRACE_PERIOD, models,
+                            phi, relevant_atoms=relevant_atoms, disjoint=disjoint, n_workers=args.check_workers)
 
 
 if __name__ == '__main__':
@@ -3,19 +3,24 @@ import os
 import sys
 import time
 from datetime import datetime
+from functools import partial
 from typing import Iterable
 
 from pysmt.environment import reset_env, get_env
 from pysmt.fnode import FNode
 
-from allsat_cnf.utils import SolverOptions, get_clauses
+from allsat_cnf.utils import SolverOptions
 from benchmark.tabularallsat_interface import TabularAllSATInterface
-from benchmark.io.file import get_output_filename, check_inputs_exist, write_result, get_input_files, \
-    read_formula_from_file, check_output_can_be_created, result_exists
+from benchmark.cnf_cache import add_cnf_cache_argument, get_cnf_cache
+from benchmark.io.dimacs import DimacsInfo
+from benchmark.io.file import get_output_filename, check_inputs_exist, get_input_files, \
+    check_output_can_be_created, open_result_log
 from benchmark.mode import Mode
 from benchmark.parsing import arg_positive
-from benchmark.preprocess import preprocess_formula
-from benchmark.run import get_options
+from benchmark.io.pipe import SolverInput, add_input_mode_argument, get_input_mode
+from benchmark.preprocess import open_input_dimacs
+from benchmark.result_cache import add_result_cache_arguments, get_result_cache
+from benchmark.run import get_options, run_batch, add_batch_arguments, get_batch_options
 
 MC_CHECK_MSG = "Checking model count..."
 
@@ -45,7 +50,10 @@ def parse_args():
     parser.add_argument('--timeout', type=arg_positive, default=3600,
                         help='Timeout for the solver')
     parser.add_argument('--tabularallsat-path', type=str, required=True, help='Path to the tabularallsat binary')
-
+    add_cnf_cache_argument(parser)
+    add_input_mode_argument(parser)
+    add_result_cache_arguments(parser)
+    add_batch_arguments(parser)
     return parser.parse_args()
 
 
@@ -61,57 +69,71 @@ def main():
 
     time_start = time.time()
 
+    results = open_result_log(args, output_file)
+    tasks = []
     for i, filename in enumerate(input_files):
-        if result_exists(output_file, filename):
+        if filename in results:
             log("Already computed, skipping...", filename, i, input_files)
-            continue
         else:
-            log("Processing...", filename, i, input_files)
+            tasks.append((i, filename))
+    try:
+        run_batch(partial(evaluate, args=args, input_files=input_files), tasks,
+                  lambda _, res: results.append(res), get_batch_options(args))
+    finally:
+        results.export()
+
+    seconds = time.time() - time_start
+    print("Done! {:.3f}s".format(seconds))
+
 
-        setup()
-        phi = read_formula_from_file(filename)
-        enum_timed_out = False
-        count = None
-        n_models = None
+def evaluate(task: tuple[int, str], args, input_files: list[str]) -> dict:
+    i, filename = task
+    log("Processing...", filename, i, input_files)
 
-        preprocess_options, solver_options = get_options(args)
-        phi_cnf, atoms = preprocess_formula(phi, preprocess_options)
-        n_clauses = len(get_clauses(phi_cnf))
+    setup()
+    enum_timed_out = False
+    count = None
+    n_models = None
+
+    preprocess_options, solver_options = get_options(args)
+    ta = TabularAllSATInterface(args.tabularallsat_path, get_result_cache(args))
+    with open_input_dimacs(ta, filename, preprocess_options, get_input_mode(args), cnf_cache=get_cnf_cache(args),
+                           digest=ta.result_cache is not None) as (dimacs_in, dimacs_info, atoms):
+        n_clauses = dimacs_info.n_clauses
         try:
             log(RUNNING_LOG, filename, i, input_files)
             time_init = time.time()
 
-            n_models, count = get_allsat_or_timeout(phi_cnf, atoms, solver_options, args.tabularallsat_path)
-            total_time = time.time() - time_init
+            n_models, count = get_allsat_or_timeout(ta, dimacs_in, dimacs_info, atoms, solver_options)
+            # results taken from the cache are reported with the time of the run that computed them
+            total_time = time.time() - time_init + ta.cached_time
         except TimeoutError:
             total_time = args.timeout
             enum_timed_out = True
 
-        res = {
-            "filename": filename,
-            "n_clauses": n_clauses,
-            "models": n_models,
-            "model_count": count,
-            "time": total_time,
-            "enum_timed_out": enum_timed_out,
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        }
+    res = {
+        "filename": filename,
+        "n_clauses": n_clauses,
+        "models": n_models,
+        "model_count": count,
+        "time": total_time,
+        "enum_timed_out": enum_timed_out,
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
 
-        write_result(args, res, output_file)
-
-    seconds = time.time() - time_start
-    print("Done! {:.3f}s".format(seconds))
+    return res
 
 
 def setup():
+    sys.setrecursionlimit(10000)
     reset_env()
     get_env().enable_infix_notation = True
 
 
-def get_allsat_or_timeout(phi: FNode, atoms: Iterable[FNode], solver_options: SolverOptions, ta_path: str) -> tuple[
-    int, int]:
-    ta = TabularAllSATInterface(ta_path)
-    return ta.projected_allsat(phi, set(atoms), solver_options.timeout)
+def get_allsat_or_timeout(ta: TabularAllSATInterface, dimacs_in: SolverInput, dimacs_info: DimacsInfo,
+                          atoms: Iterable[FNode], solver_options: SolverOptions) -> tuple[int, int]:
+    return ta.projected_allsat(dimacs_in.name, dimacs_info, set(atoms), solver_options.timeout, dimacs_in.stdin,
+                               dimacs_in.digest)
 
 
 if __name__ == '__main__':
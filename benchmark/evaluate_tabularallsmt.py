@@ -3,18 +3,19 @@ import os
 import sys
 import time
 from datetime import datetime
+from functools import partial
 from typing import Iterable
 
 from pysmt.environment import reset_env, get_env
 from pysmt.fnode import FNode
 
 from allsat_cnf.utils import SolverOptions, get_clauses
-from benchmark.io.file import get_output_filename, check_inputs_exist, write_result, get_input_files, \
-    read_formula_from_file, check_output_can_be_created, result_exists
+from benchmark.io.file import get_output_filename, check_inputs_exist, get_input_files, \
+    read_formula_from_file, check_output_can_be_created, open_result_log
 from benchmark.mode import Mode
 from benchmark.parsing import arg_positive
 from benchmark.preprocess import preprocess_formula
-from benchmark.run import get_options
+from benchmark.run import get_options, run_batch, add_batch_arguments, get_batch_options
 from benchmark.tabularallsmt_interface import TabularAllSMTInterface
 
 MC_CHECK_MSG = "Checking model count..."
@@ -45,7 +46,7 @@ def parse_args():
     parser.add_argument('--timeout', type=arg_positive, default=3600,
                         help='Timeout for the solver')
     parser.add_argument('--tabularallsmt-path', type=str, required=True, help='Path to the tabularallsmt binary')
-
+    add_batch_arguments(parser)
     return parser.parse_args()
 
 
@@ -61,49 +62,61 @@ def main():
 
     time_start = time.time()
 
+    results = open_result_log(args, output_file)
+    tasks = []
     for i, filename in enumerate(input_files):
-        if result_exists(output_file, filename):
+        if filename in results:
             log("Already computed, skipping...", filename, i, input_files)
-            continue
         else:
-            log("Processing...", filename, i, input_files)
-
-        setup()
-        phi = read_formula_from_file(filename)
-        enum_timed_out = False
-        count = None
-        n_models = None
-
-        preprocess_options, solver_options = get_options(args)
-        phi_cnf, atoms = preprocess_formula(phi, preprocess_options)
-        n_clauses = len(get_clauses(phi_cnf))
-        try:
-            log(RUNNING_LOG, filename, i, input_files)
-            time_init = time.time()
-
-            n_models = get_allsmt_or_timeout(phi_cnf, atoms, solver_options, args.tabularallsmt_path)
-            total_time = time.time() - time_init
-        except TimeoutError:
-            total_time = args.timeout
-            enum_timed_out = True
-
-        res = {
-            "filename": filename,
-            "n_clauses": n_clauses,
-            "models": n_models,
-            "model_count": count,
-            "time": total_time,
-            "enum_timed_out": enum_timed_out,
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        }
-
-        write_result(args, res, output_file)
+            tasks.append((i, filename))
+    try:
+        run_batch(partial(evaluate, args=args, input_files=input_files), tasks,
+                  lambda _, res: results.append(res), get_batch_options(args))
+    finally:
+        results.export()
 
     seconds = time.time() - time_start
     print("Done! {:.3f}s".format(seconds))
 
 
+def evaluate(task: tuple[int, str], args, input_files: list[str]) -> dict:
+    i, filename = task
+    log("Processing...", filename, i, input_files)
+
+    setup()
+    phi = read_formula_from_file(filename)
+    enum_timed_out = False
+    count = None
+    n_models = None
+
+    preprocess_options, solver_options = get_options(args)
+    phi_cnf, atoms = preprocess_formula(phi, preprocess_options)
+    n_clauses = len(get_clauses(phi_cnf))
+    try:
+        log(RUNNING_LOG, filename, i, input_files)
+        time_init = time.time()
+
+        n_models = get_allsmt_or_timeout(phi_cnf, atoms, solver_options, args.tabularallsmt_path)
+        total_time = time.time() - time_init
+    except TimeoutError:
+        total_time = args.timeout
+        enum_timed_out = True
+
+    res = {
+        "filename": filename,
+        "n_clauses": n_clauses,
+        "models": n_models,
+        "model_count": count,
+        "time": total_time,
+        "enum_timed_out": enum_timed_out,
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+    return res
+
+
 def setup():
+    sys.setrecursionlimit(10000)
     reset_env()
     get_env().enable_infix_notation = True
 
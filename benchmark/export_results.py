@@ -0,0 +1,28 @@
+import argparse as ap
+import os
+
+from benchmark.io.file import ResultLog, RESULT_LOG_EXT
+
+
+def parse_args():
+    parser = ap.ArgumentParser(description="Export the result logs of (possibly interrupted) runs to .json files")
+    parser.add_argument('dir', type=str)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # find files recursively
+    for root, dirs, files in os.walk(args.dir):
+        for file in files:
+            if file.endswith(RESULT_LOG_EXT):
+                file_path = os.path.join(root, file)
+                results = ResultLog(os.path.splitext(file_path)[0] + ".json")
+                results.export()
+                print("Exported {} results to {}".format(len(results), results.output_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import time
+
+from pysmt.shortcuts import get_atoms
+
+from benchmark.io.file import read_formula_from_file
+from benchmark.parsing import arg_positive
+from benchmark.run import run_in_fresh_process, run_with_timeout
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the per-call overhead of running a function with a timeout")
+    parser.add_argument('input', help='Formula to pass to the function (.smt2, .aig or .aag)')
+    parser.add_argument('-n', '--calls', type=arg_positive, default=20, help='Number of calls (default: 20)')
+    return parser.parse_args()
+
+
+def measure(run, phi, n_calls: int) -> float:
+    time_start = time.time()
+    for _ in range(n_calls):
+        run(get_atoms, None, phi)
+    return (time.time() - time_start) / n_calls
+
+
+def main():
+    args = parse_args()
+    phi = read_formula_from_file(args.input)
+    print("Atoms: {}".format(len(get_atoms(phi))))
+    fresh = measure(run_in_fresh_process, phi, args.calls)
+    print("Fresh process per call: {:.3f}s/call".format(fresh))
+    # the first call starts the worker
+    run_with_timeout(get_atoms, None, phi)
+    warm = measure(run_with_timeout, phi, args.calls)
+    print("Warm worker: {:.3f}s/call".format(warm))
+
+
+if __name__ == '__main__':
+    main()
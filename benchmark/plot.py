@@ -8,7 +8,7 @@ import matplotlib
 import matplotlib.pyplot as plt
 import pandas as pd
 
-from benchmark.io.file import get_input_files, check_inputs_exist
+from benchmark.io.file import get_input_files, check_inputs_exist, RESULT_LOG_EXT
 from benchmark.mode import Mode
 from benchmark.plotting.cactus_plotter import CactusPlotter
 from benchmark.plotting.ecdf_plotter import ECDFPlotter
@@ -53,6 +53,9 @@ def parse_inputs(input_files: dict[str, list[str]], with_repetitions: bool, time
     for ps_name, input_files in input_files.items():
         print(f"Problem set: {ps_name}")
         for filename in input_files:
+            if filename.endswith(RESULT_LOG_EXT):
+                # logs of the runs, exported to the .json files
+                continue
             with open(filename) as f:
                 result_out = json.load(f)
             if result_out["with_repetitions"] != with_repetitions:
@@ -63,7 +66,7 @@ def parse_inputs(input_files: dict[str, list[str]], with_repetitions: bool, time
                 result["problem_set"] = ps_name
                 result["mode"] = mode
 
-                if result["enum_timed_out"]:
+                if result["enum_timed_out"] or result.get("enum_failed", False):
                     result["model_count"] = timeout_models
                     result["models"] = timeout_models
                     result["time"] = timeout
@@ -145,6 +145,26 @@ def make_double_polarity_examples(atoms):
     ]
 
 
+def make_sat_constant_examples(atoms):
+    A, B, C, D, *_ = atoms
+    return [
+        Not(And(A, And(B, FALSE()))),
+        Or(A, Or(B, FALSE())),
+        Or(A, Or(B, TRUE())),
+        And(Or(A, TRUE()), Or(C, And(D, TRUE()))),
+        Iff(And(A, And(B, TRUE())), Or(C, Or(D, FALSE()))),
+    ]
+
+
+def make_unsat_constant_examples(atoms):
+    A, B, C, D, *_ = atoms
+    return [
+        Not(Or(A, Or(B, TRUE()))),
+        And(A, And(B, FALSE())),
+        And(Or(A, B), Not(Or(C, Or(D, TRUE())))),
+    ]
+
+
 # initialize bool variables
 boolean_variables = [Symbol(chr(i), BOOL) for i in range(ord("A"), ord("Z") + 1)]
 real_variables = [Symbol(chr(i), REAL) for i in range(ord("a"), ord("z") + 1)]
@@ -171,3 +191,6 @@ lra_single_polarity_examples = make_single_polarity_examples(real_atoms)
 
 bool_double_polarity_examples = make_double_polarity_examples(boolean_atoms)
 lra_double_polarity_examples = make_double_polarity_examples(real_atoms)
+
+bool_sat_constant_examples = make_sat_constant_examples(boolean_atoms)
+bool_unsat_constant_examples = make_unsat_constant_examples(boolean_atoms)
@@ -0,0 +1,110 @@
+from argparse import Namespace
+from io import StringIO
+
+import pytest
+
+from benchmark.io.aig import AIGAdapter, read_aiger, write_aig_dimacs
+from benchmark.io.dimacs import HeaderMode, write_dimacs
+from benchmark.mode import Mode
+from benchmark.preprocess import get_aig_cnfizer, get_cnfizer, get_projected_atoms
+from benchmark.run import get_options
+
+N_INPUTS = 70
+# inputs 1..70, and the gates 71 = in1 & in70, 72 = ~71 & in2, 73 = ~72 & ~in1, with outputs 73 and ~71
+EXPECTED_ANDS = [[140, 2], [143, 4], [145, 3]]
+EXPECTED_OUTPUTS = [146, 143]
+SYMBOLS = "i0 first\ni4 with space\ni69 last\no0 out\nc\ni1 not a symbol\n"
+
+
+def make_ascii_aig(symbols: str) -> bytes:
+    # inputs numbered from 4, and gates numbered in decreasing order, which the reader renumbers
+    inputs = "".join(f"{2 * (j + 4)}\n" for j in range(N_INPUTS))
+    gates = "6 146 8\n4 7 10\n2 5 9\n"
+    return f"aag 73 {N_INPUTS} 0 2 3\n{inputs}2\n7\n{gates}{symbols}".encode()
+
+
+def make_binary_aig(symbols: str) -> bytes:
+    body = bytearray()
+    for lhs, (rhs0, rhs1) in zip(range(142, 148, 2), EXPECTED_ANDS):
+        for delta in (lhs - rhs0, rhs0 - rhs1):
+            while delta >= 0x80:
+                body.append(delta & 0x7F | 0x80)
+                delta >>= 7
+            body.append(delta)
+    return f"aig 73 {N_INPUTS} 0 2 3\n146\n143\n".encode() + bytes(body) + symbols.encode()
+
+
+@pytest.mark.parametrize("symbols", ["", SYMBOLS])
+def test_ascii_and_binary(tmp_path, symbols):
+    aigs = []
+    for name, data in [("c.aag", make_ascii_aig(symbols)), ("c.aig", make_binary_aig(symbols))]:
+        (tmp_path / name).write_bytes(data)
+        aigs.append(read_aiger(str(tmp_path / name)))
+    ascii_aig, binary_aig = aigs
+
+    # the deltas 138, 139 and 142 take two bytes each in the binary file
+    assert ascii_aig.ands.tolist() == binary_aig.ands.tolist() == EXPECTED_ANDS
+    assert ascii_aig.outputs == binary_aig.outputs == EXPECTED_OUTPUTS
+    assert ascii_aig.n_inputs == binary_aig.n_inputs == N_INPUTS
+    assert ascii_aig.input_names == binary_aig.input_names
+    expected_names = [f"i{j}" for j in range(1, N_INPUTS + 1)]
+    if symbols:
+        expected_names[0], expected_names[4], expected_names[69] = "first", "with space", "last"
+    assert ascii_aig.input_names == expected_names
+
+
+def test_no_gates(tmp_path):
+    (tmp_path / "c.aig").write_bytes(b"aig 2 2 0 1 0\n3\ni1 b\n")
+    aig = read_aiger(str(tmp_path / "c.aig"))
+    assert aig.ands.shape == (0, 2)
+    assert aig.outputs == [3]
+    assert aig.input_names == ["i1", "b"]
+
+
+def test_truncated_binary(tmp_path):
+    (tmp_path / "c.aig").write_bytes(make_binary_aig("")[:-2])
+    with pytest.raises(ValueError):
+        read_aiger(str(tmp_path / "c.aig"))
+
+
+circuits = [
+    make_ascii_aig(SYMBOLS).decode(),
+    # a gate with a constant input
+    "aag 4 2 0 1 2\n2\n4\n8\n6 2 1\n8 7 5\n",
+    # a gate shared by two gates, and an output which is also the input of a gate
+    "aag 7 3 0 2 4\n2\n4\n6\n14\n10\n8 2 4\n10 8 6\n12 9 6\n14 11 13\n",
+    # the negation of a XOR, which gives both polarities to its gates
+    "aag 5 2 0 1 3\n2\n4\n11\n6 2 4\n8 3 5\n10 7 9\n",
+    # two contradicting outputs
+    "aag 4 3 0 2 1\n2\n4\n6\n8\n9\n8 2 5\n",
+]
+
+
+def get_preprocess_options(mode: Mode):
+    preprocess_options, _ = get_options(Namespace(mode=mode.value, timeout=None))
+    return preprocess_options
+
+
+# the modes in which AIGs are converted straight into CNF
+aig_modes = [mode for mode in Mode if mode is not Mode.TTA and get_aig_cnfizer(get_preprocess_options(mode))]
+
+
+@pytest.mark.parametrize("mode", aig_modes, ids=lambda mode: mode.value)
+@pytest.mark.parametrize("circuit", circuits, ids=["symbols", "constant", "shared", "xnor", "contradiction"])
+def test_aig_cnfizer_as_pysmt(tmp_path, mode, circuit):
+    preprocess_options = get_preprocess_options(mode)
+    aig_cnfizer = get_aig_cnfizer(preprocess_options)
+    filename = str(tmp_path / "c.aag")
+    with open(filename, "w") as f:
+        f.write(circuit)
+
+    phi = AIGAdapter.from_file(filename).to_pysmt()
+    atoms = get_projected_atoms(phi)
+    for header_mode in HeaderMode:
+        expected = StringIO()
+        expected_info = write_dimacs(expected, phi, atoms, get_cnfizer(preprocess_options), header_mode)
+        actual = StringIO()
+        actual_info, projected_vars = write_aig_dimacs(actual, read_aiger(filename), aig_cnfizer, header_mode)
+        assert actual.getvalue() == expected.getvalue()
+        assert (actual_info.n_vars, actual_info.n_clauses) == (expected_info.n_vars, expected_info.n_clauses)
+        assert projected_vars == atoms
@@ -0,0 +1,106 @@
+import pytest
+from pysmt.shortcuts import And, Or, Not, Iff, Implies, get_atoms, LT, GT, LE, Real
+
+from allsat_cnf.utils import AllSATEnumerator, SolverOptions, SubsumptionIndex, get_allsat, check_models, \
+    get_packed_allsat, ta_is_complete, ta_is_correct, ta_is_correct_parallel
+from instances import boolean_atoms, real_variables
+
+A, B, C, D, *_ = boolean_atoms
+x, y, *_ = real_variables
+
+
+def test_enumerator_projections_and_assumptions():
+    phi = And(Or(A, B), Implies(C, D), Iff(A, Not(D)))
+    with AllSATEnumerator(phi, SolverOptions(use_ta=True)) as enumerator:
+        for atoms in [{A, B}, {C, D}, get_atoms(phi)]:
+            ta, count = enumerator.get_allsat(atoms)
+            _, expected_count = get_allsat(phi, atoms=atoms)
+            assert count == expected_count
+
+        ta, _ = enumerator.get_allsat(assumptions=[A])
+        check_models(ta, And(phi, A))
+        # the assumptions do not persist after the enumeration
+        ta, _ = enumerator.get_allsat()
+        check_models(ta, phi)
+
+        enumerator.push()
+        enumerator.add_assertion(Not(B))
+        ta, _ = enumerator.get_allsat()
+        check_models(ta, And(phi, Not(B)))
+        enumerator.pop()
+        assert enumerator.atoms() == get_atoms(phi)
+        assert enumerator.is_sat(assumptions=[Not(A)])
+
+
+def test_streaming_enumeration():
+    phi = Or(And(A, B), And(C, Not(D)), Iff(A, D))
+    ta, count = get_allsat(phi, solver_options=SolverOptions(use_ta=True))
+    with AllSATEnumerator(phi, SolverOptions(use_ta=True)) as enumerator:
+        streamed = list(enumerator.iter_allsat())
+        assert streamed == ta
+        assert enumerator.count_allsat() == (len(ta), count)
+        assert list(enumerator.iter_allsat(limit=2)) == ta[:2]
+
+        seen = []
+        assert enumerator.all_sat(lambda mu: seen.append(mu) or len(seen) < 3) == 3
+        assert seen == ta[:3]
+
+
+def test_correctness_check():
+    phi = And(A, B)
+    assert ta_is_correct(phi, [{A, B}, {A, B, Not(C)}], {A, B})[0]
+    # the first model makes the formula FALSE, the last one leaves it undecided
+    is_correct, err = ta_is_correct(phi, [{A, B}, {Not(A)}, {A}], {A, B})
+    assert not is_correct
+    assert str(Not(A)) in err
+    assert not ta_is_correct(phi, [{A, B}, {A}], {A, B})[0]
+
+
+@pytest.mark.parametrize("phi", [
+    Or(And(A, B), And(C, Not(D)), Iff(A, D)),
+    # MathSAT represents `x < 1` and `y > x` as negated atoms
+    And(Or(LT(x, Real(1)), A), Or(GT(y, x), Not(A)), LE(y, Real(2))),
+])
+def test_packed_enumeration(phi):
+    packed = get_packed_allsat(phi, solver_options=SolverOptions(use_ta=True))
+    ta, count = get_allsat(phi, solver_options=SolverOptions(use_ta=True))
+    assert len(packed) == len(ta)
+    assert packed.count() == count
+    check_models(list(packed), phi, disjoint=True)
+
+
+def test_completeness_check():
+    phi = Or(And(A, B), And(C, Not(D)), Iff(A, D))
+    ta, _ = get_allsat(phi, solver_options=SolverOptions(use_ta=True))
+    for disjoint in [True, False]:
+        assert ta_is_complete(phi, ta, disjoint=disjoint)[0]
+        assert not ta_is_complete(phi, ta[1:], disjoint=disjoint)[0]
+    # non-disjoint models are only checked by subsumption
+    assert ta_is_complete(phi, ta + [{A, B}], disjoint=False)[0]
+    assert ta_is_complete(phi, ta + [{A, B}], disjoint=True)[0]
+    # {A} and {A, B} together cover 3 total assignments, as many as the models of the formula, but not {Not(A), B}
+    assert not ta_is_complete(Or(A, B), [{A}, {A, B}], disjoint=True)[0]
+
+
+def test_subsumption_index():
+    models = [{A, Not(B)}, {Not(A), C}, {Not(A), Not(C), D}, {A, Not(B)}]
+    index = SubsumptionIndex.from_models(models)
+    assert len(index) == 3
+    assert {Not(A), C} in index and {Not(A)} not in index
+    assert index.find_subset({A, Not(B), C, D}) == {A, Not(B)}
+    assert index.find_subset({Not(A), Not(C), Not(D)}) is None
+    index.insert({Not(D)})
+    assert index.find_subset({Not(A), Not(C), Not(D)}) == {Not(D)}
+    assert set(index) == {frozenset(mu) for mu in models + [{Not(D)}]}
+
+
+def test_parallel_correctness_check():
+    phi = And(Or(A, B), Iff(C, D))
+    ta, _ = get_allsat(phi, solver_options=SolverOptions(use_ta=True))
+    assert ta_is_correct_parallel(phi, ta * 10, get_atoms(phi), n_workers=2)[0]
+    is_correct, err = ta_is_correct_parallel(phi, ta * 10 + [{A, C}], get_atoms(phi), n_workers=2, shard_size=3)
+    assert not is_correct
+    assert err is not None
+    # the pool is terminated at the timeout, which is reached before the workers start
+    with pytest.raises(TimeoutError):
+        check_models(ta * 10, phi, n_workers=2, timeout=0)
@@ -0,0 +1,23 @@
+from pysmt.shortcuts import And, Or, Not, Iff, Implies, Ite
+
+from allsat_cnf.batch_checker import BooleanBatchChecker
+from instances import boolean_atoms
+
+A, B, C, D, *_ = boolean_atoms
+
+
+def test_three_valued_evaluation():
+    phi = And(Or(A, B), Implies(C, D), Ite(A, Iff(B, C), Not(C)))
+    checker = BooleanBatchChecker(phi, chunk_size=8)
+    models = [
+        {A, B, C, D},  # TRUE
+        {Not(A), B, Not(C), Not(D)},  # TRUE
+        {Not(A), Not(B)},  # FALSE
+        {A, C, Not(D)},  # FALSE
+        {A, B},  # unknown
+        {A, Not(B), Not(C)},  # TRUE, even if D is not assigned
+    ] * 3
+    is_true, is_false = checker.evaluate(checker.pack(models))
+    assert list(is_true) == [True, True, False, False, False, True] * 3
+    assert list(is_false) == [False, False, True, True, False, False] * 3
+    assert list(checker.undecided(checker.pack(models))) == [4, 10, 16]
@@ -1,14 +1,15 @@
 from itertools import product
 
 import pytest
-from pysmt.shortcuts import is_sat, get_atoms
+from pysmt.shortcuts import is_sat, get_atoms, And, Or, Not
 
 from allsat_cnf.demorgan_cnfizer import DistributiveCNF
 from allsat_cnf.label_cnfizer import LabelCNFizer
 from allsat_cnf.polarity_cnfizer import PolarityCNFizer
 from allsat_cnf.utils import check_models, get_allsat, SolverOptions, is_cnf
 from instances import bool_identity_examples, bool_single_polarity_examples, bool_double_polarity_examples, \
-    lra_identity_examples, lra_single_polarity_examples, lra_double_polarity_examples
+    lra_identity_examples, lra_single_polarity_examples, lra_double_polarity_examples, boolean_atoms, \
+    bool_sat_constant_examples, bool_unsat_constant_examples
 from utils import get_data_from_examples
 
 
@@ -67,3 +68,78 @@ def test_lra_number_of_clauses_double_polarity(cnfizer, phi, n, n_vars):
     assert is_sat(phi) == is_sat(cnf)
     ta, _ = get_allsat(cnf, atoms=get_atoms(phi), solver_options=SolverOptions(use_ta=True))
     check_models(ta, phi)
+
+
+@pytest.mark.parametrize("cnfizer, phi",
+                         product([PolarityCNFizer(), LabelCNFizer(), PolarityCNFizer(nnf=True, mutex_nnf_labels=True)],
+                                 [e.formula for e in bool_single_polarity_examples + bool_double_polarity_examples]))
+def test_bool_clause_store(cnfizer, phi):
+    store = cnfizer.convert_as_store(phi)
+    assert all(lit != 0 and abs(lit) <= store.n_vars for clause in store for lit in clause)
+    assert set(store.var_map.atoms()) == get_atoms(phi)
+    cnf = store.as_formula()
+    assert is_cnf(cnf)
+    assert len(cnf.args()) == len(store)
+    assert is_sat(phi) == is_sat(cnf)
+
+
+@pytest.mark.parametrize("cnfizer, phi",
+                         product([PolarityCNFizer(), PolarityCNFizer(nnf=True, mutex_nnf_labels=True)],
+                                 [e.formula for e in bool_single_polarity_examples + bool_double_polarity_examples]))
+def test_bool_session(cnfizer, phi):
+    with cnfizer.session() as session:
+        tl, store = session.convert(phi)
+        not_tl, neg_store = session.convert(Not(phi))
+        _, new_store = session.convert(phi)
+    # sub-formulas already encoded are not encoded again
+    assert len(new_store) == 0
+    assert not set(store) & set(neg_store)
+    clauses = And(map(Or, store.as_fnode_clauses() + neg_store.as_fnode_clauses()))
+    for f, lit in [(phi, tl), (Not(phi), not_tl)]:
+        cnf = And(clauses, session.var_map.to_fnode(lit))
+        assert is_sat(f) == is_sat(cnf)
+        ta, _ = get_allsat(cnf, atoms=get_atoms(phi), solver_options=SolverOptions(use_ta=True))
+        check_models(ta, f)
+
+
+@pytest.mark.parametrize("cnfizer, phi",
+                         product([PolarityCNFizer(flatten=True), LabelCNFizer(flatten=True),
+                                  PolarityCNFizer(nnf=True, mutex_nnf_labels=True, flatten=True)],
+                                 [e.formula for e in bool_single_polarity_examples + bool_double_polarity_examples]
+                                 + bool_sat_constant_examples + bool_unsat_constant_examples))
+def test_bool_flatten(cnfizer, phi):
+    store = cnfizer.convert_as_store(phi)
+    assert {a for a in store.var_map.atoms() if not a.is_bool_constant()} == get_atoms(phi)
+    cnf = store.as_formula()
+    assert is_cnf(cnf)
+    assert is_sat(phi) == is_sat(cnf)
+    ta, _ = get_allsat(cnf, atoms=get_atoms(phi), solver_options=SolverOptions(use_ta=True))
+    check_models(ta, phi)
+
+
+@pytest.mark.parametrize("cnfizer, phi",
+                         product([PolarityCNFizer(), LabelCNFizer(), PolarityCNFizer(flatten=True),
+                                  LabelCNFizer(flatten=True)],
+                                 bool_unsat_constant_examples))
+def test_bool_unsat_constants(cnfizer, phi):
+    # a clause made FALSE by the constants is kept as the unit clause of FALSE
+    cnf = cnfizer.convert_as_formula(phi)
+    assert not is_sat(cnf)
+
+
+@pytest.mark.parametrize("cnfizer_class", [PolarityCNFizer, LabelCNFizer])
+def test_bool_flatten_chains(cnfizer_class):
+    A, B, C, D, *_ = boolean_atoms
+    cnfizer = cnfizer_class(flatten=True)
+    assert cnfizer.convert_as_formula(And(A, And(B, And(C, D)))) == cnfizer.convert_as_formula(And(A, B, C, D))
+    assert cnfizer.convert_as_formula(Or(Or(A, B), Or(C, D))) == cnfizer.convert_as_formula(Or(A, B, C, D))
+
+    # a chain of binary gates is encoded by a single label
+    phi = Or(A, And(B, And(C, And(D, A))))
+    assert cnfizer.convert_as_store(phi).n_vars == 6
+    assert cnfizer_class().convert_as_store(phi).n_vars == 8
+
+    # shared sub-formulas keep their own label
+    shared = And(A, B)
+    phi = Or(And(shared, C), And(shared, D))
+    assert cnfizer.convert_as_store(phi).n_vars == cnfizer_class().convert_as_store(phi).n_vars == 8
@@ -0,0 +1,115 @@
+import os
+from itertools import product
+
+import numpy as np
+import pytest
+
+from benchmark import ddnnf as ddnnf_module
+from benchmark.ddnnf import AND, DDNNF_CACHE_EXT, FALSE, OR, TRUE, load_ddnnf
+
+# a decision tree over x1, x2, x3, with a path to FALSE
+DECISION_TREE = """o 1 0
+o 2 0
+t 3 0
+f 4 0
+1 2 1 0
+1 3 -1 -2 0
+1 4 -1 2 0
+2 3 2 0
+2 3 -2 3 0
+"""
+
+# the conjunction of a d-DNNF over x1, x2 and one over x3, x4, x5 sharing a node, with the root not numbered first
+# and the edges not grouped by origin
+DECOMPOSABLE = """a 7 0
+o 2 0
+o 3 0
+t 4 0
+o 5 0
+2 4 1 0
+7 2 0
+3 5 3 0
+5 4 4 0
+2 4 -1 2 0
+7 3 0
+3 5 -3 0
+5 4 -4 -5 0
+"""
+
+ddnnfs = [(DECISION_TREE, 3), (DECISION_TREE, 5), (DECOMPOSABLE, 5), (DECOMPOSABLE, 7), ("t 1 0\n", 2), ("f 1 0\n", 2)]
+
+
+def evaluate(ddnnf, node: int, assignment: dict[int, bool]) -> bool:
+    def edge_is_true(edge: int) -> bool:
+        literals = ddnnf.literals[ddnnf.lit_offsets[edge]:ddnnf.lit_offsets[edge + 1]].tolist()
+        return all(assignment[abs(lit)] == (lit > 0) for lit in literals) and \
+            evaluate(ddnnf, int(ddnnf.edge_to[edge]), assignment)
+
+    edges = range(ddnnf.child_offsets[node], ddnnf.child_offsets[node + 1])
+    node_type = ddnnf.node_types[node]
+    if node_type == TRUE:
+        return True
+    if node_type == FALSE:
+        return False
+    if node_type == OR:
+        return any(edge_is_true(e) for e in edges)
+    assert node_type == AND
+    return all(edge_is_true(e) for e in edges)
+
+
+def write_nnf(tmp_path, nnf: str) -> str:
+    nnf_file = str(tmp_path / "f.nnf")
+    with open(nnf_file, "w") as f:
+        f.write(nnf)
+    return nnf_file
+
+
+@pytest.mark.parametrize("nnf, n_vars", ddnnfs)
+def test_count(tmp_path, nnf, n_vars):
+    ddnnf = load_ddnnf(write_nnf(tmp_path, nnf))
+    count, n_paths = ddnnf.count(n_vars)
+    paths = list(ddnnf.iter_paths())
+    assert n_paths == len(paths)
+    assert count == sum(2 ** (n_vars - len(path)) for path in paths)
+    assert count == sum(evaluate(ddnnf, ddnnf.root, dict(enumerate(values, start=1)))
+                        for values in product([False, True], repeat=n_vars))
+
+
+def test_count_too_few_variables(tmp_path):
+    ddnnf = load_ddnnf(write_nnf(tmp_path, DECOMPOSABLE))
+    with pytest.raises(ValueError):
+        ddnnf.count(4)
+
+
+def test_paths(tmp_path):
+    ddnnf = load_ddnnf(write_nnf(tmp_path, DECISION_TREE))
+    assert ddnnf.root == 1
+    assert sorted(ddnnf.iter_paths()) == sorted([(1, 2), (1, -2, 3), (-1, -2)])
+    assert len(list(load_ddnnf(write_nnf(tmp_path, DECOMPOSABLE)).iter_paths())) == 8
+
+
+def test_project(tmp_path):
+    ddnnf = load_ddnnf(write_nnf(tmp_path, DECOMPOSABLE))
+    projected_ids = {2, 4, 5}
+    new_ids = {2: 1, 4: 2, 5: 3}
+    expected = [tuple((1 if lit > 0 else -1) * new_ids[abs(lit)] for lit in path if abs(lit) in projected_ids)
+                for path in ddnnf.iter_paths()]
+    assert list(ddnnf.project(projected_ids).iter_paths()) == expected
+
+
+def test_cache(tmp_path, monkeypatch):
+    nnf_file = write_nnf(tmp_path, DECOMPOSABLE)
+    ddnnf = load_ddnnf(nnf_file, cache=True)
+    assert os.path.exists(nnf_file + DDNNF_CACHE_EXT)
+    with monkeypatch.context() as m:
+        m.setattr(ddnnf_module, "_parse_nnf", lambda nnf_file: pytest.fail("the NNF file is parsed again"))
+        cached = load_ddnnf(nnf_file, cache=True)
+    for field in ["node_types", "child_offsets", "edge_to", "lit_offsets", "literals"]:
+        assert np.array_equal(getattr(cached, field), getattr(ddnnf, field))
+    assert cached.root == ddnnf.root
+
+    # the cache is discarded once the NNF file changes
+    write_nnf(tmp_path, DECISION_TREE)
+    reloaded = load_ddnnf(nnf_file, cache=True)
+    assert reloaded.root == 1
+    assert sorted(reloaded.iter_paths()) == sorted(load_ddnnf(nnf_file).iter_paths())
@@ -0,0 +1,83 @@
+from io import StringIO
+from itertools import product
+
+import pytest
+from pysmt.shortcuts import And, Or, Not, Iff, Ite, FALSE, TRUE, Bool, get_atoms, substitute
+
+from allsat_cnf.clause_store import VariableMap
+from allsat_cnf.polarity_cnfizer import PolarityCNFizer
+from benchmark.io.dimacs import DimacsWriter, HeaderMode, dimacs_to_pysmt, read_dimacs, write_dimacs
+from instances import boolean_atoms
+
+A, B, C, D, *_ = boolean_atoms
+
+examples = [
+    And(Or(A, B), Or(Not(A), C)),
+    Iff(A, Or(B, Not(C))),
+    Ite(A, And(B, C), Not(D)),
+    Or(And(A, B), FALSE()),
+    And(A, TRUE()),
+    FALSE(),
+]
+
+
+def models(dimacs) -> set[tuple[bool, ...]]:
+    """Returns the total assignments to the variables satisfying the clauses."""
+    clauses = [dimacs.clause(i) for i in range(dimacs.n_clauses)]
+    return {values for values in product([False, True], repeat=dimacs.n_vars)
+            if all(any(values[abs(lit) - 1] == (lit > 0) for lit in clause) for clause in clauses)}
+
+
+@pytest.mark.parametrize("header_mode", HeaderMode)
+def test_writer_round_trip(header_mode):
+    var_map = VariableMap()
+    f = StringIO()
+    writer = DimacsWriter(f, var_map, [A, B, C], header_mode)
+    label = var_map.new_var()
+    clauses = [(1, -2), (label,), (-1, 2, -label), (3, -label)]
+    for clause in clauses:
+        writer.add_clause(clause)
+    writer.close()
+
+    problem_line = f.getvalue().split("\n")[0]
+    assert len(problem_line) == DimacsWriter.HEADER_WIDTH
+    assert problem_line.split() == ["p", "cnf", "4", "4"] + (["3"] if header_mode is HeaderMode.WITH_NUM_PROJECTED_VARS
+                                                             else [])
+    dimacs = read_dimacs(StringIO(f.getvalue()))
+    assert (dimacs.n_vars, dimacs.n_clauses) == (writer.n_vars, writer.n_clauses)
+    assert dimacs.projected_ids == [1, 2, 3]
+    assert [dimacs.clause(i) for i in range(dimacs.n_clauses)] == clauses
+
+
+@pytest.mark.parametrize("header_mode", HeaderMode)
+@pytest.mark.parametrize("phi", examples)
+def test_write_dimacs_round_trip(header_mode, phi):
+    atoms = get_atoms(phi) | {A}
+    f = StringIO()
+    info = write_dimacs(f, phi, atoms, PolarityCNFizer(), header_mode)
+    dimacs = read_dimacs(StringIO(f.getvalue()))
+    assert (dimacs.n_vars, dimacs.n_clauses) == (info.n_vars, info.n_clauses)
+    # the projected variables are numbered first, in order of their names
+    sorted_atoms = sorted(atoms, key=str)
+    assert dimacs.projected_ids == list(range(1, len(atoms) + 1))
+    assert [info.var_map[atom] for atom in sorted_atoms] == dimacs.projected_ids
+
+    expected_models = {values for values in product([False, True], repeat=len(atoms))
+                       if substitute(phi, dict(zip(sorted_atoms, map(Bool, values)))).simplify().is_true()}
+    dimacs_models = models(dimacs)
+    assert {tuple(values[var - 1] for var in dimacs.projected_ids) for values in dimacs_models} == expected_models
+
+    cnf, projected_symbols, symbols = dimacs_to_pysmt(StringIO(f.getvalue()))
+    assert projected_symbols == {symbols[i] for i in dimacs.projected_ids}
+    for values in product([False, True], repeat=dimacs.n_vars):
+        cnf_value = substitute(cnf, {symbols[i]: Bool(v) for i, v in enumerate(values, start=1)}).simplify()
+        assert cnf_value.is_true() == (values in dimacs_models)
+
+
+def test_malformed():
+    with pytest.raises(ValueError):
+        read_dimacs(StringIO("p cnf 2 2\n1 -2 0\n"))
+    with pytest.raises(ValueError):
+        read_dimacs(StringIO("p cnf 2 1\n1 -3 0\n"))
+    with pytest.raises(ValueError):
+        read_dimacs(StringIO("p cnf 2 1\n1 -2\n"))
@@ -0,0 +1,31 @@
+from pysmt.shortcuts import Not
+
+from allsat_cnf.packed_models import PackedModels
+from instances import boolean_atoms
+
+A, B, C, D, *_ = boolean_atoms
+
+
+def test_packed_models():
+    atoms = [A, B, C, D]
+    models = [{A, Not(B)}, {Not(A), C, D}, {Not(A), Not(C)}]
+    packed = PackedModels.from_models(atoms, models)
+    assert len(packed) == 3
+    assert list(packed) == models
+    assert list(packed.n_free()) == [2, 1, 2]
+    assert packed.count() == 4 + 2 + 4
+    assert packed.weights().sum() == packed.count()
+
+    assert packed.covers({A, Not(B), C, Not(D)})
+    assert not packed.covers({Not(A), C, Not(D)})
+    assert list(packed.subsets_of(*packed.pack({Not(A), Not(B), Not(C), D}))) == [False, False, True]
+    assert list(packed.supersets_of(*packed.pack({Not(A)}))) == [False, True, True]
+
+
+def test_disjoint_models():
+    atoms = [A, B, C, D]
+    assert PackedModels.from_models(atoms, [{A, Not(B)}, {Not(A), C, D}, {Not(A), Not(C)}, {A, B}]).are_disjoint()
+    assert PackedModels.from_models(atoms, [{A}, {Not(A), B}, {Not(A), Not(B), C}]).are_disjoint()
+    # {A, C} and {B, Not(D)} are both extended by {A, B, C, Not(D)}
+    assert not PackedModels.from_models(atoms, [{A, C}, {Not(A), Not(B)}, {B, Not(D)}]).are_disjoint()
+    assert not PackedModels.from_models(atoms, [{A, Not(B)}, {A, Not(B), C}]).are_disjoint()
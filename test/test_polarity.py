@@ -0,0 +1,37 @@
+from pysmt.shortcuts import And, Or, Not, Iff, Implies, Ite
+
+from allsat_cnf.polarity_finder import PolarityFinder
+from allsat_cnf.polarity_walker import Polarity
+from instances import boolean_atoms
+
+A, B, C, D, *_ = boolean_atoms
+
+
+def test_polarity_single():
+    phi = Or(And(A, B), Not(Implies(C, D)))
+    polarities = PolarityFinder().find(phi)
+    assert polarities[phi] == Polarity.POS
+    assert polarities[And(A, B)] == Polarity.POS
+    assert polarities[Implies(C, D)] == Polarity.NEG
+    assert polarities[C] == Polarity.POS
+    assert polarities[D] == Polarity.NEG
+
+
+def test_polarity_shared_sub_formula():
+    shared = And(A, Or(B, C))
+    phi = And(Or(shared, D), Or(Not(shared), Not(D)), Iff(B, D))
+    polarities = PolarityFinder().find(phi)
+    assert polarities[shared] == Polarity.DOUBLE
+    assert polarities[Or(B, C)] == Polarity.DOUBLE
+    assert polarities[A] == Polarity.DOUBLE
+    assert polarities[B] == Polarity.DOUBLE
+    assert polarities[Iff(B, D)] == Polarity.POS
+
+
+def test_polarity_ite():
+    phi = Not(Ite(A, And(B, C), Or(C, D)))
+    polarities = PolarityFinder().find(phi)
+    assert polarities[A] == Polarity.DOUBLE
+    assert polarities[And(B, C)] == Polarity.NEG
+    assert polarities[Or(C, D)] == Polarity.NEG
+    assert polarities[D] == Polarity.NEG
@@ -0,0 +1,70 @@
+import pytest
+from pysmt.shortcuts import And, Or, Not, Iff, Implies, Ite, TRUE, FALSE, is_valid, LE, Real, Symbol, REAL
+
+from allsat_cnf.label_cnfizer import LabelCNFizer
+from allsat_cnf.polarity_cnfizer import PolarityCNFizer
+from allsat_cnf.structural_hasher import StructuralHasher
+from instances import boolean_atoms
+
+A, B, C, D, *_ = boolean_atoms
+x = Symbol("x", REAL)
+
+examples = [
+    And(Or(A, B), Or(B, A)),
+    Or(And(A, And(B, C)), And(And(C, B), A)),
+    And(A, TRUE(), Or(B, FALSE())),
+    Or(A, Not(A), B),
+    And(A, Not(A)),
+    Iff(Not(A), Not(B)),
+    Iff(Not(A), B),
+    Iff(A, Not(A)),
+    Implies(And(A, B), Or(C, D)),
+    Ite(Not(A), B, C),
+    Ite(A, TRUE(), B),
+    Ite(A, B, FALSE()),
+    And(Or(A, LE(x, Real(1))), Or(LE(x, Real(1)), A)),
+]
+
+
+@pytest.mark.parametrize("phi", examples)
+def test_equivalent(phi):
+    normalized = StructuralHasher().convert(phi)
+    assert is_valid(Iff(phi, normalized))
+    assert normalized.get_atoms() <= phi.get_atoms()
+
+
+def test_argument_order():
+    hasher = StructuralHasher()
+    assert hasher.convert(And(A, B)) is hasher.convert(And(B, A))
+    assert hasher.convert(Or(A, Or(B, C))) is hasher.convert(Or(Or(C, A), B))
+    assert hasher.convert(Iff(Not(A), Not(B))) is hasher.convert(Iff(B, A))
+
+
+def test_constants():
+    hasher = StructuralHasher()
+    assert hasher.convert(And(A, TRUE(), Or(B, FALSE()))) is hasher.convert(And(A, B))
+    assert hasher.convert(Or(A, Not(A), B)).is_true()
+    assert hasher.convert(And(Or(A, B), Iff(C, Not(C)))).is_false()
+
+
+def test_shared_sub_formula_not_flattened():
+    shared = And(A, B)
+    phi = Or(And(shared, C), And(shared, D))
+    normalized = StructuralHasher().convert(phi)
+    assert all(shared in arg.args() for arg in normalized.args())
+
+
+@pytest.mark.parametrize("cnfizer_class", [PolarityCNFizer, LabelCNFizer])
+def test_fewer_labels_and_clauses(cnfizer_class):
+    phi = And(Or(A, And(B, C)), Or(And(C, B), A), Or(D, FALSE()))
+    store = cnfizer_class().convert_as_store(phi)
+    strash_store = cnfizer_class(strash=True).convert_as_store(phi)
+    assert strash_store.n_vars < store.n_vars
+    assert len(strash_store) < len(store)
+
+
+def test_removed_atoms_kept():
+    phi = And(A, Or(B, Not(B)))
+    store = PolarityCNFizer(strash=True).convert_as_store(phi)
+    assert set(store.var_map.atoms()) == {A, B}
+    assert store.as_formula() == A